@@ -0,0 +1,160 @@
+"""
+Measures the per-document cost of decoding scraped articles into dicts versus handing them out as
+RawBSONDocuments (database.MongoDBClient.enable_raw_documents), for the access patterns of the processors.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_decode --docs 5000 --comments 0 10 --out bench_decode.json
+
+Decoding is measured on BSON encoded in process, so no server is needed. With --mongo-uri the same corpus
+is also read back from a disposable collection on a local mongod with both document classes.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from benchmarks.bench_the_waiter import git_commit
+from benchmarks.synthetic import generate_corpus
+
+
+def read_skipped(raw: bytes) -> Any:
+    # A document the caller skips after looking at its _id
+    return RawBSONDocument(raw)['_id']
+
+
+def read_prediction_fields(raw: bytes) -> Any:
+    # What HelakuruScraperProcessor.predict_doc reads
+    doc = RawBSONDocument(raw)
+    return doc.get('newsContentEn') or doc.get('newsTitleEn'), [c.get('commentText') for c in doc.get('top_comments', [])]
+
+
+def read_image_fields(raw: bytes) -> Any:
+    # What imageDownloader.py reads before deciding whether to download
+    doc = RawBSONDocument(raw)
+    return doc.get('postId'), [img.get('url') for img in doc.get('imgContent', [])]
+
+
+DECODERS: Dict[str, Callable[[bytes], Any]] = {
+    'dict_full': bson.decode,
+    'raw_untouched': RawBSONDocument,
+    'raw_skip': read_skipped,
+    'raw_prediction_fields': read_prediction_fields,
+    'raw_image_fields': read_image_fields,
+    'raw_to_dict': lambda raw: dict(RawBSONDocument(raw)),
+}
+
+
+def encode_corpus(n_docs: int, comments_per_doc: int, seed: int) -> List[bytes]:
+    corpus = generate_corpus(n_docs, comments_per_doc, seed=seed, predicted=False)
+    for index, doc in enumerate(corpus):
+        doc['_id'] = bson.ObjectId()
+        doc['postId'] = str(index)
+        doc['imgContent'] = [{'url': f'/photo/{index}/{i}', 'downloaded': False} for i in range(3)]
+    return [bson.encode(doc) for doc in corpus]
+
+
+def time_decoder(decode: Callable[[bytes], Any], encoded: List[bytes], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for raw in encoded:
+            decode(raw)
+        timings.append(time.perf_counter() - started)
+
+    # Memory of holding the whole batch in decoded form, as a list(cursor) would
+    tracemalloc.start()
+    held = [bson.decode(raw) for raw in encoded] if decode is bson.decode else [RawBSONDocument(raw) for raw in encoded]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+
+    seconds = statistics.median(timings)
+    return {
+        'seconds_median': seconds,
+        'us_per_doc': seconds / len(encoded) * 1e6,
+        'held_mb': current / 2 ** 20,
+    }
+
+
+def time_mongo_reads(mongo_uri: str, encoded: List[bytes], repeat: int) -> Dict[str, Dict[str, float]]:
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_uri)
+    db = client[f'bench_decode_{os.getpid()}']
+    try:
+        db.docs.insert_many([RawBSONDocument(raw) for raw in encoded])
+        results = {}
+        for name, document_class in (('mongo_dict', dict), ('mongo_raw', RawBSONDocument)):
+            collection = db.docs.with_options(codec_options=CodecOptions(document_class=document_class))
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                for doc in collection.find():
+                    doc['_id']
+                timings.append(time.perf_counter() - started)
+            seconds = statistics.median(timings)
+            results[name] = {'seconds_median': seconds, 'us_per_doc': seconds / len(encoded) * 1e6}
+        return results
+    finally:
+        client.drop_database(db.name)
+        client.close()
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    results = []
+    for comments_per_doc in args.comments:
+        encoded = encode_corpus(args.docs, comments_per_doc, args.seed)
+        entry: Dict[str, Any] = {
+            'docs': args.docs,
+            'comments_per_doc': comments_per_doc,
+            'bytes_per_doc': sum(len(raw) for raw in encoded) / len(encoded),
+            'decoders': {name: time_decoder(decode, encoded, args.repeat) for name, decode in DECODERS.items()},
+        }
+        if args.mongo_uri:
+            entry['decoders'].update(time_mongo_reads(args.mongo_uri, encoded, args.repeat))
+        results.append(entry)
+
+        print(f"comments/doc={comments_per_doc:<4} {entry['bytes_per_doc']:9.0f} bytes/doc")
+        for name, measured in entry['decoders'].items():
+            print(f"  {name:22} {measured['us_per_doc']:9.2f} us/doc")
+
+    return {
+        'benchmark': 'decode',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'bson_c_extension': bson.has_c(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(description="Per-document BSON decode cost: dicts vs RawBSONDocument")
+    arg_parser.add_argument("--docs", type=int, default=5000)
+    arg_parser.add_argument("--comments", type=int, nargs="+", default=[0, 10], help="Top comments per document")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--mongo-uri", default=None, help="Also time cursor reads from a local mongod")
+    arg_parser.add_argument("--out", default="bench_decode.json")
+    return arg_parser
+
+
+if __name__ == '__main__':
+    cli_args = build_parser().parse_args()
+    report = run_benchmark(cli_args)
+    with open(cli_args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {cli_args.out}")
@@ -0,0 +1,321 @@
+"""
+End-to-end benchmark of HelakuruScraperProcessor.process (unpredicted -> predicted -> weighted) without
+live services: Mongo is replaced by mongomock (or a disposable database on a local mongod given with
+--mongo-uri), Lingva by a fake translator, and the_poli / the_candi by tiny randomly initialized BERTs.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_pipeline --docs 500 --comments 5 --out bench_pipeline.json
+
+The report breaks the wall time down per stage (Mongo reads/writes, translation, the_poli, the_candi,
+sentiment, the_waiter), gives docs/s for the whole flow and the BSON size of the prediction updates.
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertModel, BertTokenizer, BertTokenizerFast
+
+from benchmarks.bench_the_waiter import git_commit
+from benchmarks.synthetic import CANDIDATES, WORDS, generate_corpus
+from database import MongoDBClient
+from prediction import hela_processor
+from prediction.hela_processor import HelakuruScraperProcessor, update_sizes
+from prediction.the_poli import CLASS_NAMES, MAX_LEN, RadicalizedClassifier, politicalIncClassifier
+from prediction.translator import TextTranslator
+
+COLLECTION_NAME = 'news_articles'
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - started
+                self.calls[stage] += 1
+        return timed
+
+    def wrap_iter(self, stage: str, iterable: Iterable) -> Iterator:
+        # Times cursor advancement, i.e. the Mongo round trips and BSON decoding
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.seconds[stage] += time.perf_counter() - started
+                return
+            self.seconds[stage] += time.perf_counter() - started
+            self.calls[stage] += 1
+            yield item
+
+
+class FakeTranslator:
+    """
+    Stand-in for TextTranslator that returns the URL-stripped text, optionally after a fixed delay.
+    """
+
+    def __init__(self, latency_ms: float = 0.0) -> None:
+        self.latency = latency_ms / 1000
+
+    def translate_text(self, text: str, source_lang: str = 'auto', target_lang: str = 'en') -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return TextTranslator.remove_urls(text)
+
+
+class RatedPoliticalPredictor:
+    """
+    Runs the_poli for its cost but decides the label from a hash of the text, so a randomly initialized
+    model still sends the requested share of documents through the candidate/sentiment/weighting stages.
+    """
+
+    def __init__(self, predictor: politicalIncClassifier, political_rate: float) -> None:
+        self.predictor = predictor
+        self.political_rate = political_rate
+
+    def predict(self, text: str) -> str:
+        self.predictor.predict(text)
+        if zlib.crc32(text.encode('utf-8')) % 1000 < self.political_rate * 1000:
+            return 'political'
+        return 'non-political'
+
+
+def write_vocab(path: str) -> None:
+    letters = 'abcdefghijklmnopqrstuvwxyz0123456789'
+    tokens = SPECIAL_TOKENS + WORDS + list(letters + '.,!?') + [f'##{c}' for c in letters]
+    with open(path, 'w') as f:
+        f.write('\n'.join(dict.fromkeys(tokens)) + '\n')
+
+
+def tiny_config(vocab_size: int, num_labels: int = 2) -> BertConfig:
+    return BertConfig(
+        vocab_size=vocab_size,
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=MAX_LEN,
+        num_labels=num_labels,
+    )
+
+
+def build_tiny_models(workdir: str, seed: int) -> Dict[str, Any]:
+    """
+    Builds a tiny the_poli classifier in memory and saves a tiny the_candi checkpoint in the
+    <dir>/tokenizer, <dir>/model layout CandidatePredictor loads from.
+    """
+    torch.manual_seed(seed)
+    vocab_path = os.path.join(workdir, 'vocab.txt')
+    write_vocab(vocab_path)
+    with open(vocab_path) as f:
+        vocab_size = sum(1 for _ in f)
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    the_poli_model = RadicalizedClassifier(n_classes=len(CLASS_NAMES), bert_model=BertModel(tiny_config(vocab_size)))
+    the_poli_model.to(device)
+    the_poli_predictor = politicalIncClassifier(
+        model=the_poli_model,
+        tokenizer=BertTokenizer(vocab_file=vocab_path),
+        device=device,
+        max_len=MAX_LEN,
+        class_names=CLASS_NAMES,
+    )
+
+    the_candi_dir = os.path.join(workdir, 'the_candi')
+    BertTokenizerFast(vocab_file=vocab_path).save_pretrained(os.path.join(the_candi_dir, 'tokenizer'))
+    BertForSequenceClassification(tiny_config(vocab_size, num_labels=len(CANDIDATES))).save_pretrained(
+        os.path.join(the_candi_dir, 'model')
+    )
+
+    return {
+        'the_poli_predictor': the_poli_predictor,
+        'the_candi_dir': the_candi_dir,
+        'label_dict': dict(enumerate(CANDIDATES)),
+    }
+
+
+def open_db_client(mongo_uri: str) -> MongoDBClient:
+    if mongo_uri:
+        # Disposable database on a local mongod, dropped when the benchmark ends
+        return MongoDBClient(uri=mongo_uri, db_name=f'bench_pipeline_{os.getpid()}', collection_name=COLLECTION_NAME)
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("Install mongomock or pass --mongo-uri of a local mongod")
+    return MongoDBClient(uri=None, db_name='bench_pipeline', collection_name=COLLECTION_NAME,
+                         client=mongomock.MongoClient(tz_aware=True))
+
+
+def record_updates(processor: HelakuruScraperProcessor, updates: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+    # Keeps (document, update) pairs of the prediction pass; their sizes are computed after the timed run
+    predict_doc = processor.predict_doc
+
+    def recorded(doc: Dict[str, Any]) -> Dict[str, Any]:
+        update_fields = predict_doc(doc)
+        updates.append((doc, update_fields))
+        return update_fields
+
+    processor.predict_doc = recorded
+
+
+def instrument(processor: HelakuruScraperProcessor, db_client: MongoDBClient, timer: StageTimer) -> List[Callable]:
+    """
+    Wraps every stage of the processor with the timer. Returns callables that undo the module-level patches.
+    """
+    processor.political_predictor.predict = timer.wrap('the_poli', processor.political_predictor.predict)
+    processor.candidate_predictor.predict = timer.wrap('the_candi', processor.candidate_predictor.predict)
+    processor.the_trans.translate_text = timer.wrap('translate', processor.the_trans.translate_text)
+    db_client.update_doc = timer.wrap('mongo_write', db_client.update_doc)
+    db_client.flush = timer.wrap('mongo_write', db_client.flush)
+
+    for finder in ('find_unpredicted_texts_docs', 'find_unweighted_text_docs'):
+        original_finder = getattr(db_client, finder)
+        setattr(db_client, finder, functools.partial(
+            lambda find, *args, **kwargs: timer.wrap_iter('mongo_read', find(*args, **kwargs)), original_finder
+        ))
+
+    restore = []
+    for name, stage in (('calculate_sentiment_score', 'sentiment'), ('process_post', 'the_waiter'),
+                        ('decompose_post', 'the_waiter')):
+        original = getattr(hela_processor, name)
+        setattr(hela_processor, name, timer.wrap(stage, original))
+        restore.append(functools.partial(setattr, hela_processor, name, original))
+    return restore
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    db_client = open_db_client(args.mongo_uri)
+    corpus = generate_corpus(args.docs, args.comments, seed=args.seed, predicted=False,
+                             content_words=args.content_words)
+    db_client.collection.insert_many(corpus)
+    if args.bulk:
+        db_client.enable_bulk_writes()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        models = build_tiny_models(workdir, args.seed)
+
+        setup_started = time.perf_counter()
+        processor = HelakuruScraperProcessor(
+            db_client=db_client,
+            political_predictor=RatedPoliticalPredictor(models['the_poli_predictor'], args.political_rate),
+            the_candi_dir=models['the_candi_dir'],
+            label_dict=models['label_dict'],
+            tr_url='http://localhost:0',
+        )
+        processor.the_trans = FakeTranslator(args.translate_latency_ms)
+        setup_seconds = time.perf_counter() - setup_started
+
+        timer = StageTimer()
+        updates: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        record_updates(processor, updates)
+        restore = instrument(processor, db_client, timer)
+        try:
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                processor.process()
+            wall = time.perf_counter() - started
+        finally:
+            for undo in restore:
+                undo()
+
+    if db_client.writer is not None:
+        db_client.writer.close()
+
+    predicted = db_client.collection.count_documents({"predictedAt": {"$exists": True}})
+    weighted = db_client.collection.count_documents({"pt_the_waiter": {"$exists": True}})
+    if args.mongo_uri:
+        db_client.client.drop_database(db_client.db.name)
+
+    update_bytes = [update_sizes(doc, update_fields) for doc, update_fields in updates]
+    staged = sum(timer.seconds.values())
+    stages = {
+        stage: {
+            'seconds': seconds,
+            'calls': timer.calls[stage],
+            'share': seconds / wall if wall else None,
+        }
+        for stage, seconds in sorted(timer.seconds.items(), key=lambda kv: -kv[1])
+    }
+    stages['other'] = {'seconds': wall - staged, 'calls': None, 'share': (wall - staged) / wall if wall else None}
+
+    return {
+        'benchmark': 'pipeline',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'torch': torch.__version__,
+        'device': str(models['the_poli_predictor'].device),
+        'mongo': 'mongod' if args.mongo_uri else 'mongomock',
+        'config': {
+            'docs': args.docs,
+            'comments_per_doc': args.comments,
+            'content_words': args.content_words,
+            'political_rate': args.political_rate,
+            'translate_latency_ms': args.translate_latency_ms,
+            'bulk_writes': args.bulk,
+            'seed': args.seed,
+        },
+        'setup_seconds': setup_seconds,
+        'wall_seconds': wall,
+        'docs_per_s': args.docs / wall if wall else None,
+        'predicted_docs': predicted,
+        'weighted_docs': weighted,
+        'stages': stages,
+        # Prediction updates: positional top_comments.N.field paths vs rewriting the whole array
+        'update_bytes_per_doc': {
+            'delta': sum(delta for delta, _ in update_bytes) / len(update_bytes) if update_bytes else None,
+            'whole_array': sum(full for _, full in update_bytes) / len(update_bytes) if update_bytes else None,
+        },
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(description="End-to-end benchmark of the Helakuru processing pipeline")
+    arg_parser.add_argument("--docs", type=int, default=200)
+    arg_parser.add_argument("--comments", type=int, default=5, help="Top comments per document")
+    arg_parser.add_argument("--content-words", type=int, default=250)
+    arg_parser.add_argument("--political-rate", type=float, default=0.5)
+    arg_parser.add_argument("--translate-latency-ms", type=float, default=0.0)
+    arg_parser.add_argument("--bulk", action="store_true", help="Buffer updates through BulkWriter")
+    arg_parser.add_argument("--mongo-uri", default=None, help="Local mongod to use instead of mongomock")
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--out", default="bench_pipeline.json")
+    return arg_parser
+
+
+if __name__ == '__main__':
+    cli_args = build_parser().parse_args()
+    report = run_benchmark(cli_args)
+
+    print(f"{report['docs_per_s']:.1f} docs/s over {cli_args.docs} docs ({report['wall_seconds']:.2f}s)")
+    for stage_name, stage in report['stages'].items():
+        print(f"  {stage_name:12} {stage['seconds']:9.3f}s {100 * (stage['share'] or 0):6.1f}%")
+    if report['update_bytes_per_doc']['delta'] is not None:
+        print(f"Prediction update: {report['update_bytes_per_doc']['delta']:.0f} bytes/doc "
+              f"(whole top_comments array: {report['update_bytes_per_doc']['whole_array']:.0f})")
+
+    with open(cli_args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {cli_args.out}")
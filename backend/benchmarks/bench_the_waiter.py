@@ -0,0 +1,307 @@
+"""
+Benchmarks prediction/the_waiter.py, its streaming and multi-profile variants, and the archived
+analyzers in archive/the_waiter_v1.py ... v5.py on seeded synthetic corpora.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_the_waiter --posts 1000 10000 --comments 0 5 20 --out bench_the_waiter.json
+
+For every implementation and corpus size it records the median wall time, posts/s and comments/s,
+the peak Python heap of the calling process (tracemalloc; pool workers are not included), and how far
+its normalized standings are from the live the_waiter.
+"""
+import argparse
+import ast
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from benchmarks.synthetic import CANDIDATES, generate_corpus
+from prediction import the_waiter
+from prediction.profiles import DEFAULT_PROFILE, default_profile, evaluate_profiles
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'archive')
+
+
+def load_archive_module(version: str) -> Any:
+    path = os.path.join(ARCHIVE_DIR, f'the_waiter_{version}.py')
+    spec = importlib.util.spec_from_file_location(f'archive_the_waiter_{version}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _iso(date_str: str) -> str:
+    # v2 and v3 only accept '%Y-%m-%dT%H:%M:%SZ'
+    return the_waiter.parse_datetime(date_str).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def to_legacy_shape(post: Dict[str, Any]) -> Dict[str, Any]:
+    # Field names used by the_waiter_v2 and v3
+    return {
+        'reactions_count': post.get('reactions', {}),
+        'comment_count': post.get('commentCount', 0),
+        'share_count': post.get('sharesCount', 0),
+        'published_at': _iso(post.get('publishedAt')),
+        'candidate_scores': post.get('pt_the_candi', {}),
+        'sentiment_score': post.get('pt_the_senti', {}).get('sentiment_score', 0),
+        'top_comments': [
+            {
+                'reactions_count': comment.get('commentReaction', {}),
+                'reply_count': comment.get('commentReplyCount', 0),
+                'published_at': _iso(comment.get('publishedAt')),
+                'candidate_scores': comment.get('pt_the_candi', {}),
+                'sentiment_score': comment.get('pt_the_senti', {}).get('sentiment_score', 0),
+            }
+            for comment in post.get('top_comments', [])
+        ],
+    }
+
+
+def to_v4_shape(post: Dict[str, Any], reactions_field: str) -> Dict[str, Any]:
+    # v4 and v5 read post fields by their Esana names but comment reactions/replies by older names
+    adapted = dict(post)
+    adapted['top_comments'] = [
+        {
+            **comment,
+            reactions_field: comment.get('commentReaction', {}),
+            'reply_count': comment.get('commentReplyCount', 0),
+        }
+        for comment in post.get('top_comments', [])
+    ]
+    return adapted
+
+
+def _sum_weights(per_post: List[Dict[str, float]]) -> Dict[str, float]:
+    totals = defaultdict(float)
+    for weights in per_post:
+        for candidate, weight in weights.items():
+            totals[candidate] += weight
+    return totals
+
+
+def make_archive_runners() -> Dict[str, Any]:
+    """
+    Wraps every archived analyzer as corpus -> total candidate weights. Input adaptation happens
+    outside the timed call so only the analyzer itself is measured.
+    """
+    runners: Dict[str, Any] = {}
+    scraped_at = datetime.now(timezone.utc).isoformat()
+
+    v1 = load_archive_module('v1')
+
+    def run_v1(posts: List[Dict[str, Any]]) -> Dict[str, float]:
+        # v1 scores posts only, without comments
+        return _sum_weights(
+            v1.calculate_candidate_scores(
+                v1.calculate_post_engagement_score(
+                    post.get('reactions', {}), post.get('commentCount'), post.get('sharesCount'),
+                    post['publishedAt'], scraped_at,
+                ),
+                post.get('pt_the_candi', {}),
+                post.get('pt_the_senti', {}).get('sentiment_score', 0),
+            )
+            for post in posts
+        )
+
+    runners['archive_v1'] = (run_v1, lambda posts: posts)
+
+    # v2 is a script: run its module body with the sample `posts` assignment removed
+    v2_path = os.path.join(ARCHIVE_DIR, 'the_waiter_v2.py')
+    with open(v2_path) as f:
+        v2_tree = ast.parse(f.read(), filename=v2_path)
+    v2_tree.body = [
+        node for node in v2_tree.body
+        if not (isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'posts' for t in node.targets))
+    ]
+    v2_code = compile(v2_tree, v2_path, 'exec')
+
+    def run_v2(posts: List[Dict[str, Any]]) -> Dict[str, float]:
+        namespace = {'__name__': 'archive_the_waiter_v2', 'posts': posts}
+        with contextlib.redirect_stdout(io.StringIO()):
+            exec(v2_code, namespace)
+        return namespace['total_candidate_weights']
+
+    runners['archive_v2'] = (run_v2, lambda posts: [to_legacy_shape(post) for post in posts])
+
+    v3 = load_archive_module('v3')
+    runners['archive_v3'] = (
+        lambda posts: v3.EngagementAnalyzer(posts).analyze()[0],
+        lambda posts: [to_legacy_shape(post) for post in posts],
+    )
+
+    # v4 and v5 analyze a single post at a time
+    v4 = load_archive_module('v4')
+    runners['archive_v4'] = (
+        lambda posts: _sum_weights(v4.EngagementAnalyzer(post).analyze()[0] for post in posts),
+        lambda posts: [to_v4_shape(post, 'reactions_count') for post in posts],
+    )
+
+    v5 = load_archive_module('v5')
+    runners['archive_v5'] = (
+        lambda posts: _sum_weights(v5.EngagementAnalyzer(post).analyze()[0] for post in posts),
+        lambda posts: [to_v4_shape(post, 'reactions') for post in posts],
+    )
+    return runners
+
+
+def make_live_runners(processes: int) -> Dict[str, Any]:
+    profiles = {DEFAULT_PROFILE: default_profile()}
+    return {
+        'the_waiter_serial': (lambda posts: the_waiter.aggregate_chunk(posts)[0], None),
+        'the_waiter_pool': (lambda posts: the_waiter.analyze_posts(posts)[0], None),
+        'the_waiter_stream': (
+            lambda posts: the_waiter.aggregate_stream(iter(posts), processes=processes)[0], None
+        ),
+        'the_waiter_profiles': (
+            lambda posts: evaluate_profiles(
+                iter(posts), profiles, as_of=the_waiter.CURRENT_TIME
+            )[DEFAULT_PROFILE]['total_candidate_weights'],
+            None,
+        ),
+    }
+
+
+def _ranks(values: List[float]) -> List[int]:
+    order = sorted(range(len(values)), key=lambda i: values[i], reverse=True)
+    ranks = [0] * len(values)
+    for rank, i in enumerate(order):
+        ranks[i] = rank
+    return ranks
+
+
+def agreement(reference: Dict[str, float], weights: Dict[str, float]) -> Dict[str, Any]:
+    """
+    Compares standings on the live normalization (share of the signed sum) so different formulas are comparable.
+    """
+    ref_shares = the_waiter.normalize_candidate_weights({c: float(reference.get(c, 0)) for c in CANDIDATES})
+    shares = the_waiter.normalize_candidate_weights({c: float(weights.get(c, 0)) for c in CANDIDATES})
+    ref_ranks = _ranks([ref_shares[c] for c in CANDIDATES])
+    ranks = _ranks([shares[c] for c in CANDIDATES])
+    n = len(CANDIDATES)
+    spearman = 1 - 6 * sum((a - b) ** 2 for a, b in zip(ref_ranks, ranks)) / (n * (n ** 2 - 1))
+    return {
+        'max_share_diff_pp': max(abs(ref_shares[c] - shares[c]) for c in CANDIDATES),
+        'leader_agrees': ref_ranks.index(0) == ranks.index(0),
+        'rank_spearman': spearman,
+        'shares': shares,
+    }
+
+
+def measure(run: Callable, posts: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run(posts)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    run(posts)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds_median': statistics.median(timings),
+        'seconds_min': min(timings),
+        'peak_mb': peak / 2 ** 20,
+        'result': result,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    runners = make_live_runners(args.processes)
+    if not args.skip_archive:
+        runners.update(make_archive_runners())
+    if args.only:
+        runners = {name: runner for name, runner in runners.items() if name in args.only}
+
+    results = []
+    for n_posts in args.posts:
+        for comments_per_post in args.comments:
+            corpus = generate_corpus(n_posts, comments_per_post, seed=args.seed)
+            reference = the_waiter.aggregate_chunk(corpus)[0]
+            n_comments = n_posts * comments_per_post
+
+            for name, (run, adapt) in runners.items():
+                posts = adapt(corpus) if adapt else corpus
+                try:
+                    measured = measure(run, posts, args.repeat)
+                except Exception as e:  # archived analyzers break on some inputs; record it and go on
+                    results.append({
+                        'implementation': name, 'posts': n_posts, 'comments_per_post': comments_per_post,
+                        'error': f'{type(e).__name__}: {e}',
+                    })
+                    print(f"{name:22} posts={n_posts:<8} comments/post={comments_per_post:<4} failed: {e}")
+                    continue
+
+                seconds = measured['seconds_median']
+                entry = {
+                    'implementation': name,
+                    'posts': n_posts,
+                    'comments_per_post': comments_per_post,
+                    'seconds_median': seconds,
+                    'seconds_min': measured['seconds_min'],
+                    'posts_per_s': n_posts / seconds if seconds else None,
+                    'comments_per_s': n_comments / seconds if seconds else None,
+                    'peak_mb': measured['peak_mb'],
+                    'agreement': agreement(reference, measured['result']),
+                }
+                results.append(entry)
+                print(
+                    f"{name:22} posts={n_posts:<8} comments/post={comments_per_post:<4} "
+                    f"{seconds:9.4f}s {entry['posts_per_s']:12.1f} posts/s {entry['peak_mb']:8.1f} MB "
+                    f"max diff {entry['agreement']['max_share_diff_pp']:.3g} pp"
+                )
+
+    return {
+        'benchmark': 'the_waiter',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(description="Benchmark the_waiter against the archived analyzers")
+    arg_parser.add_argument("--posts", type=int, nargs="+", default=[1000, 10000])
+    arg_parser.add_argument("--comments", type=int, nargs="+", default=[0, 5, 20], help="Top comments per post")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--processes", type=int, default=None, help="Workers for the streaming aggregator")
+    arg_parser.add_argument("--only", nargs="+", default=None, help="Implementations to run")
+    arg_parser.add_argument("--skip-archive", action="store_true")
+    arg_parser.add_argument("--out", default="bench_the_waiter.json")
+    return arg_parser
+
+
+if __name__ == '__main__':
+    cli_args = build_parser().parse_args()
+    report = run_benchmarks(cli_args)
+    with open(cli_args.out, 'w') as f:
+        json.dump(report, f, indent=2, default=float)
+    print(f"Report written to {cli_args.out}")
@@ -0,0 +1,116 @@
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+CANDIDATES = ['anura', 'sajith', 'ranil', 'other', 'no_one']
+REACTION_KEYS = ['like', 'love', 'haha', 'wow', 'sad', 'angry']
+
+# Esana publishes dates like 'Fri, 20 Sep 2024 12:58:32 GMT+0000'
+PUBLISHED_FORMAT = '%a, %d %b %Y %H:%M:%S GMT+0000'
+# Fixed, so a corpus is the same from run to run: the 60 days up to the 21 September 2024 election
+DEFAULT_START = datetime(2024, 7, 23, tzinfo=timezone.utc)
+
+WORDS = [
+    'election', 'president', 'parliament', 'economy', 'tax', 'fuel', 'price', 'rally', 'vote', 'policy',
+    'anura', 'sajith', 'ranil', 'colombo', 'kandy', 'galle', 'minister', 'debt', 'imf', 'budget',
+    'manifesto', 'campaign', 'support', 'corruption', 'reform', 'youth', 'farmers', 'salary', 'power', 'crisis',
+]
+
+
+def _text(rng: random.Random, n_words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + '.'
+
+
+def _candidate_scores(rng: random.Random) -> Dict[str, float]:
+    # Dirichlet-like probabilities, as produced by the_candi's softmax
+    draws = [rng.gammavariate(0.5, 1.0) for _ in CANDIDATES]
+    total = sum(draws) or 1.0
+    return {c: d / total for c, d in zip(CANDIDATES, draws)}
+
+
+def _reactions(rng: random.Random, scale: float) -> Dict[str, int]:
+    # Heavy-tailed counts: most posts get a few reactions, some go viral
+    base = int(rng.paretovariate(1.3) * scale)
+    mix = [0.70, 0.10, 0.08, 0.03, 0.04, 0.05]
+    return {k: int(base * share * rng.uniform(0.5, 1.5)) for k, share in zip(REACTION_KEYS, mix)}
+
+
+def _sentiment(rng: random.Random) -> Dict[str, float]:
+    return {'sentiment_score': max(-1.0, min(1.0, rng.gauss(0.05, 0.35))) + 0.001}
+
+
+def synthetic_comment(rng: random.Random, published: datetime, predicted: bool = True) -> Dict[str, Any]:
+    comment_published = published + timedelta(minutes=rng.randint(1, 48 * 60))
+    comment: Dict[str, Any] = {
+        'commentText': _text(rng, rng.randint(3, 30)),
+        'commentReaction': _reactions(rng, 5),
+        'commentReplyCount': int(rng.paretovariate(1.5)) - 1,
+        'publishedAt': comment_published.strftime(PUBLISHED_FORMAT),
+    }
+    if predicted:
+        comment['tr_comment_text'] = comment['commentText']
+        comment['pt_the_candi'] = _candidate_scores(rng)
+        comment['pt_the_senti'] = _sentiment(rng)
+    return comment
+
+
+def synthetic_post(
+        rng: random.Random,
+        news_id: int,
+        comments_per_post: int,
+        start: datetime,
+        days: int,
+        predicted: bool = True,
+        content_words: int = 250
+) -> Dict[str, Any]:
+    """
+    One Esana article in the shape the scraper stores and the processors enrich.
+
+    :param predicted: Include the pt_the_poli / pt_the_candi / pt_the_senti fields written by the processors.
+    """
+    published = start + timedelta(seconds=rng.randint(0, days * 24 * 3600))
+    reactions = _reactions(rng, 40)
+    post: Dict[str, Any] = {
+        'newsId': news_id,
+        'newsTitleEn': _text(rng, rng.randint(6, 14)),
+        'newsContentEn': _text(rng, content_words),
+        'newsTitleLl': _text(rng, rng.randint(6, 14)),
+        'newsContentLl': _text(rng, content_words),
+        'publishedAt': published.strftime(PUBLISHED_FORMAT),
+        'scrapedAt': (published + timedelta(hours=rng.randint(1, 72))).isoformat().replace('+00:00', 'Z'),
+        'reactions': reactions,
+        'sharesCount': int(rng.paretovariate(1.5)) - 1,
+        'commentCount': comments_per_post + int(rng.paretovariate(1.2)) - 1,
+        'top_comments': [synthetic_comment(rng, published, predicted) for _ in range(comments_per_post)],
+    }
+    if predicted:
+        post['predictedAt'] = (published + timedelta(hours=80)).isoformat()
+        post['pt_the_poli'] = {'prediction': 'political', 'final_the_poli': 'political'}
+        post['pt_the_candi'] = _candidate_scores(rng)
+        post['pt_the_senti'] = _sentiment(rng)
+    return post
+
+
+def iter_corpus(
+        n_posts: int,
+        comments_per_post: int = 5,
+        seed: int = 42,
+        start: Optional[datetime] = None,
+        days: int = 60,
+        predicted: bool = True,
+        content_words: int = 250
+) -> Iterator[Dict[str, Any]]:
+    """
+    Seeded stream of synthetic Esana articles; the same arguments always yield the same corpus.
+
+    :param start: First publish date, DEFAULT_START if not given. Pass one relative to now (e.g. now minus
+        `days`) for posts that the_waiter's decay, which runs against the current time, has not yet faded.
+    """
+    rng = random.Random(seed)
+    start = start or DEFAULT_START
+    for news_id in range(1, n_posts + 1):
+        yield synthetic_post(rng, news_id, comments_per_post, start, days, predicted, content_words)
+
+
+def generate_corpus(n_posts: int, comments_per_post: int = 5, seed: int = 42, **kwargs: Any) -> List[Dict[str, Any]]:
+    return list(iter_corpus(n_posts, comments_per_post, seed, **kwargs))
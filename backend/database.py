@@ -1,45 +1,701 @@
 import os
-from pymongo import MongoClient
+import time
+import zlib
+import atexit
+import socket
+import threading
+import importlib.util
+from datetime import datetime, timedelta, timezone
+import bson
+from bson.raw_bson import RawBSONDocument
+from pymongo import ASCENDING, MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
 from dotenv import load_dotenv
 
+from rollup import Rollup
+from stamps import stamp_articles
+
 load_dotenv()
 
 MONGO_URI = os.getenv('MONGO_URI')
 DB_NAME = os.getenv('DB_NAME')
+BULK_WRITES = os.getenv('BULK_WRITES', '0') == '1'
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', '500'))
+BULK_FLUSH_SECONDS = float(os.getenv('BULK_FLUSH_SECONDS', '5'))
+BULK_MAX_RETRIES = 3
+# Server error codes a retry can get past (network trouble, elections, write conflicts); any other write
+# error, e.g. a duplicate key (11000) or a failed validation (121), fails the same way again
+TRANSIENT_ERROR_CODES = {6, 7, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+# Connection pool of the process-wide client shared by every MongoDBClient on the same URI
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '2'))
+MONGO_MAX_IDLE_MS = int(os.getenv('MONGO_MAX_IDLE_MS', '300000'))
+# Empty: every wire compressor whose package is installed, see available_compressors()
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS', '')
+# Hand out RawBSONDocuments from the processors' finders; fields are decoded when first read
+RAW_BSON = os.getenv('RAW_BSON', '0') == '1'
+LEASE_SECONDS = int(os.getenv('LEASE_SECONDS', '600'))
+CLAIM_PAGE_SIZE = int(os.getenv('CLAIM_PAGE_SIZE', '100'))
+CHECKPOINT_COLLECTION = os.getenv('CHECKPOINT_COLLECTION', 'checkpoints')
+RANGE_BATCH_SIZE = int(os.getenv('RANGE_BATCH_SIZE', '500'))
+# Model outputs by text hash (prediction.fingerprint.text_hash), reused when an unchanged text comes back
+NLP_CACHE_COLLECTION = os.getenv('NLP_CACHE_COLLECTION', 'nlp_cache')
+# Entries are dropped this long after they were cached (a TTL index on cachedAt), so the cache stays bounded
+NLP_CACHE_TTL_SECONDS = int(os.getenv('NLP_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+# Daily rollup (rollup.Rollup) kept up to date by the processors' writes; read by the dashboard
+ROLLUP = os.getenv('ROLLUP', '0') == '1'
+ROLLUP_COLLECTION = os.getenv('ROLLUP_COLLECTION', 'daily_rollup')
+# Change streams need a replica set; a local single-node one is enough (mongod --replSet rs0, then rs.initiate())
+WATCH_MAX_AWAIT_MS = int(os.getenv('WATCH_MAX_AWAIT_MS', '1000'))
+
+# Work-selection queries; INDEXES below are shaped after them
+UNPREDICTED_QUERY = {
+    "$or": [
+        {"predictedAt": {"$exists": False}},
+        {"pt_the_poli": {"$exists": False}}
+    ]
+}
+POLITICAL_QUERY = {"pt_the_poli.final_the_poli": "political"}
+# Documents weighted before components were stored have no weightedAt and get re-weighted once
+UNWEIGHTED_QUERY = {"pt_the_waiter.weightedAt": {"$exists": False}, **POLITICAL_QUERY}
+
+
+def stale_query(model_versions):
+    """
+    Predicted documents scored by other models than model_versions (prediction.fingerprint.model_versions),
+    including those predicted before predictions were stamped. the_candi and the_senti only count for
+    political documents, the only ones they run on.
+    """
+    predicted = {"predictedAt": {"$exists": True}}
+    # One branch per index below; a model's $ne is two ranges of its index, empty when nothing is stale
+    return {"$or": [
+        {**predicted, "model_versions.the_poli": {"$ne": model_versions["the_poli"]}},
+        {**predicted, **POLITICAL_QUERY, "model_versions.the_candi": {"$ne": model_versions["the_candi"]}},
+        {**predicted, **POLITICAL_QUERY, "model_versions.the_senti": {"$ne": model_versions["the_senti"]}},
+    ]}
+
+
+INDEXES = [
+    # One index per $or branch of UNPREDICTED_QUERY; $exists: False is answered from the null bounds
+    {"keys": [("predictedAt", ASCENDING)], "name": "predictedAt_1"},
+    {"keys": [("pt_the_poli", ASCENDING)], "name": "pt_the_poli_1"},
+    # Only political documents are ever weighted, so the index covers just those
+    {
+        "keys": [("pt_the_poli.final_the_poli", ASCENDING), ("pt_the_waiter.weightedAt", ASCENDING)],
+        "name": "political_weightedAt",
+        "partialFilterExpression": POLITICAL_QUERY,
+    },
+    # One index per branch of stale_query, so finding stale documents after a backfill costs little
+    {"keys": [("model_versions.the_poli", ASCENDING), ("predictedAt", ASCENDING)], "name": "model_versions_the_poli"},
+    *({
+        "keys": [("pt_the_poli.final_the_poli", ASCENDING), (f"model_versions.{model}", ASCENDING)],
+        "name": f"political_{model}",
+        "partialFilterExpression": POLITICAL_QUERY,
+    } for model in ("the_candi", "the_senti")),
+    # Stored publishing time and language (stamps.py) the dashboard selects on; also finds the unstamped
+    {"keys": [("published", ASCENDING), ("lang", ASCENDING)], "name": "published_lang"},
+    # The languages the dashboard's sidebar offers, read as the distinct keys
+    {"keys": [("lang", ASCENDING)], "name": "lang_1"},
+    # The dashboard's snapshot and export ask for the articles written after a watermark
+    {"keys": [("updatedAt", ASCENDING)], "name": "updatedAt_1"},
+]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def available_compressors():
+    # In order of preference; the server uses the first one it supports too. zlib needs no extra package
+    compressors = [name for name, package in (("zstd", "zstandard"), ("snappy", "snappy"))
+                   if importlib.util.find_spec(package) is not None]
+    return ",".join(compressors + ["zlib"])
+
+
+def client_options():
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_MS,
+        "compressors": MONGO_COMPRESSORS or available_compressors(),
+    }
+
+
+def get_mongo_client(uri=None):
+    """
+    Returns the process-wide MongoClient for uri, creating it on first use. Every caller shares its
+    connection pool; callers that are done with it call release_mongo_client.
+
+    :param uri: Connection string, defaults to MONGO_URI.
+    """
+    uri = uri or MONGO_URI
+    with _clients_lock:
+        entry = _clients.get(uri)
+        if entry is None:
+            entry = _clients[uri] = {"client": MongoClient(uri, **client_options()), "refs": 0}
+        entry["refs"] += 1
+        return entry["client"]
+
+
+def release_mongo_client(client):
+    # A closed MongoClient cannot be reopened, so the shared one is closed only when its last user is done
+    with _clients_lock:
+        for uri, entry in _clients.items():
+            if entry["client"] is client:
+                entry["refs"] -= 1
+                if entry["refs"] > 0:
+                    return False
+                del _clients[uri]
+                break
+    client.close()
+    return True
+
+
+def lease_free_query(now=None):
+    # Documents nobody holds a lease on, or whose lease has expired
+    return {"$or": [{"lease": {"$exists": False}},
+                    {"lease.expiresAt": {"$lt": now or datetime.now(timezone.utc)}}]}
+
+
+def in_shard(doc_id, shard, num_shards):
+    if not num_shards:
+        return True
+    key = doc_id.binary if hasattr(doc_id, "binary") else str(doc_id).encode("utf-8")
+    return zlib.crc32(key) % num_shards == shard
+
+
+class BulkWriter:
+    """
+    Buffers UpdateOne operations and sends them with bulk_write(ordered=False) once batch_size
+    operations are queued or flush_interval seconds have passed since the last flush.
+    Operations failing with transient errors are retried with backoff, the others are set aside in
+    self.failed; pending operations are flushed on close and at exit.
+    """
+
+    def __init__(self, collection, batch_size=BULK_BATCH_SIZE, flush_interval=BULK_FLUSH_SECONDS,
+                 max_retries=BULK_MAX_RETRIES):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.ops = []
+        self.failed = []
+        self.stats = {"flushes": 0, "ops": 0, "matched": 0, "modified": 0, "upserted": 0, "retried": 0, "failed": 0}
+        self._lock = threading.RLock()
+        self._last_flush = time.monotonic()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def add(self, op):
+        with self._lock:
+            self.ops.append(op)
+            if len(self.ops) >= self.batch_size:
+                self.flush()
+
+    def update_one(self, filter_, update, upsert=False):
+        self.add(UpdateOne(filter_, update, upsert=upsert))
+
+    def _flush_periodically(self):
+        # Covers callers that go quiet (e.g. sleeping between posts) with operations still queued
+        while not self._stopped.wait(min(self.flush_interval, 1.0)):
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                try:
+                    self.flush()
+                except Exception as e:
+                    # Keep the thread alive: the next interval flushes whatever is queued by then
+                    print(f"Periodic bulk flush failed: {e!r}")
+
+    def flush(self):
+        with self._lock:
+            ops, self.ops = self.ops, []
+            self._last_flush = time.monotonic()
+            if ops:
+                self._write(ops)
+            return dict(self.stats)
+
+    def _write(self, ops):
+        self.stats["flushes"] += 1
+        self.stats["ops"] += len(ops)
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retried"] += len(ops)
+                time.sleep(min(2 ** attempt * 0.1, 5))
+            try:
+                result = self.collection.bulk_write(ops, ordered=False)
+                self._count(result.bulk_api_result)
+                return
+            except BulkWriteError as e:
+                details = e.details
+                self._count(details)
+                # Unordered: everything but the reported operations was applied
+                errors = details.get("writeErrors", [])
+                transient = [error.get("code") in TRANSIENT_ERROR_CODES for error in errors]
+                self._give_up([ops[error["index"]] for error, retry in zip(errors, transient) if not retry],
+                              errors[0].get("errmsg") if errors else "")
+                ops = [ops[error["index"]] for error, retry in zip(errors, transient) if retry]
+                if not ops:
+                    return
+            except ConnectionFailure as e:
+                print(f"Bulk write of {len(ops)} operations failed: {e}")
+            except OperationFailure as e:
+                if e.code not in TRANSIENT_ERROR_CODES and not e.has_error_label("RetryableWriteError"):
+                    self._give_up(ops, e)
+                    return
+                print(f"Bulk write of {len(ops)} operations failed: {e}")
+            except Exception as e:
+                # e.g. InvalidDocument: the batch cannot be sent as it is, so it is not retried either
+                self._give_up(ops, repr(e))
+                return
+
+        self._give_up(ops, f"still failing after {self.max_retries} retries")
+
+    def _give_up(self, ops, reason):
+        if not ops:
+            return
+        self.stats["failed"] += len(ops)
+        self.failed.extend(ops)
+        print(f"Giving up on {len(ops)} operations: {reason}")
+
+    def _count(self, result):
+        self.stats["matched"] += result.get("nMatched", 0)
+        self.stats["modified"] += result.get("nModified", 0)
+        self.stats["upserted"] += result.get("nUpserted", 0)
+
+    def close(self):
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self.flush()
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
 
 class MongoDBClient:
-    def __init__(self, uri, db_name, collection_name):
-        self.client = MongoClient(uri)
+    def __init__(self, uri, db_name, collection_name, client=None):
+        # An existing client (e.g. an in-process stand-in) can be passed instead of a URI
+        self.client = client if client is not None else get_mongo_client(uri)
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
+        self.writer = None
+        self.lease = None
+        self.checkpoint = None
+        self.rollup = None
+        self.stamps = None
+
+    def enable_bulk_writes(self, batch_size=BULK_BATCH_SIZE, flush_interval=BULK_FLUSH_SECONDS):
+        # Route update_doc / update_one through a BulkWriter; call flush() before reading back the writes
+        if self.writer is None:
+            self.writer = BulkWriter(self.collection, batch_size=batch_size, flush_interval=flush_interval)
+        return self.writer
+
+    def enable_rollup(self, source=None):
+        """
+        Makes update_doc keep the daily rollup collection up to date. Buffered writes reach the rollup when
+        they are flushed (flush(), close_db), direct ones right away.
+
+        :param source: Source the articles are counted under, defaults to the collection name.
+        """
+        if self.rollup is None:
+            # A fresh handle: the rollup reads dict documents even when self.collection hands out raw ones
+            self.rollup = Rollup(self.db[self.collection.name], self.db[ROLLUP_COLLECTION], source)
+        return self.rollup
+
+    def enable_stamping(self):
+        # Makes flush() store the publishing time and language of the articles not stamped yet (stamps.py)
+        if self.stamps is None:
+            # A fresh handle, as for the rollup: stamping reads dict documents
+            self.stamps = self.db[self.collection.name]
+        return self.stamps
+
+    def flush(self):
+        stats = self.writer.flush() if self.writer is not None else None
+        if self.rollup is not None:
+            self.rollup.sync()
+        if self.stamps is not None:
+            stamp_articles(self.stamps)
+        return stats
+
+    def enable_raw_documents(self):
+        """
+        Makes reads through self.collection return RawBSONDocuments. A raw document keeps the bytes it was
+        sent as and only decodes its top-level fields when one of them is first accessed; embedded
+        documents (e.g. every top comment) stay raw until they are read in turn. Raw documents are
+        read-only, use to_dict() for a mutable copy.
+
+        With bson's C extension a full dict decode is cheap, so this pays off mainly for documents that
+        are passed along untouched or held in memory; benchmarks/bench_decode.py measures both.
+        """
+        codec_options = self.collection.codec_options.with_options(document_class=RawBSONDocument)
+        self.collection = self.collection.with_options(codec_options=codec_options)
+        return self.collection
+
+    def enable_leasing(self, owner=None, lease_seconds=LEASE_SECONDS, shard=None, num_shards=None,
+                       page_size=CLAIM_PAGE_SIZE):
+        """
+        Makes the unpredicted/unweighted finders lease every document before handing it out, so several
+        workers can run against the same collection. update_doc releases the lease; the leases of a
+        worker that dies expire after lease_seconds and its documents return to the pool.
 
-    def find_unpredicted_texts_docs(self):
-        return self.collection.find({
-            "$or": [
-                {"predictedAt": {"$exists": False}},
-                {"pt_the_poli": {"$exists": False}}
-            ]
-        })
+        :param owner: Lease owner written to the documents, defaults to <hostname>:<pid>.
+        :param lease_seconds: How long a claimed document stays reserved for this worker.
+        :param shard: Index of this worker's shard, in [0, num_shards).
+        :param num_shards: Only claim documents whose _id hashes to shard; None claims from the whole pool.
+        :param page_size: _ids read per page while looking for claimable documents.
+        """
+        if num_shards is not None and not 0 <= (shard or 0) < num_shards:
+            raise ValueError(f"Shard {shard} is out of range for {num_shards} shards")
+        self.lease = {
+            "owner": owner or f"{socket.gethostname()}:{os.getpid()}",
+            "seconds": lease_seconds,
+            "shard": shard or 0,
+            "num_shards": num_shards,
+            "page_size": page_size,
+        }
+        return self.lease
 
-    def find_unweighted_text_docs(self):
-        return self.collection.find({
-            "pt_the_waiter": {"$exists": False},
-            "pt_the_poli.final_the_poli": "political"
-        })
+    def enable_checkpointing(self, job_name, batch_size=RANGE_BATCH_SIZE):
+        """
+        Makes the unpredicted/unweighted finders page through _id ranges and record a checkpoint in the
+        checkpoints collection after every committed batch. A job restarted under the same name resumes
+        after its last checkpoint; the checkpoint is removed once a scan runs to the end.
+
+        :param job_name: Name the checkpoints are stored under, one job per worker.
+        :param batch_size: Documents per _id range.
+        """
+        self.checkpoint = {"job": job_name, "batch_size": batch_size}
+        return self.checkpoint
+
+    def find_unpredicted_texts_docs(self, projection=None):
+        return self._find("unpredicted", UNPREDICTED_QUERY, projection)
+
+    def find_unweighted_text_docs(self, projection=None):
+        return self._find("unweighted", UNWEIGHTED_QUERY, projection)
+
+    def _find(self, name, query, projection=None):
+        # Leasing pages by _id itself and is shared between workers, so it takes precedence over checkpoints
+        if self.lease is not None:
+            return self.claim_docs(query, projection)
+        if self.checkpoint is not None:
+            return self.iter_id_ranges(name, query, projection)
+        return self.collection.find(query, projection)
+
+    def iter_id_ranges(self, name, query, projection=None):
+        """
+        Yields the documents matching query in batches of increasing _id, each read with a fresh
+        query, so no cursor has to survive the processing of a batch.
+
+        The checkpoint of a batch is written when the caller asks for the next document, i.e. after it
+        has handled the last one; pending bulk writes are flushed first so a checkpoint never gets ahead
+        of the updates it stands for.
+        """
+        checkpoints = self.db[CHECKPOINT_COLLECTION]
+        checkpoint_id = f"{self.checkpoint['job']}:{self.collection.name}:{name}"
+        saved = checkpoints.find_one({"_id": checkpoint_id})
+        last_id = saved["lastId"] if saved else None
+        done = saved["docs"] if saved else 0
+        if saved:
+            print(f"Resuming {checkpoint_id} after _id {last_id} ({done} documents done)")
+
+        while True:
+            range_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+            batch = list(self.collection.find(range_query, projection)
+                         .sort("_id", ASCENDING).limit(self.checkpoint["batch_size"]))
+            if not batch:
+                break
+            yield from batch
+
+            self.flush()
+            last_id = batch[-1]["_id"]
+            done += len(batch)
+            checkpoints.update_one(
+                {"_id": checkpoint_id},
+                {"$set": {"lastId": last_id, "docs": done, "updatedAt": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+
+        checkpoints.delete_one({"_id": checkpoint_id})
+
+    def claim_docs(self, query, projection=None):
+        """
+        Yields the documents matching query that this worker manages to lease, one at a time, so a
+        lease only has to cover the processing of a single document.
+
+        _ids are read in pages of _id > last seen, so no cursor stays open while documents are processed.
+        A sweep that reaches the end starts over to pick up expired leases and new documents; the
+        generator stops after a sweep that claimed nothing. A document is claimed at most once per call,
+        even if its update leaves it matching the query.
+        """
+        # A sweep never returns to an _id it passed, so only documents that still match once processed
+        # (e.g. a failed prediction) can come round again; only those are remembered, not every one claimed
+        retained = set()
+        while True:
+            claimed_in_sweep = 0
+            last_id = None
+            while True:
+                page_query = {"$and": [query, lease_free_query()]}
+                if last_id is not None:
+                    page_query["$and"].append({"_id": {"$gt": last_id}})
+                ids = [doc["_id"] for doc in self.collection.find(page_query, {"_id": 1})
+                       .sort("_id", ASCENDING).limit(self.lease["page_size"])]
+                if not ids:
+                    break
+                last_id = ids[-1]
+
+                claimed = []
+                for doc_id in ids:
+                    if doc_id in retained or not in_shard(doc_id, self.lease["shard"], self.lease["num_shards"]):
+                        continue
+                    doc = self.claim_doc(doc_id, query, projection)
+                    if doc is not None:
+                        claimed.append(doc_id)
+                        claimed_in_sweep += 1
+                        yield doc
+                retained |= self._still_matching(claimed, query)
+            if not claimed_in_sweep:
+                return
+
+    def _still_matching(self, doc_ids, query):
+        # Called once the caller is done with the documents; their buffered updates must land first
+        if not doc_ids:
+            return set()
+        if self.writer is not None:
+            self.writer.flush()
+        return {doc["_id"] for doc in self.collection.find({"$and": [{"_id": {"$in": doc_ids}}, query]}, {"_id": 1})}
+
+    def claim_doc(self, doc_id, query, projection=None):
+        # Atomic: of several workers racing for the same document only one moves it to its lease
+        now = datetime.now(timezone.utc)
+        return self.collection.find_one_and_update(
+            {"$and": [{"_id": doc_id}, query, lease_free_query(now)]},
+            {"$set": {"lease": {"owner": self.lease["owner"],
+                                "expiresAt": now + timedelta(seconds=self.lease["seconds"])}}},
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def renew_lease(self, doc_id):
+        # For documents that take longer than the lease to process
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.lease["seconds"])
+        result = self.collection.update_one({"_id": doc_id, "lease.owner": self.lease["owner"]},
+                                            {"$set": {"lease.expiresAt": expires_at}})
+        return result.modified_count == 1
+
+    def release_lease(self, doc_id):
+        # Hands a claimed document back to the pool without updating it
+        self.update_one({"_id": doc_id, "lease.owner": self.lease["owner"]}, {"$unset": {"lease": ""}})
+
+    def find_political_docs(self, projection=None, batch_size=None):
+        cursor = self.collection.find(POLITICAL_QUERY, projection)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    def ensure_indexes(self):
+        # create_index is a no-op for indexes that already exist with the same options
+        for index in INDEXES:
+            options = {key: value for key, value in index.items() if key != "keys"}
+            self.collection.create_index(index["keys"], **options)
+        # A changed TTL conflicts with the existing index; apply it with collMod instead
+        self.db[NLP_CACHE_COLLECTION].create_index(
+            [("cachedAt", ASCENDING)], name="cachedAt_ttl", expireAfterSeconds=NLP_CACHE_TTL_SECONDS
+        )
+        return [index["name"] for index in INDEXES] + [f"{NLP_CACHE_COLLECTION}.cachedAt_ttl"]
+
+    def explain_finders(self):
+        """
+        Explains the work-selection queries and reports the stages of their winning plans.
+
+        :return: Query name -> {"stages": [...], "indexes": [...], "collscan": bool}.
+        """
+        plans = {}
+        for name, query in (("unpredicted", UNPREDICTED_QUERY), ("unweighted", UNWEIGHTED_QUERY),
+                            ("political", POLITICAL_QUERY)):
+            winning_plan = self.collection.find(query).explain()["queryPlanner"]["winningPlan"]
+            stages, indexes = [], []
+            _collect_plan_stages(winning_plan, stages, indexes)
+            plans[name] = {"stages": stages, "indexes": indexes, "collscan": "COLLSCAN" in stages}
+        return plans
+
+    def find_unpredicted_by_ids(self, doc_ids, projection=None):
+        # Re-reads inserts reported by the change stream; documents handled since (e.g. by a batch run) drop out
+        return self.collection.find({"$and": [{"_id": {"$in": list(doc_ids)}}, UNPREDICTED_QUERY]}, projection)
+
+    def get_cached_predictions(self, cache_key):
+        # cache_key: "<processor>:<text hash>", processors store differently shaped predictions
+        return self.db[NLP_CACHE_COLLECTION].find_one({"_id": cache_key})
+
+    def cache_predictions(self, cache_key, entry):
+        self.db[NLP_CACHE_COLLECTION].replace_one(
+            {"_id": cache_key}, {**entry, "cachedAt": datetime.now(timezone.utc)}, upsert=True
+        )
+
+    def has_unpredicted_docs(self):
+        return self.collection.find_one(UNPREDICTED_QUERY, {"_id": 1}) is not None
+
+    def find_stale_docs(self, model_versions, projection=None, limit=100):
+        """
+        The next documents to re-score after a model change, newest first (by the insert day in their
+        ObjectId) and, within a day, most engaged first (shares + comments + reactions).
+
+        Only one day is ever sorted: the newest stale document is found through the stale_query indexes, and the
+        engagement sort runs over the stale documents of its (UTC) insert day, an _id range.
+
+        :param model_versions: Fingerprints of the current models.
+        :param limit: Documents to return.
+        """
+        stale = stale_query(model_versions)
+        # Answered from the stale_query indexes; once a backfill is done this is all a round costs
+        if self.collection.find_one(stale, {"_id": 1}) is None:
+            return iter([])
+        newest = next(iter(self.collection.find(stale, {"_id": 1}).sort("_id", -1).limit(1)), None)
+        if newest is None:
+            return iter([])
+        if not isinstance(newest["_id"], bson.ObjectId):
+            # No insert time to group by
+            return self.collection.find(stale, projection).sort("_id", -1).limit(limit)
+
+        # Scraped documents carry generated ObjectIds, whose timestamp is the insert time
+        inserted = newest["_id"].generation_time
+        day_start = datetime(inserted.year, inserted.month, inserted.day, tzinfo=timezone.utc)
+        engagement = {"$add": [
+            {"$ifNull": ["$sharesCount", 0]},
+            {"$ifNull": ["$commentCount", 0]},
+            {"$sum": {"$map": {"input": {"$objectToArray": {"$ifNull": ["$reactions", {}]}}, "as": "r",
+                               "in": "$$r.v"}}},
+        ]}
+        pipeline = [
+            {"$match": {"$and": [
+                {"_id": {"$gte": bson.ObjectId.from_datetime(day_start), "$lte": newest["_id"]}}, stale,
+            ]}},
+            {"$addFields": {"_backfill": {"engagement": engagement}}},
+            {"$sort": {"_backfill.engagement": -1, "_id": -1}},
+            {"$limit": limit},
+            {"$project": projection or {"_backfill": 0}},
+        ]
+        return self.aggregate(pipeline)
+
+    def watch_inserts(self, resume_token=None, max_await_time_ms=WATCH_MAX_AWAIT_MS):
+        """
+        Opens a change stream on the collection that reports inserted documents.
+
+        :param resume_token: Token of the last handled event (see save_resume_token); None starts from now.
+        :param max_await_time_ms: How long try_next() waits for an event before returning None.
+        """
+        return self.collection.watch(
+            [{"$match": {"operationType": "insert"}}, {"$project": {"documentKey": 1}}],
+            resume_after=resume_token,
+            max_await_time_ms=max_await_time_ms,
+        )
+
+    def load_resume_token(self, name):
+        saved = self.db[CHECKPOINT_COLLECTION].find_one({"_id": f"watch:{self.collection.name}:{name}"})
+        return saved["resumeToken"] if saved else None
+
+    def save_resume_token(self, name, resume_token):
+        self.db[CHECKPOINT_COLLECTION].update_one(
+            {"_id": f"watch:{self.collection.name}:{name}"},
+            {"$set": {"resumeToken": resume_token, "updatedAt": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    def clear_resume_token(self, name):
+        self.db[CHECKPOINT_COLLECTION].delete_one({"_id": f"watch:{self.collection.name}:{name}"})
+
+    def aggregate(self, pipeline):
+        return self.collection.aggregate(pipeline, allowDiskUse=True)
 
     def get_all_docs(self):
         return self.collection.find({})
 
-    def update_doc(self, doc_id, update_fields):
-        self.collection.update_one({"_id": doc_id}, {"$set": update_fields})
+    def update_doc(self, doc_id, update_fields, unset_fields=()):
+        # updatedAt is the server's time of the write, which the dashboard's snapshot and export watermark on
+        update = {"$set": update_fields, "$currentDate": {"updatedAt": True}}
+        unset = {field: "" for field in unset_fields}
+        if self.lease is not None:
+            unset["lease"] = ""
+        if unset:
+            update["$unset"] = unset
+        self.update_one({"_id": doc_id}, update)
+        if self.rollup is not None:
+            self.rollup.touch(doc_id)
+            if self.writer is None:
+                self.rollup.sync()
+
+    def update_one(self, filter_, update):
+        # Buffered writes return None; their results are summed in writer.stats
+        if self.writer is not None:
+            self.writer.update_one(filter_, update)
+            return None
+        return self.collection.update_one(filter_, update)
+
+
+def _collect_plan_stages(plan, stages, indexes):
+    # Plans nest their inputs under inputStage/inputStages (and queryPlan for the slot-based engine)
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan:
+            indexes.append(plan["indexName"])
+        for value in plan.values():
+            _collect_plan_stages(value, stages, indexes)
+    elif isinstance(plan, list):
+        for item in plan:
+            _collect_plan_stages(item, stages, indexes)
+
 
+def to_dict(doc):
+    # Fully decoded copy of a RawBSONDocument (e.g. for json.dumps), with MongoClient's default codec options
+    if isinstance(doc, RawBSONDocument):
+        return bson.decode(doc.raw)
+    return doc
 
-def get_db_client(collection_name):
-    return MongoDBClient(uri=MONGO_URI, db_name=DB_NAME, collection_name=collection_name)
+
+def get_db_client(collection_name, bulk_writes=BULK_WRITES, raw_documents=False, db_name=None, uri=None,
+                  rollup=ROLLUP, stamps=False):
+    # Clients of the same URI share one MongoClient (see get_mongo_client)
+    db_client = MongoDBClient(uri=uri or MONGO_URI, db_name=db_name or DB_NAME, collection_name=collection_name)
+    if bulk_writes:
+        db_client.enable_bulk_writes()
+    if raw_documents:
+        db_client.enable_raw_documents()
+    if rollup:
+        db_client.enable_rollup()
+    if stamps:
+        db_client.enable_stamping()
+    return db_client
 
 
 def close_db(client):
     if client:
-        client.client.close()
-        print("Database connection closed.")
+        if client.writer is not None:
+            client.writer.close()
+            print(f"Bulk writes: {client.writer.stats}")
+        if client.rollup is not None:
+            client.rollup.sync()
+            print(f"Rollup: {client.rollup.stats}")
+        if release_mongo_client(client.client):
+            print("Database connection closed.")
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Bootstrap the indexes and confirm the work-selection queries use them
+    db_client = get_db_client(sys.argv[1] if len(sys.argv) > 1 else os.getenv("DB_COLLECTION_NAME"))
+    try:
+        print(f"Indexes ensured: {', '.join(db_client.ensure_indexes())}")
+        query_plans = db_client.explain_finders()
+    finally:
+        close_db(db_client)
+
+    for query_name, query_plan in query_plans.items():
+        status = "COLLSCAN" if query_plan["collscan"] else "index"
+        print(f"{query_name:12} {status:8} {' <- '.join(query_plan['stages'])} {query_plan['indexes']}")
+    sys.exit(1 if any(query_plan["collscan"] for query_plan in query_plans.values()) else 0)
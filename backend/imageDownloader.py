@@ -1,9 +1,9 @@
-from database import get_db_client, close_db
+from database import RAW_BSON, get_db_client, close_db, to_dict
 import subprocess
 import json
 import os
 
-single_posts_client = get_db_client("single_posts")
+single_posts_client = get_db_client("single_posts", raw_documents=RAW_BSON)
 poli_img_client = get_db_client("poli_img")
 
 try:
@@ -20,7 +20,7 @@ try:
     undownloaded_images = single_posts_client.collection.find(query)
 
     for doc in undownloaded_images:
-        doc_json = json.dumps(doc, default=str)  # Convert document to JSON
+        doc_json = json.dumps(to_dict(doc), default=str)  # Convert document to JSON
         print(doc_json)
 
         for index, img in enumerate(doc['imgContent']):
@@ -45,12 +45,15 @@ try:
                 print(result.stdout)
 
                 if os.path.exists(file_path):
-                    update_result = single_posts_client.collection.update_one(
+                    update_result = single_posts_client.update_one(
                         {"postId": doc['postId'], "imgContent.url": img['url']},
                         {"$set": {"imgContent.$.downloaded": True}}
                     )
 
-                    if update_result.modified_count > 0:
+                    if update_result is None:
+                        # Buffered (BULK_WRITES=1): the outcome is reported when the writer flushes
+                        print(f"Queued downloaded status for image {index + 1} in document {doc['postId']}")
+                    elif update_result.modified_count > 0:
                         print(f"Updated downloaded status for image {index + 1} in document {doc['postId']}")
                     else:
                         print(f"Failed to update downloaded status for image {index + 1} in document {doc['postId']}")
@@ -1,5 +1,6 @@
 import os
 import ast
+import argparse
 from typing import NoReturn, Dict
 
 from dotenv import load_dotenv
@@ -11,7 +12,11 @@ from prediction.the_poli import (
     MAX_LEN,
 )
 from prediction.hela_processor import HelakuruScraperProcessor
-from database import get_db_client
+from prediction.change_stream import run_daemon
+from prediction.backfill import run_backfill
+from prediction.fingerprint import model_versions
+from prediction.near_duplicates import NEAR_DUP_THRESHOLD, NearDuplicates
+from database import RAW_BSON, get_db_client
 
 # Load environment variables
 load_dotenv(dotenv_path='.env')
@@ -23,22 +28,54 @@ THE_CANDI_MODEL_PATH: str = os.getenv("THE_CANDI_MODEL_PATH", "")
 DB_COLLECTION_NAME: str = os.getenv("DB_COLLECTION_NAME", "")
 TRANSLATE_URL: str = os.getenv("TRANSLATE_URL", "http://localhost:3000/")
 THE_CANDI_LABEL: Dict[int, str] = ast.literal_eval(os.getenv("LABEL", "{}"))
+# Set LEASE_CLAIMS=1 to run several predictors side by side; NUM_SHARDS/SHARD split the pool between them
+LEASE_CLAIMS: bool = os.getenv("LEASE_CLAIMS", "0") == "1"
+NUM_SHARDS: int = int(os.getenv("NUM_SHARDS", "0"))
+SHARD: int = int(os.getenv("SHARD", "0"))
+# Page through _id ranges and resume after the last committed batch of this job when restarted
+CHECKPOINT_JOB: str = os.getenv("CHECKPOINT_JOB", "")
 
 
-def predict() -> NoReturn:
+def predict(daemon: bool = False, batch_size: int = 32, max_wait: float = 2.0, backfill: bool = False,
+            budget: float = 60, max_docs: int = None, near_duplicates: float = None) -> NoReturn:
     # Initialize HelakuruScraperProcessor
     processor = HelakuruScraperProcessor(
         db_client=db_client,
         political_predictor=the_poli_predictor,
         the_candi_dir=THE_CANDI_MODEL_PATH,
         label_dict=THE_CANDI_LABEL,
-        tr_url=TRANSLATE_URL
+        tr_url=TRANSLATE_URL,
+        model_versions=model_versions(THE_POLI_MODEL_PATH, THE_POLI_CONFIG_PATH, THE_CANDI_MODEL_PATH, THE_CANDI_LABEL),
+        near_duplicates=NearDuplicates(["articles", "comments"], threshold=near_duplicates) if near_duplicates else None
     )
+    print(f"Model versions: {processor.model_versions}")
+    if backfill:
+        rescored = run_backfill(processor, db_client, batch_size=batch_size, docs_per_minute=budget, max_docs=max_docs)
+        print({"message": f"Backfill completed, {rescored} documents re-scored."})
+        return
+    if daemon:
+        run_daemon(processor, db_client, batch_size=batch_size, max_wait_seconds=max_wait)
     processor.process()
     print({"message": "Prediction and update completed for unpredicted documents."})
 
 
 if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Predict and weight unpredicted articles")
+    arg_parser.add_argument("--daemon", action="store_true",
+                            help="Keep running and process new articles from the change stream (needs a replica set)")
+    arg_parser.add_argument("--batch-size", type=int, default=32, help="Inserts per micro-batch in daemon mode")
+    arg_parser.add_argument("--max-wait", type=float, default=2.0,
+                            help="Seconds a micro-batch waits for more inserts after the first one")
+    arg_parser.add_argument("--backfill", action="store_true",
+                            help="Re-score documents predicted by older model checkpoints, newest and most engaged first")
+    arg_parser.add_argument("--budget", type=float, default=60, help="Backfill documents per minute (0: unthrottled)")
+    arg_parser.add_argument("--max-docs", type=int, default=None, help="Stop the backfill after this many documents")
+    arg_parser.add_argument("--near-duplicates", type=float, nargs="?", const=NEAR_DUP_THRESHOLD, default=None,
+                            metavar="THRESHOLD",
+                            help="Reuse the predictions of articles and comments at least this similar (default "
+                                 f"{NEAR_DUP_THRESHOLD}, NEAR_DUP_THRESHOLD) to ones already scored")
+    args = arg_parser.parse_args()
+
     # Load the political model
     the_poli_model, the_poli_tokenizer, the_poli_device = load_model(
         THE_POLI_MODEL_PATH, THE_POLI_CONFIG_PATH
@@ -54,8 +91,16 @@ if __name__ == '__main__':
     )
 
     # Get the database client
-    db_client = get_db_client(DB_COLLECTION_NAME)
+    # Articles are stamped with their publishing time and language as they are processed
+    db_client = get_db_client(DB_COLLECTION_NAME, raw_documents=RAW_BSON, stamps=True)
     print(db_client)
+    db_client.ensure_indexes()
+    if LEASE_CLAIMS or NUM_SHARDS:
+        lease = db_client.enable_leasing(shard=SHARD, num_shards=NUM_SHARDS or None)
+        print(f"Claiming documents as {lease['owner']} (shard {SHARD} of {NUM_SHARDS or 1})")
+    elif CHECKPOINT_JOB:
+        db_client.enable_checkpointing(CHECKPOINT_JOB)
 
     # Run the prediction process
-    predict()
+    predict(daemon=args.daemon, batch_size=args.batch_size, max_wait=args.max_wait, backfill=args.backfill,
+            budget=args.budget, max_docs=args.max_docs, near_duplicates=args.near_duplicates)
@@ -0,0 +1,51 @@
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from prediction.hela_processor import FRESH_DOC_FIELDS
+
+
+def throttled(docs: Iterable[Dict[str, Any]], interval: float) -> Iterator[Dict[str, Any]]:
+    # Hands out at most one document per interval seconds
+    next_at = time.monotonic()
+    for doc in docs:
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        next_at = max(next_at, time.monotonic()) + interval
+        yield doc
+
+
+def run_backfill(
+        processor: Any,
+        db_client: Any,
+        batch_size: int = 50,
+        docs_per_minute: float = 60,
+        max_docs: Optional[int] = None
+) -> int:
+    """
+    Re-scores documents predicted by older models than the processor's (see MongoDBClient.find_stale_docs),
+    newest and most engaged first, at no more than docs_per_minute. Before every batch, new unpredicted
+    documents are processed first, so live ingestion keeps up while a backfill runs.
+
+    :param processor: HelakuruScraperProcessor with model_versions set.
+    :param batch_size: Stale documents fetched per round.
+    :param docs_per_minute: Re-scoring budget; 0 disables the throttle.
+    :param max_docs: Stop after this many documents, None runs until nothing is stale.
+    :return: Number of documents re-scored.
+    """
+    if not processor.model_versions:
+        raise ValueError("Backfilling needs the processor's model_versions to tell stale predictions apart")
+
+    interval = 60 / docs_per_minute if docs_per_minute else 0
+    done = 0
+    while max_docs is None or done < max_docs:
+        if db_client.has_unpredicted_docs():
+            processor.process()
+
+        limit = batch_size if max_docs is None else min(batch_size, max_docs - done)
+        docs = list(db_client.find_stale_docs(processor.model_versions, FRESH_DOC_FIELDS, limit))
+        if not docs:
+            break
+        done += processor.process_docs(throttled(docs, interval))
+        print(f"Backfill: {done} documents re-scored with {processor.model_versions}")
+    return done
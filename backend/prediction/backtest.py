@@ -0,0 +1,119 @@
+import csv
+from array import array
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, TextIO, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from prediction.the_waiter import CANDIDATES, LAMBDA_DECAY, as_utc
+
+SECONDS_PER_DAY = 24 * 3600
+
+# Projection for documents passed to load_components
+COMPONENT_FIELDS = {'pt_the_waiter.components': 1}
+
+
+def load_components(docs: Iterable[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Flattens the stored the_waiter components of all documents into column arrays.
+
+    :param docs: Documents carrying pt_the_waiter.components (see the_waiter.decompose_post).
+    :return: Publish times in epoch days, engagement * sentiment factors and an (n, candidates) score matrix.
+    """
+    times, factors, scores = array('d'), array('d'), array('d')
+    for doc in docs:
+        for component in doc.get('pt_the_waiter', {}).get('components', []):
+            times.append(as_utc(component['publishedAt']).timestamp() / SECONDS_PER_DAY)
+            factors.append(component['engagement'] * component['sentiment'])
+            scores.extend(component['candidates'].get(c, 0) for c in CANDIDATES)
+
+    return (
+        np.frombuffer(times, dtype=np.float64),
+        np.frombuffer(factors, dtype=np.float64),
+        np.frombuffer(scores, dtype=np.float64).reshape(-1, len(CANDIDATES)),
+    )
+
+
+def as_of_times(start: date, end: date, tz: str = 'UTC') -> Tuple[List[date], np.ndarray]:
+    # Each day is evaluated as of the following midnight in the given timezone
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    zone = ZoneInfo(tz)
+    as_of = [
+        datetime.combine(day + timedelta(days=1), time.min, tzinfo=zone).timestamp() / SECONDS_PER_DAY
+        for day in days
+    ]
+    return days, np.asarray(as_of, dtype=np.float64)
+
+
+def backtest(
+        times: np.ndarray,
+        factors: np.ndarray,
+        scores: np.ndarray,
+        as_of: np.ndarray,
+        lambda_decay: float = LAMBDA_DECAY
+) -> np.ndarray:
+    """
+    Decayed candidate weights for every as-of time in one pass over the components.
+
+    Every component is assigned to the first as-of time it was published before and decayed to it.
+    Because the decay is exponential, the totals of as-of time j are the totals of j - 1 decayed over
+    the gap between them plus the components of bin j.
+
+    :param as_of: Increasing as-of times in epoch days.
+    :return: An (as_of, candidates) matrix of total candidate weights.
+    """
+    bins = np.searchsorted(as_of, times, side='right')
+    keep = bins < len(as_of)
+    bins = bins[keep]
+    contribution = factors[keep] * np.exp(-lambda_decay * (as_of[bins] - times[keep]))
+
+    per_bin = np.column_stack([
+        np.bincount(bins, weights=contribution * scores[keep, i], minlength=len(as_of))
+        for i in range(scores.shape[1])
+    ]) if len(as_of) else np.zeros((0, scores.shape[1]))
+
+    carry = np.exp(-lambda_decay * np.diff(as_of))
+    totals = per_bin.copy()
+    for j in range(1, len(as_of)):
+        totals[j] += totals[j - 1] * carry[j - 1]
+    return totals
+
+
+def normalize_rows(totals: np.ndarray) -> np.ndarray:
+    # Row-wise normalize_candidate_weights: percentages, or zeros when the weights sum to zero
+    sums = totals.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(sums != 0, totals / sums * 100, 0.0)
+    return shares
+
+
+def backtest_series(
+        docs: Iterable[Dict[str, Any]],
+        start: date,
+        end: date,
+        tz: str = 'UTC'
+) -> List[Dict[str, Any]]:
+    """
+    Daily standings between start and end (inclusive), counting only content published before each day's end.
+
+    :return: One row per day with the total and normalized weight of every candidate.
+    """
+    days, as_of = as_of_times(start, end, tz)
+    totals = backtest(*load_components(docs), as_of)
+    shares = normalize_rows(totals)
+
+    rows = []
+    for day, day_totals, day_shares in zip(days, totals, shares):
+        row: Dict[str, Any] = {'date': day.isoformat()}
+        row.update({f'total_{c}': float(v) for c, v in zip(CANDIDATES, day_totals)})
+        row.update({f'share_{c}': float(v) for c, v in zip(CANDIDATES, day_shares)})
+        rows.append(row)
+    return rows
+
+
+def write_series(rows: List[Dict[str, Any]], out: TextIO) -> None:
+    fieldnames = ['date'] + [f'total_{c}' for c in CANDIDATES] + [f'share_{c}' for c in CANDIDATES]
+    writer = csv.DictWriter(out, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
@@ -0,0 +1,74 @@
+import time
+from typing import Any
+
+from pymongo.errors import OperationFailure
+
+from prediction.hela_processor import FRESH_DOC_FIELDS
+
+STREAM_NAME = 'predictor'
+# The resume token fell off the oplog (ChangeStreamHistoryLost) or can no longer be used (ChangeStreamFatalError)
+LOST_HISTORY_CODES = (280, 286)
+NOT_REPLICA_SET_CODE = 40573
+
+
+def _catch_up(processor: Any) -> None:
+    # Documents inserted while no stream was open are only reachable through the batch queries
+    print("Catching up on unpredicted documents...")
+    processor.process()
+
+
+def run_daemon(processor: Any, db_client: Any, batch_size: int = 32, max_wait_seconds: float = 2.0) -> None:
+    """
+    Processes new articles as they are inserted, instead of on the next batch run.
+
+    Inserts are collected from a change stream into micro-batches of up to batch_size documents, or
+    whatever arrived within max_wait_seconds of the first one, then predicted and weighted in one pass
+    (HelakuruScraperProcessor.process_docs). The resume token is stored after every batch, so a restarted
+    daemon carries on after the last handled insert. Without a usable token it first catches up with a
+    regular batch run; the stream is opened before that so nothing inserted meanwhile is missed.
+
+    :param processor: HelakuruScraperProcessor writing through db_client.
+    :param db_client: MongoDBClient of the scraper collection; the server must be a replica set.
+    """
+    while True:
+        resume_token = db_client.load_resume_token(STREAM_NAME)
+        try:
+            with db_client.watch_inserts(resume_token) as stream:
+                if resume_token is None:
+                    _catch_up(processor)
+                print(f"Watching {db_client.collection.name} for new documents...")
+                _consume(stream, processor, db_client, batch_size, max_wait_seconds)
+        except OperationFailure as e:
+            if e.code == NOT_REPLICA_SET_CODE:
+                raise SystemExit("Change streams need a replica set: start mongod with --replSet rs0 and run rs.initiate()")
+            if e.code not in LOST_HISTORY_CODES:
+                raise
+            print(f"Cannot resume the change stream ({e}); starting over.")
+            db_client.clear_resume_token(STREAM_NAME)
+
+
+def _consume(stream: Any, processor: Any, db_client: Any, batch_size: int, max_wait_seconds: float) -> None:
+    saved_token = None
+    while stream.alive:
+        doc_ids = []
+        deadline = None
+        while len(doc_ids) < batch_size:
+            change = stream.try_next()
+            if change is not None:
+                doc_ids.append(change["documentKey"]["_id"])
+                deadline = deadline or time.monotonic() + max_wait_seconds
+            elif doc_ids and time.monotonic() >= deadline:
+                break
+            elif not doc_ids:
+                # Idle: no need to hold a partial batch open
+                break
+
+        if doc_ids:
+            started = time.monotonic()
+            processed = processor.process_docs(db_client.find_unpredicted_by_ids(doc_ids, FRESH_DOC_FIELDS))
+            print(f"Processed {processed} of {len(doc_ids)} new documents in {time.monotonic() - started:.2f}s")
+
+        # Also advanced while idle (postBatchResumeToken), so a restart does not replay old oplog entries
+        if stream.resume_token is not None and stream.resume_token != saved_token:
+            db_client.save_resume_token(STREAM_NAME, stream.resume_token)
+            saved_token = stream.resume_token
@@ -3,21 +3,34 @@ import subprocess
 import json
 import time
 import random
-from typing import Any, List, Dict, Optional
+from typing import Any, List, Dict, Optional, Tuple
+
+from database import to_dict
+from prediction.fingerprint import text_hash
+from prediction.near_duplicates import NearDuplicates
 
 
 class FacebookScraperProcessor:
-    def __init__(self, db_client: Any, sentiment_predictor: Any, text_translator: Any) -> None:
+    def __init__(self, db_client: Any, sentiment_predictor: Any, text_translator: Any,
+                 near_duplicates: Optional[NearDuplicates] = None,
+                 model_versions: Optional[Dict[str, str]] = None) -> None:
         """
         Initializes the FacebookScraperProcessor with a database client, sentiment predictor, and text translator.
 
         :param db_client: Database client used to fetch and update documents.
         :param sentiment_predictor: Sentiment predictor for determining whether text is political or non-political.
         :param text_translator: Text translator for translating the post and comment texts.
+        :param near_duplicates: NearDuplicates(["posts", "comments"]) to reuse the translations and predictions of
+            near-duplicate posts and comments; None translates and predicts every text.
+        :param model_versions: Fingerprint of the political model behind sentiment_predictor
+            (prediction.fingerprint.political_model_versions); cached and near-duplicate predictions of other
+            models are not reused. None leaves predictions unstamped.
         """
         self.db_client = db_client
         self.sentiment_predictor = sentiment_predictor
         self.text_translator = text_translator
+        self.near_duplicates = near_duplicates
+        self.model_versions = model_versions
 
     def process(self) -> None:
         """
@@ -28,39 +41,53 @@ class FacebookScraperProcessor:
 
         for doc in unpredicted_docs:
             post_text: str = doc.get("post_text", "")
-            translated_text: Optional[str] = self.text_translator.translate_text(post_text) if post_text else None
-
             i += 1
 
+            # Re-scraped posts whose texts did not change reuse their translations and predictions
+            content_hash = text_hash(post_text, *doc.get("two_comments", []))
+            cached = self.db_client.get_cached_predictions(f"facebook:{content_hash}")
+            if cached is not None and cached.get("model_versions") == self.model_versions:
+                update_fields = dict(cached["fields"])
+                update_fields["post_text_prediction_data"] = {
+                    **update_fields["post_text_prediction_data"],
+                    "predictedAt": datetime.now(timezone.utc).isoformat(),
+                }
+                update_fields["text_hash"] = content_hash
+                # A re-scraped political post is still followed up, whether or not its texts changed
+                if update_fields["final_the_poli"] == 'political':
+                    self._scrape_political_post(doc)
+                self.db_client.update_doc(doc["_id"], update_fields)
+                print(f"{i}. Processed document {doc['_id']} (unchanged text, cached predictions)")
+                continue
+
             # Initialize final_the_poli as non-political by default
             final_the_poli: str = 'non-political'
 
             # Predict sentiment based on the translated post text
-            if translated_text:
-                sentiment: str = self.sentiment_predictor.predict(translated_text)
-                if sentiment == 'political':
-                    final_the_poli = 'political'
-            else:
-                sentiment = "non-political"
+            post_fields, reusable = (
+                self._predict_text("posts", post_text, self._predict_post) if post_text
+                else ({"tr_post_text": None, "prediction": "non-political"}, True)
+            )
+            translated_text: Optional[str] = post_fields["tr_post_text"]
+            sentiment: str = post_fields["prediction"]
+            if sentiment == 'political':
+                final_the_poli = 'political'
 
             # Process comments
             comment_data: List[Dict[str, Optional[str]]] = []
             comments: List[str] = doc.get("two_comments", [])
             if comments:
                 for comment in comments:
-                    translated_comment_text: Optional[str] = self.text_translator.translate_text(comment)
-                    comment_sentiment: str = (
-                        self.sentiment_predictor.predict(translated_comment_text)
-                        if translated_comment_text else "non-political"
-                    )
-                    if comment_sentiment == 'political':
+                    comment_fields, comment_reusable = self._predict_text("comments", comment, self._predict_comment)
+                    reusable = reusable and comment_reusable
+                    if comment_fields["comment_sentiment"] == 'political':
                         final_the_poli = 'political'
 
                     # Store comment data
                     comment_data.append({
                         "original_comment": comment,
-                        "translated_comment": translated_comment_text,
-                        "comment_sentiment": comment_sentiment
+                        "translated_comment": comment_fields["translated_comment"],
+                        "comment_sentiment": comment_fields["comment_sentiment"]
                     })
 
             # Prepare the fields to be updated in the document
@@ -76,27 +103,66 @@ class FacebookScraperProcessor:
 
             # If the post is political, run the external Node.js script
             if final_the_poli == 'political':
-                try:
-                    print(f'\t\t> political - {doc["post_text"]}')
-                    doc_json: str = json.dumps(doc, default=str)
-                    print(doc_json)
-
-                    # Sleep for a random duration between 1 and 180 seconds
-                    time.sleep(random.uniform(1, 180))
-
-                    # Run the external Node.js scraper script
-                    result = subprocess.run(
-                        ['node', '../scrapers/dist/facebook_SinglePostScraper.js', doc_json],
-                        capture_output=True,
-                        text=True,
-                        encoding='utf-8',
-                        check=True  # Raises CalledProcessError if the script fails
-                    )
-                except subprocess.CalledProcessError as e:
-                    print(f"An error occurred while running the script: {e.stderr}")
+                self._scrape_political_post(doc)
+
+            if self.model_versions:
+                update_fields["model_versions"] = self.model_versions
+            # A failed translation was labelled non-political; the next run translates it again
+            if reusable:
+                self.db_client.cache_predictions(f"facebook:{content_hash}",
+                                                 {"model_versions": self.model_versions, "fields": update_fields})
+            update_fields["text_hash"] = content_hash
 
             # Update the document in the database
             self.db_client.update_doc(doc["_id"], update_fields)
             print(f"{i}. Processed document {doc['_id']}")
 
+        self.db_client.flush()
+        if self.near_duplicates is not None:
+            self.near_duplicates.save()
+            print(self.near_duplicates.report())
         print("Translation, sentiment prediction, and update completed for unpredicted documents.")
+
+    @staticmethod
+    def _scrape_political_post(doc: Dict[str, Any]) -> None:
+        try:
+            print(f'\t\t> political - {doc["post_text"]}')
+            doc_json: str = json.dumps(to_dict(doc), default=str)
+            print(doc_json)
+
+            # Sleep for a random duration between 1 and 180 seconds
+            time.sleep(random.uniform(1, 180))
+
+            # Run the external Node.js scraper script
+            subprocess.run(
+                ['node', '../scrapers/dist/facebook_SinglePostScraper.js', doc_json],
+                capture_output=True,
+                text=True,
+                encoding='utf-8',
+                check=True  # Raises CalledProcessError if the script fails
+            )
+        except subprocess.CalledProcessError as e:
+            print(f"An error occurred while running the script: {e.stderr}")
+
+    def _predict_text(self, name: str, text: str, run: Any) -> Tuple[Dict[str, Any], bool]:
+        # Near-duplicate posts and comments (reposted stories, bot comments) reuse translations and predictions
+        if self.near_duplicates is None:
+            fields, _, reusable = run(text)
+            return fields, reusable
+        return self.near_duplicates.predict(name, text, run, self.model_versions)
+
+    def _predict_post(self, post_text: str) -> Tuple[Dict[str, Any], Dict[str, int], bool]:
+        translated_text: Optional[str] = self.text_translator.translate_text(post_text)
+        if not translated_text:
+            return {"tr_post_text": translated_text, "prediction": "non-political"}, {"translation": 1}, False
+        sentiment: str = self.sentiment_predictor.predict(translated_text)
+        return {"tr_post_text": translated_text, "prediction": sentiment}, {"translation": 1, "inference": 1}, True
+
+    def _predict_comment(self, comment: str) -> Tuple[Dict[str, Any], Dict[str, int], bool]:
+        translated_comment_text: Optional[str] = self.text_translator.translate_text(comment)
+        if not translated_comment_text:
+            return {"translated_comment": translated_comment_text, "comment_sentiment": "non-political"}, \
+                {"translation": 1}, False
+        comment_sentiment: str = self.sentiment_predictor.predict(translated_comment_text)
+        return {"translated_comment": translated_comment_text, "comment_sentiment": comment_sentiment}, \
+            {"translation": 1, "inference": 1}, True
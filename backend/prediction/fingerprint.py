@@ -0,0 +1,93 @@
+import hashlib
+import os
+import unicodedata
+from typing import Dict, Optional
+
+FINGERPRINT_LENGTH = 16
+_READ_SIZE = 1 << 20
+# (path, size, mtime) -> digest, so a checkpoint is only hashed once per process
+_file_digests: Dict[tuple, str] = {}
+
+
+def _file_digest(path: str) -> str:
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(_READ_SIZE), b''):
+                digest.update(block)
+        _file_digests[key] = digest.hexdigest()
+    return _file_digests[key]
+
+
+def file_fingerprint(*paths: str, extra: Optional[str] = None) -> str:
+    """
+    Content fingerprint of model files: the sha256 of every file, walking directories in sorted order,
+    together with their paths relative to the given root. Renaming or moving a checkpoint keeps its
+    fingerprint; changing a weight or config file changes it.
+
+    :param paths: Files or directories, e.g. a checkpoint and its config.
+    :param extra: Anything else the predictions depend on, e.g. the label mapping.
+    :return: The first FINGERPRINT_LENGTH hex digits.
+    """
+    digest = hashlib.sha256()
+    for root in paths:
+        if os.path.isdir(root):
+            files = sorted(
+                os.path.join(directory, name)
+                for directory, _, names in os.walk(root)
+                for name in names
+            )
+        else:
+            files = [root]
+        for path in files:
+            relative = os.path.relpath(path, root) if os.path.isdir(root) else os.path.basename(path)
+            digest.update(relative.encode('utf-8'))
+            digest.update(_file_digest(path).encode('ascii'))
+    if extra is not None:
+        digest.update(extra.encode('utf-8'))
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def normalize_text(text: Optional[str]) -> str:
+    # Case, Unicode form and whitespace differences between scrapes do not change the text
+    return ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+
+
+def text_hash(*texts: Optional[str]) -> str:
+    """
+    sha256 of the normalized texts a prediction was made from, in order (e.g. content, title, comments).
+    """
+    return hashlib.sha256('\x1f'.join(normalize_text(text) for text in texts).encode('utf-8')).hexdigest()
+
+
+def textblob_fingerprint() -> str:
+    # the_senti is TextBlob's lexicon polarity, versioned by the installed package
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return f"textblob-{version('textblob')}"
+    except PackageNotFoundError:
+        return "textblob-unknown"
+
+
+def political_model_versions(the_poli_model_path: str, the_poli_config_path: str) -> Dict[str, str]:
+    # The Facebook processor only runs the political model (on translated texts)
+    return {"the_poli": file_fingerprint(the_poli_model_path, the_poli_config_path)}
+
+
+def model_versions(
+        the_poli_model_path: str,
+        the_poli_config_path: str,
+        the_candi_dir: str,
+        label_dict: Dict[int, str]
+) -> Dict[str, str]:
+    """
+    Fingerprints of the models behind pt_the_poli, pt_the_candi and pt_the_senti, as stored in the
+    model_versions field of every predicted document.
+    """
+    return {
+        "the_poli": file_fingerprint(the_poli_model_path, the_poli_config_path),
+        "the_candi": file_fingerprint(the_candi_dir, extra=repr(sorted(label_dict.items()))),
+        "the_senti": textblob_fingerprint(),
+    }
@@ -1,10 +1,84 @@
 from datetime import datetime, timezone
-from typing import Any, Dict
-from prediction.the_waiter import analyze_posts
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import bson
+
+from prediction.the_waiter import WAITER_FIELDS, process_post, finalize_results, decompose_post
+from prediction.fingerprint import text_hash
+from prediction.near_duplicates import NearDuplicates
 from prediction.the_candi import CandidatePredictor
 from prediction.the_senti import calculate_sentiment_score
 from prediction.translator import TextTranslator
 
+# Fields read by the prediction pass; the rest of the article (e.g. newsContentLl) is not fetched
+UNPREDICTED_FIELDS = {"newsContentEn": 1, "newsTitleEn": 1, "top_comments": 1}
+# Fields process_docs needs to predict and weight in one go; top_comments already covers the comment fields
+FRESH_DOC_FIELDS = {**UNPREDICTED_FIELDS, **{f: 1 for f in WAITER_FIELDS if not f.startswith("top_comments.")}}
+
+
+def comment_set_paths(index: int, fields: Dict[str, Any]) -> Dict[str, Any]:
+    # {"pt_the_candi": ...} of comment 3 -> {"top_comments.3.pt_the_candi": ...}
+    return {f"top_comments.{index}.{field}": value for field, value in fields.items()}
+
+
+def political_only_paths(doc: Dict[str, Any]) -> List[str]:
+    # Fields only political articles carry, to $unset when an article is (re-)scored as non-political
+    return ["pt_the_candi", "pt_the_senti", "pt_the_waiter"] + [
+        f"top_comments.{index}.{field}"
+        for index in range(len(doc.get("top_comments", [])))
+        for field in ("pt_the_candi", "pt_the_senti")
+    ]
+
+
+def apply_set_paths(doc: Dict[str, Any], update_fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The document as it reads after $set-ting update_fields, without a round trip to the database.
+    Handles top-level fields and the top_comments.<index>.<field> paths of comment_set_paths.
+    """
+    updated = {key: value for key, value in doc.items() if key != "top_comments"}
+    top_comments = [dict(comment) for comment in doc.get("top_comments", [])]
+    for path, value in update_fields.items():
+        if path.startswith("top_comments."):
+            _, index, field = path.split(".", 2)
+            top_comments[int(index)][field] = value
+        else:
+            updated[path] = value
+    if "top_comments" in doc:
+        updated["top_comments"] = top_comments
+    return updated
+
+
+def update_sizes(doc: Dict[str, Any], update_fields: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    BSON size of the $set sent for update_fields, and of the same update written the old way, with the
+    whole top_comments array (original comment bodies included) in a single top_comments field.
+
+    :return: (delta bytes, whole-array bytes).
+    """
+    full_fields = {path: value for path, value in update_fields.items() if not path.startswith("top_comments.")}
+    if len(full_fields) < len(update_fields):
+        full_fields["top_comments"] = apply_set_paths(doc, update_fields)["top_comments"]
+    return len(bson.encode({"$set": update_fields})), len(bson.encode({"$set": full_fields}))
+
+
+def prediction_cache_entry(update_fields: Dict[str, Any], model_versions: Optional[Dict[str, str]]) -> Dict[str, Any]:
+    # The model outputs of a prediction update; comment fields are kept by comment index
+    fields, comments = {}, {}
+    for path, value in update_fields.items():
+        if path.startswith("top_comments."):
+            _, index, field = path.split(".", 2)
+            comments.setdefault(index, {})[field] = value
+        elif path not in ("predictedAt", "text_hash"):
+            fields[path] = value
+    return {"model_versions": model_versions, "fields": fields, "comments": comments}
+
+
+def cached_update_fields(entry: Dict[str, Any]) -> Dict[str, Any]:
+    update_fields = dict(entry["fields"])
+    for index, comment_fields in entry["comments"].items():
+        update_fields.update(comment_set_paths(int(index), comment_fields))
+    return update_fields
+
 
 class HelakuruScraperProcessor:
     def __init__(
@@ -13,9 +87,20 @@ class HelakuruScraperProcessor:
             political_predictor: Any,
             the_candi_dir: str,
             label_dict: Dict[int, str],
-            tr_url: str
+            tr_url: str,
+            model_versions: Optional[Dict[str, str]] = None,
+            near_duplicates: Optional[NearDuplicates] = None
     ) -> None:
+        """
+        :param model_versions: Fingerprints of the_poli, the_candi and the_senti (prediction.fingerprint.model_versions)
+            stamped on every prediction; None leaves predictions unstamped.
+        :param near_duplicates: NearDuplicates(["articles", "comments"]) to reuse the predictions of near-duplicate
+            articles and comments; None scores every text.
+        """
         self.db_client = db_client
+        self.model_versions = model_versions
+        self.near_duplicates = near_duplicates
+        self.nlp_cache_stats = {"hits": 0, "misses": 0}
         self.political_predictor = political_predictor
         self.candidate_predictor = CandidatePredictor(
             model_dir=the_candi_dir, label_dict=label_dict
@@ -28,85 +113,185 @@ class HelakuruScraperProcessor:
         candidate prediction, sentiment analysis, and engagement analysis.
         """
         self._process_unpredicted_documents()
+        # Buffered predictions must reach the database before the unweighted query runs
+        self.db_client.flush()
         self._process_unweighted_documents()
+        self.db_client.flush()
+        print(f"NLP cache: {self.nlp_cache_stats['hits']} hits, {self.nlp_cache_stats['misses']} misses")
+        if self.near_duplicates is not None:
+            self.near_duplicates.save()
+            print(self.near_duplicates.report())
         print("Processing of Helakuru articles completed.")
 
+    def process_docs(self, docs: Iterable[Dict[str, Any]]) -> int:
+        """
+        Predicts and weights documents in one pass, with a single update per document.
+
+        :param docs: Documents with the UNPREDICTED_FIELDS and WAITER_FIELDS of the article.
+        :return: Number of documents processed.
+        """
+        count = 0
+        for count, doc in enumerate(docs, start=1):
+            update_fields = self.predict_doc(doc)
+            if update_fields["pt_the_poli"]["final_the_poli"] == "political":
+                update_fields.update(self.weight_doc(apply_set_paths(doc, update_fields)) or {})
+                self.db_client.update_doc(doc["_id"], update_fields)
+            else:
+                # A re-scored article that is no longer political must not keep counting its old weights
+                self.db_client.update_doc(doc["_id"], update_fields, unset_fields=political_only_paths(doc))
+            print(f"{count}. Processed article {doc['_id']}")
+        self.db_client.flush()
+        return count
+
     def _process_unpredicted_documents(self) -> None:
-        unprocessed_docs = self.db_client.find_unpredicted_texts_docs()
-
-        for index, doc in enumerate(unprocessed_docs, start=1):
-            article_text = doc.get("newsContentEn", "")
-            if article_text == "":
-                article_text = doc.get("newsTitleEn", "")
-            predicted_time = datetime.now(timezone.utc).isoformat()
-            update_fields: Dict[str, Any] = {
-                "predictedAt": predicted_time,
-                "pt_the_poli": {
-                    "prediction": "non-political",
-                    "final_the_poli": "non-political",
-                },
+        # Political articles are weighted in the same update, so an article re-predicted after a re-scrape
+        # gets weights from its current counts even if it still carries older ones
+        unprocessed_docs = self.db_client.find_unpredicted_texts_docs(projection=FRESH_DOC_FIELDS)
+        self.process_docs(unprocessed_docs)
+
+    def predict_doc(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Runs the political, candidate and sentiment predictions for one article and its top comments.
+
+        Predictions are cached by a hash of the article's texts, so an article re-scraped with new counts
+        but the same texts (and the same models) skips translation and inference. With near_duplicates, each
+        article and comment text close enough to one scored before reuses that text's predictions.
+
+        :return: The fields to set on the document; comment fields as top_comments.<index>.<field> paths.
+        """
+        article_text = doc.get("newsContentEn", "")
+        if article_text == "":
+            article_text = doc.get("newsTitleEn", "")
+        predicted_time = datetime.now(timezone.utc).isoformat()
+        content_hash = text_hash(
+            doc.get("newsContentEn", ""),
+            doc.get("newsTitleEn", ""),
+            *(comment.get("commentText") for comment in doc.get("top_comments", [])),
+        )
+
+        cached = self.db_client.get_cached_predictions(f"helakuru:{content_hash}")
+        if cached is not None and cached.get("model_versions") == self.model_versions:
+            self.nlp_cache_stats["hits"] += 1
+            return {"predictedAt": predicted_time, "text_hash": content_hash,
+                    **cached_update_fields(cached)}
+        self.nlp_cache_stats["misses"] += 1
+
+        update_fields: Dict[str, Any] = {
+            "predictedAt": predicted_time,
+            "text_hash": content_hash,
+            "pt_the_poli": {
+                "prediction": "non-political",
+                "final_the_poli": "non-political",
+            },
+        }
+
+        reusable = True
+        if article_text:
+            article_fields, reusable = self._predict_text("articles", article_text, self._predict_article)
+            update_fields.update(article_fields)
+
+            if update_fields["pt_the_poli"]["final_the_poli"] == "political":
+                # Process top comments; only the computed fields are written back, by position
+                top_comments = doc.get("top_comments", [])
+                for comment_index, comment in enumerate(top_comments):  # Process up to 10 comments
+                    comment_text = comment.get("commentText", None)
+                    if comment_text:
+                        comment_fields, comment_reusable = self._predict_text("comments", comment_text,
+                                                                              self._predict_comment)
+                        reusable = reusable and comment_reusable
+                        update_fields.update(comment_set_paths(comment_index, comment_fields))
+
+        if self.model_versions:
+            # Non-political articles only went through the_poli
+            ran = ("the_poli", "the_candi", "the_senti") if update_fields["pt_the_poli"]["final_the_poli"] == "political" \
+                else ("the_poli",)
+            update_fields["model_versions"] = {model: self.model_versions[model] for model in ran}
+
+        # An article with a failed comment translation is scored again next time rather than replayed
+        if reusable:
+            self.db_client.cache_predictions(f"helakuru:{content_hash}",
+                                             prediction_cache_entry(update_fields, self.model_versions))
+        return update_fields
+
+    def _predict_text(self, name: str, text: str, run: Any) -> Tuple[Dict[str, Any], bool]:
+        # Near-duplicates of already scored articles and comments reuse their predictions
+        if self.near_duplicates is None:
+            fields, _, reusable = run(text)
+            return fields, reusable
+        return self.near_duplicates.predict(name, text, run, self.model_versions)
+
+    def _predict_article(self, article_text: str) -> Tuple[Dict[str, Any], Dict[str, int], bool]:
+        fields: Dict[str, Any] = {"pt_the_poli": {"prediction": "non-political", "final_the_poli": "non-political"}}
+
+        # Perform political prediction
+        political_prediction = self.political_predictor.predict(article_text)
+        fields["pt_the_poli"]["prediction"] = political_prediction
+        if political_prediction != "political":
+            return fields, {"inference": 1}, True
+        fields["pt_the_poli"]["final_the_poli"] = "political"
+
+        # Perform candidate prediction
+        candidate_score = self.candidate_predictor.predict(article_text)
+        if candidate_score is not None:
+            fields["pt_the_candi"] = candidate_score
+
+        # Perform sentiment analysis
+        sentiment_score = calculate_sentiment_score(article_text)
+        if sentiment_score is not None:
+            fields["pt_the_senti"] = {
+                "sentiment_score": sentiment_score,
             }
+        return fields, {"inference": 3}, True
 
-            if article_text:
-                # Perform political prediction
-                political_prediction = self.political_predictor.predict(article_text)
-                update_fields["pt_the_poli"]["prediction"] = political_prediction
-
-                if political_prediction == "political":
-                    update_fields["pt_the_poli"]["final_the_poli"] = "political"
-
-                    # Perform candidate prediction
-                    candidate_score = self.candidate_predictor.predict(article_text)
-                    if candidate_score is not None:
-                        update_fields["pt_the_candi"] = candidate_score
-
-                    # Perform sentiment analysis
-                    sentiment_score = calculate_sentiment_score(article_text)
-                    if sentiment_score is not None:
-                        update_fields["pt_the_senti"] = {
-                            "sentiment_score": sentiment_score,
-                        }
-
-                    # Process top comments
-                    top_comments = doc.get("top_comments", [])
-                    for comment in top_comments:  # Process up to 10 comments
-                        comment_text = comment.get("commentText", None)
-                        if comment_text:
-                            tr_comment_text = self.the_trans.translate_text(comment_text)
-                            if tr_comment_text is not None:
-                                comment["tr_comment_text"] = tr_comment_text
-                            cm_sentiment_score = calculate_sentiment_score(tr_comment_text)
-                            if cm_sentiment_score is not None:
-                                comment["pt_the_senti"] = {
-                                    "sentiment_score": cm_sentiment_score,
-                                }
-                            cm_candidate_score = self.candidate_predictor.predict(tr_comment_text)
-                            if cm_candidate_score is not None:
-                                comment["pt_the_candi"] = cm_candidate_score
-
-                    # Add updated comments back to the document
-                    update_fields["top_comments"] = top_comments
-
-            # Update the document in the database
-            self.db_client.update_doc(doc["_id"], update_fields)
-            print(f"{index}. Processed article {doc['_id']}")
+    def _predict_comment(self, comment_text: str) -> Tuple[Dict[str, Any], Dict[str, int], bool]:
+        comment_fields: Dict[str, Any] = {}
+        tr_comment_text = self.the_trans.translate_text(comment_text)
+        if tr_comment_text is None:
+            # Nothing to score; a failed translation is not reused
+            return comment_fields, {"translation": 1}, False
+        comment_fields["tr_comment_text"] = tr_comment_text
+        cm_sentiment_score = calculate_sentiment_score(tr_comment_text)
+        if cm_sentiment_score is not None:
+            comment_fields["pt_the_senti"] = {
+                "sentiment_score": cm_sentiment_score,
+            }
+        cm_candidate_score = self.candidate_predictor.predict(tr_comment_text)
+        if cm_candidate_score is not None:
+            comment_fields["pt_the_candi"] = cm_candidate_score
+        return comment_fields, {"translation": 1, "inference": 2}, True
 
     def _process_unweighted_documents(self) -> None:
         """
         Processes documents that have not yet been weighted for engagement.
         Performs engagement analysis and updates the corresponding fields in the database.
         """
-        unweighted_docs = self.db_client.find_unweighted_text_docs()
+        unweighted_docs = self.db_client.find_unweighted_text_docs(projection=WAITER_FIELDS)
 
         for index, doc in enumerate(unweighted_docs, start=1):
-            total_candidate_weights, normalized_candidate_weights, total_field_contributions = analyze_posts([doc])
-
-            if total_candidate_weights and normalized_candidate_weights:
-                update_fields: Dict[str, Any] = {
-                    "pt_the_waiter": {
-                        "total_candidate_weights": total_candidate_weights,
-                        "normalized_candidate_weights": normalized_candidate_weights,
-                    }
-                }
+            update_fields = self.weight_doc(doc)
+            if update_fields:
                 self.db_client.update_doc(doc["_id"], update_fields)
                 print(f"{index}. Updated weights for article {doc['_id']}")
+
+    @staticmethod
+    def weight_doc(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Runs the_waiter over one predicted article.
+
+        :return: The pt_the_waiter field to set, or None when the article carries no weight.
+        """
+        # A single post does not need a process pool
+        total_candidate_weights, normalized_candidate_weights, total_field_contributions = finalize_results(
+            process_post(doc)
+        )
+        if not (total_candidate_weights and normalized_candidate_weights):
+            return None
+        return {
+            "pt_the_waiter": {
+                "total_candidate_weights": total_candidate_weights,
+                "normalized_candidate_weights": normalized_candidate_weights,
+                # Undecayed components for query-time decay (the_waiter.decay_pipeline)
+                "components": decompose_post(doc),
+                "weightedAt": datetime.now(timezone.utc),
+            }
+        }
@@ -0,0 +1,220 @@
+import copy
+import json
+import os
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from prediction.fingerprint import normalize_text
+
+NEAR_DUP_THRESHOLD = float(os.getenv('NEAR_DUP_THRESHOLD', '0.9'))
+NEAR_DUP_DIR = os.getenv('NEAR_DUP_DIR', 'near_duplicates')
+# Texts kept per index (about 1 KB of signature each, plus the payload); the least recently matched go first
+NEAR_DUP_MAX_ITEMS = int(os.getenv('NEAR_DUP_MAX_ITEMS', '50000'))
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+# Mersenne prime 2^61 - 1; with a < 2^31 and 32-bit shingle hashes a * h + b stays below 2^64
+_PRIME = np.uint64((1 << 61) - 1)
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Bands and rows per band for num_perm permutations. The S-curve's steepest point, (1 / bands) ** (1 / rows),
+    is put just below the threshold, so pairs above it are rarely missed; candidates are then checked
+    against the threshold on their full signatures.
+    """
+    candidates = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [br for br in candidates if (1 / br[0]) ** (1 / br[1]) <= threshold]
+    return max(below or candidates[:1], key=lambda br: (1 / br[0]) ** (1 / br[1]))
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    # 32-bit hashes of the character shingles of the normalized text
+    text = normalize_text(text)
+    if len(text) <= size:
+        return np.array([zlib.crc32(text.encode('utf-8'))], dtype=np.uint64)
+    return np.array(
+        list({zlib.crc32(text[i:i + size].encode('utf-8')) for i in range(len(text) - size + 1)}), dtype=np.uint64
+    )
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures of normalized texts in an LSH index, each with the payload (e.g. translations and
+    predictions) of the item it was computed for. query() returns the payload of the most similar
+    indexed text whose estimated Jaccard similarity of shingles reaches the threshold.
+
+    The index lives in memory and holds at most max_items texts, evicting the least recently matched one
+    when full. All of them were scored by the same models (model_key); clear() empties the index when they
+    change. save() writes it to an .npz file that the constructor loads back.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD, num_perm: int = NUM_PERM, seed: int = 1,
+                 path: Optional[str] = None, max_items: int = NEAR_DUP_MAX_ITEMS) -> None:
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.seed = seed
+        self.path = path
+        self.max_items = max_items
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+        self.model_key: Optional[str] = None
+        # Item id -> (signature, payload), least recently matched first
+        self.items: "OrderedDict[int, Tuple[np.ndarray, Dict[str, Any]]]" = OrderedDict()
+        self.buckets = [defaultdict(list) for _ in range(self.bands)]
+        self.stats = {"queries": 0, "hits": 0, "evicted": 0}
+        self._next_item = 0
+        self._changed = False
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text)
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % _PRIME).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def query(self, signature: np.ndarray) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        :return: (payload, estimated similarity) of the best match at or above the threshold, or None.
+        """
+        self.stats["queries"] += 1
+        candidates = {item for bucket, key in zip(self.buckets, self._band_keys(signature)) for item in bucket.get(key, ())}
+        best, best_similarity = None, self.threshold
+        for item in candidates:
+            similarity = float(np.mean(self.items[item][0] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = item, similarity
+        if best is None:
+            return None
+        self.stats["hits"] += 1
+        self.items.move_to_end(best)
+        return self.items[best][1], best_similarity
+
+    def add(self, signature: np.ndarray, payload: Dict[str, Any]) -> None:
+        while self.items and len(self.items) >= self.max_items:
+            self._evict()
+        item, self._next_item = self._next_item, self._next_item + 1
+        self.items[item] = (signature, payload)
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            bucket[key].append(item)
+        self._changed = True
+
+    def _evict(self) -> None:
+        item, (signature, _) = self.items.popitem(last=False)
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            bucket[key].remove(item)
+            if not bucket[key]:
+                del bucket[key]
+        self.stats["evicted"] += 1
+
+    def clear(self, model_key: Optional[str] = None) -> None:
+        # Drops every text, e.g. when the models their payloads came from were replaced
+        self.items.clear()
+        self.buckets = [defaultdict(list) for _ in range(self.bands)]
+        self.model_key = model_key
+        self._changed = True
+
+    def save(self, path: Optional[str] = None) -> None:
+        # The file is only rewritten when texts were added or dropped since it was loaded or last saved
+        path = path or self.path
+        if not self._changed and os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        signatures = np.vstack([signature for signature, _ in self.items.values()]) if self.items \
+            else np.zeros((0, self.num_perm), dtype=np.uint64)
+        # np.savez appends .npz to other names, so write to a temporary .npz and move it over the index
+        temporary = f"{path}.tmp.npz"
+        np.savez_compressed(
+            temporary,
+            signatures=signatures,
+            payloads=np.array(json.dumps([payload for _, payload in self.items.values()], default=str)),
+            params=np.array([self.num_perm, self.seed], dtype=np.int64),
+            model_key=np.array(self.model_key or ""),
+        )
+        os.replace(temporary, path)
+        self._changed = False
+
+    def load(self, path: str) -> None:
+        with np.load(path) as stored:
+            if list(stored['params']) != [self.num_perm, self.seed]:
+                print(f"Ignoring near-duplicate index {path}: built with other MinHash parameters")
+                return
+            # Indexes saved before model keys were stored are cleared on first use
+            self.model_key = (str(stored['model_key']) or None) if 'model_key' in stored else None
+            payloads = json.loads(str(stored['payloads']))
+            # Least recently matched first, so the most recent survive when the file holds more than max_items
+            for signature, payload in zip(stored['signatures'], payloads):
+                self.add(signature, payload)
+        self._changed = False
+
+
+class NearDuplicates:
+    """
+    Near-duplicate reuse for a processor: one persisted NearDuplicateIndex per kind of text (e.g. articles and
+    comments), and counts of the translation and inference calls made and avoided through it.
+    """
+
+    def __init__(self, names: List[str], threshold: float = NEAR_DUP_THRESHOLD, directory: str = NEAR_DUP_DIR) -> None:
+        self.indexes = {
+            name: NearDuplicateIndex(threshold, path=os.path.join(directory, f"{name}.npz")) for name in names
+        }
+        self.calls = {call: {"made": 0, "avoided": 0} for call in ("translation", "inference")}
+
+    def predict(
+            self,
+            name: str,
+            text: str,
+            run: Callable[[str], Tuple[Dict[str, Any], Dict[str, int], bool]],
+            model_versions: Optional[Dict[str, str]] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        The fields of an already scored near-duplicate of text, if one was scored with the same model_versions;
+        otherwise the fields computed by run(text), which are then indexed for the texts that follow. Returned
+        with whether they are reusable, which the fields of a near-duplicate always are.
+
+        :param name: Index to look in, e.g. "comments".
+        :param run: Translates and predicts one text; returns (fields, calls made by kind, reusable). Fields of
+            a failed translation should not be reusable.
+        """
+        index = self.indexes[name]
+        model_key = json.dumps(model_versions, sort_keys=True)
+        if index.model_key != model_key:
+            # Texts scored by other models cannot be reused by these, now or later
+            index.clear(model_key)
+        signature = index.signature(text)
+        match = index.query(signature)
+        if match is not None and match[0]["model_versions"] == model_versions:
+            payload = match[0]
+            for call, count in payload["calls"].items():
+                self.calls[call]["avoided"] += count
+            return copy.deepcopy(payload["fields"]), True
+
+        fields, calls, reusable = run(text)
+        for call, count in calls.items():
+            self.calls[call]["made"] += count
+        if reusable:
+            index.add(signature, {"model_versions": model_versions, "fields": copy.deepcopy(fields), "calls": calls})
+        return fields, reusable
+
+    def avoided_fraction(self, call: str) -> float:
+        counts = self.calls[call]
+        total = counts["made"] + counts["avoided"]
+        return counts["avoided"] / total if total else 0.0
+
+    def report(self) -> str:
+        return "Near-duplicates: " + ", ".join(
+            f"{counts['avoided']} of {counts['made'] + counts['avoided']} {call} calls avoided "
+            f"({self.avoided_fraction(call):.1%})"
+            for call, counts in self.calls.items()
+        )
+
+    def save(self) -> None:
+        for index in self.indexes.values():
+            index.save()
@@ -0,0 +1,168 @@
+from datetime import datetime, timezone
+from math import log
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import yaml
+
+from prediction.the_waiter import (
+    CANDIDATES,
+    ENGAGEMENT_WEIGHTS,
+    HALF_LIFE_DAYS,
+    REACTION_WEIGHTS,
+    STREAM_CHUNK_SIZE,
+    chunked,
+    normalize_candidate_weights,
+    parse_datetime,
+)
+
+DEFAULT_PROFILE = 'default'
+PROFILE_KEYS = ('reaction_weights', 'engagement_weights', 'half_life_days')
+SECONDS_PER_DAY = 24 * 3600
+
+
+def default_profile() -> Dict[str, Any]:
+    # The weights the_waiter currently runs with
+    return {
+        'reaction_weights': dict(REACTION_WEIGHTS),
+        'engagement_weights': dict(ENGAGEMENT_WEIGHTS),
+        'half_life_days': HALF_LIFE_DAYS,
+    }
+
+
+def load_profiles(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Loads named weighting profiles from a YAML file. Every profile overrides the default
+    profile, so it only has to list the weights it changes:
+
+        profiles:
+          slow_decay:
+            half_life_days: 30
+          v2_reactions:
+            reaction_weights: {like: 0.10, love: 0.10, haha: -0.05, wow: 0.005, angry: -0.10, sad: -0.005}
+
+    :param path: Path of the YAML file.
+    :return: Profiles by name, always including the default profile.
+    """
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+
+    profiles = {DEFAULT_PROFILE: default_profile()}
+    for name, overrides in (config.get('profiles') or {}).items():
+        unknown = set(overrides or {}) - set(PROFILE_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown keys in weighting profile '{name}': {', '.join(sorted(unknown))}")
+
+        profile = default_profile()
+        for key in ('reaction_weights', 'engagement_weights'):
+            profile[key].update((overrides or {}).get(key, {}))
+        profile['half_life_days'] = (overrides or {}).get('half_life_days', profile['half_life_days'])
+        profiles[name] = profile
+    return profiles
+
+
+def _unit_features(units: List[Dict[str, Any]], reaction_field: str, reaction_keys: List[str]) -> Dict[str, np.ndarray]:
+    return {
+        'reactions': np.array(
+            [[unit.get(reaction_field, {}).get(k, 0) for k in reaction_keys] for unit in units], dtype=np.float64
+        ).reshape(-1, len(reaction_keys)),
+        'published': np.array(
+            [parse_datetime(unit.get('publishedAt')).timestamp() / SECONDS_PER_DAY for unit in units], dtype=np.float64
+        ),
+        'sentiment': np.array(
+            [unit.get('pt_the_senti', {}).get('sentiment_score', 0) for unit in units], dtype=np.float64
+        ),
+        'candidates': np.array(
+            [[unit.get('pt_the_candi', {}).get(c, 0) for c in CANDIDATES] for unit in units], dtype=np.float64
+        ).reshape(-1, len(CANDIDATES)),
+    }
+
+
+def build_features(posts_data: List[Dict[str, Any]], reaction_keys: List[str]) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Profile-independent feature matrices of posts and their top comments, computed once and
+    shared by every profile evaluated over them.
+    """
+    comments = [comment for data in posts_data for comment in data.get('top_comments', [])]
+
+    post_features = _unit_features(posts_data, 'reactions', reaction_keys)
+    # log1p(shares) and log1p(comments) columns, scaled by the profile's engagement weights
+    post_features['counts'] = np.log1p(np.array(
+        [[data.get('sharesCount', 0), data.get('commentCount', 0)] for data in posts_data], dtype=np.float64
+    ).reshape(-1, 2))
+
+    comment_features = _unit_features(comments, 'commentReaction', reaction_keys)
+    comment_features['counts'] = np.log1p(np.array(
+        [comment.get('commentReplyCount', 0) for comment in comments], dtype=np.float64
+    ).reshape(-1, 1))
+
+    return {'posts': post_features, 'comments': comment_features}
+
+
+def _weigh_units(
+        features: Dict[str, np.ndarray],
+        reaction_matrix: np.ndarray,
+        count_matrix: np.ndarray,
+        reaction_scale: np.ndarray,
+        lambda_decay: np.ndarray,
+        as_of: float
+) -> np.ndarray:
+    # Engagement of every unit under every profile: (units, K)
+    engagement = features['counts'] @ count_matrix
+    engagement += np.log1p(np.abs(features['reactions'] @ reaction_matrix)) * reaction_scale
+    age = np.maximum(as_of - features['published'], 0)
+    decay = np.exp(-np.outer(age, lambda_decay))
+    # (candidates, units) @ (units, K)
+    return (features['candidates'] * features['sentiment'][:, None]).T @ (engagement * decay)
+
+
+def evaluate_profiles(
+        posts_data: Iterable[Dict[str, Any]],
+        profiles: Dict[str, Dict[str, Any]],
+        as_of: Optional[datetime] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE
+) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Evaluates K weighting profiles over the same posts in a single pass. Each chunk of posts is turned
+    into shared feature matrices once; the profiles only enter as (features, K) weight matrices.
+
+    :param posts_data: Iterable of post documents (e.g. a Mongo cursor).
+    :param profiles: Profiles by name, as returned by load_profiles.
+    :param as_of: Time the decay is computed against, defaults to now.
+    :return: Total and normalized candidate weights by profile name.
+    """
+    names = list(profiles)
+    reaction_keys = sorted(set().union(*(profiles[name]['reaction_weights'] for name in names)))
+    as_of_days = (as_of or datetime.now(timezone.utc)).timestamp() / SECONDS_PER_DAY
+
+    reaction_matrix = np.array(
+        [[profiles[name]['reaction_weights'].get(k, 0) for name in names] for k in reaction_keys], dtype=np.float64
+    )
+    engagement = {
+        key: np.array([profiles[name]['engagement_weights'][key] for name in names], dtype=np.float64)
+        for key in ENGAGEMENT_WEIGHTS
+    }
+    lambda_decay = np.array([log(2) / profiles[name]['half_life_days'] for name in names], dtype=np.float64)
+    post_counts = np.vstack([engagement['shares'], engagement['comments']])
+    comment_counts = engagement['comment_replies'][None, :]
+
+    totals = np.zeros((len(CANDIDATES), len(names)))
+    for chunk in chunked(posts_data, chunk_size):
+        features = build_features(chunk, reaction_keys)
+        # Post reactions are added unscaled, comment reactions carry the comment_reactions weight
+        totals += _weigh_units(
+            features['posts'], reaction_matrix, post_counts, np.ones(len(names)), lambda_decay, as_of_days
+        )
+        totals += _weigh_units(
+            features['comments'], reaction_matrix, comment_counts, engagement['comment_reactions'],
+            lambda_decay, as_of_days
+        )
+
+    standings = {}
+    for k, name in enumerate(names):
+        total_candidate_weights = {c: float(totals[i, k]) for i, c in enumerate(CANDIDATES)}
+        standings[name] = {
+            'total_candidate_weights': total_candidate_weights,
+            'normalized_candidate_weights': normalize_candidate_weights(total_candidate_weights),
+        }
+    return standings
@@ -25,6 +25,17 @@ CURRENT_TIME = datetime.now(timezone.utc)
 
 CANDIDATES = ['anura', 'sajith', 'ranil', 'other', 'no_one']
 
+# Number of documents held in memory at once by the streaming aggregator
+STREAM_CHUNK_SIZE = 1000
+
+# Fields process_post reads; use as a Mongo projection when streaming documents
+WAITER_FIELDS = {
+    'publishedAt': 1, 'pt_the_candi': 1, 'pt_the_senti': 1,
+    'sharesCount': 1, 'commentCount': 1, 'reactions': 1,
+    'top_comments.publishedAt': 1, 'top_comments.pt_the_candi': 1, 'top_comments.pt_the_senti': 1,
+    'top_comments.commentReplyCount': 1, 'top_comments.commentReaction': 1,
+}
+
 
 def parse_datetime(date_str):
     try:
@@ -34,8 +45,13 @@ def parse_datetime(date_str):
         return CURRENT_TIME
 
 
-def calculate_decay_factor(published_at):
-    delta_t = (CURRENT_TIME - published_at).total_seconds() / (24 * 3600)
+def as_utc(value):
+    # pymongo returns naive UTC datetimes unless tz_aware is set
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def calculate_decay_factor(published_at, as_of=None):
+    delta_t = ((as_of or CURRENT_TIME) - published_at).total_seconds() / (24 * 3600)
     delta_t = max(delta_t, 0)
     return math.exp(-LAMBDA_DECAY * delta_t)
 
@@ -51,17 +67,7 @@ def calculate_weighted_reaction(reactions):
     return total_weighted_reactions, reaction_contributions
 
 
-def default_dict_float():
-    return defaultdict(float)
-
-
-def process_post(data):
-    # Parse post data
-    published_at = parse_datetime(data.get('publishedAt'))
-    decay_factor = calculate_decay_factor(published_at)
-    candidate_scores = data.get('pt_the_candi', {})
-    sentiment_score = data.get('pt_the_senti', {}).get('sentiment_score', 0)
-
+def calculate_post_engagement(data):
     # Calculate engagement metrics
     shares = data.get('sharesCount', 0)
     comments = data.get('commentCount', 0)
@@ -72,10 +78,39 @@ def process_post(data):
     norm_comments = np.log1p(comments)
     norm_weighted_reactions = np.log1p(abs(weighted_reactions))
 
-    # Engagement score for the post
     E_p_shares = ENGAGEMENT_WEIGHTS['shares'] * norm_shares
     E_p_comments = ENGAGEMENT_WEIGHTS['comments'] * norm_comments
     E_p_reactions = norm_weighted_reactions  # Reactions are directly added
+    return E_p_shares, E_p_comments, E_p_reactions, reaction_contributions
+
+
+def calculate_comment_engagement(comment_data):
+    comment_replies = comment_data.get('commentReplyCount', 0)
+    comment_weighted_reactions, comment_reaction_contributions = calculate_weighted_reaction(
+        comment_data.get('commentReaction', {}))
+
+    # Logarithmic scaling for normalization
+    norm_comment_reactions = np.log1p(abs(comment_weighted_reactions))
+    norm_comment_replies = np.log1p(comment_replies)
+
+    E_c_reactions = ENGAGEMENT_WEIGHTS['comment_reactions'] * norm_comment_reactions
+    E_c_replies = ENGAGEMENT_WEIGHTS['comment_replies'] * norm_comment_replies
+    return E_c_reactions, E_c_replies, comment_reaction_contributions
+
+
+def default_dict_float():
+    return defaultdict(float)
+
+
+def process_post(data):
+    # Parse post data
+    published_at = parse_datetime(data.get('publishedAt'))
+    decay_factor = calculate_decay_factor(published_at)
+    candidate_scores = data.get('pt_the_candi', {})
+    sentiment_score = data.get('pt_the_senti', {}).get('sentiment_score', 0)
+
+    # Engagement score for the post
+    E_p_shares, E_p_comments, E_p_reactions, reaction_contributions = calculate_post_engagement(data)
     E_p = E_p_shares + E_p_comments + E_p_reactions
 
     # Initialize candidate weights and contributions
@@ -106,17 +141,9 @@ def process_post(data):
         comment_decay_factor = calculate_decay_factor(comment_published_at)
         comment_candidate_scores = comment_data.get('pt_the_candi', {})
         comment_sentiment_score = comment_data.get('pt_the_senti', {}).get('sentiment_score', 0)
-        comment_replies = comment_data.get('commentReplyCount', 0)
-        comment_weighted_reactions, comment_reaction_contributions = calculate_weighted_reaction(
-            comment_data.get('commentReaction', {}))
-
-        # Logarithmic scaling for normalization
-        norm_comment_reactions = np.log1p(abs(comment_weighted_reactions))
-        norm_comment_replies = np.log1p(comment_replies)
 
         # Engagement score for the comment
-        E_c_reactions = ENGAGEMENT_WEIGHTS['comment_reactions'] * norm_comment_reactions
-        E_c_replies = ENGAGEMENT_WEIGHTS['comment_replies'] * norm_comment_replies
+        E_c_reactions, E_c_replies, comment_reaction_contributions = calculate_comment_engagement(comment_data)
         E_c = E_c_reactions + E_c_replies
 
         for candidate in CANDIDATES:
@@ -140,6 +167,71 @@ def process_post(data):
     return candidate_weights, field_contributions
 
 
+def decompose_post(data):
+    """
+    Splits a post into undecayed components, one for the post itself and one per top comment.
+    Each component keeps its own publish time so the decay can be applied at query time:
+    weight[c] = engagement * candidates[c] * sentiment * exp(-LAMBDA_DECAY * (as_of - publishedAt)).
+    """
+    E_p_shares, E_p_comments, E_p_reactions, _ = calculate_post_engagement(data)
+    components = [{
+        'publishedAt': parse_datetime(data.get('publishedAt')),
+        'engagement': float(E_p_shares + E_p_comments + E_p_reactions),
+        'sentiment': float(data.get('pt_the_senti', {}).get('sentiment_score', 0)),
+        'candidates': {c: float(data.get('pt_the_candi', {}).get(c, 0)) for c in CANDIDATES},
+    }]
+
+    for comment_data in data.get('top_comments', []):
+        E_c_reactions, E_c_replies, _ = calculate_comment_engagement(comment_data)
+        components.append({
+            'publishedAt': parse_datetime(comment_data.get('publishedAt')),
+            'engagement': float(E_c_reactions + E_c_replies),
+            'sentiment': float(comment_data.get('pt_the_senti', {}).get('sentiment_score', 0)),
+            'candidates': {c: float(comment_data.get('pt_the_candi', {}).get(c, 0)) for c in CANDIDATES},
+        })
+
+    return components
+
+
+def apply_decay(components, as_of=None):
+    # Decayed candidate weights of stored components; content published after as_of is not counted
+    as_of = as_utc(as_of or datetime.now(timezone.utc))
+    candidate_weights = defaultdict(float, {c: 0.0 for c in CANDIDATES})
+    for component in components:
+        published_at = as_utc(component['publishedAt'])
+        if published_at > as_of:
+            continue
+        factor = component['engagement'] * component['sentiment'] * calculate_decay_factor(published_at, as_of)
+        for candidate in CANDIDATES:
+            candidate_weights[candidate] += factor * component['candidates'].get(candidate, 0)
+    return candidate_weights
+
+
+def decay_pipeline(as_of=None, match=None):
+    """
+    Mongo aggregation pipeline computing the decayed candidate weights as of a given time
+    from the components stored in pt_the_waiter.components (see decompose_post).
+    """
+    as_of = as_of or datetime.now(timezone.utc)
+    age_days = {'$divide': [{'$subtract': [as_of, '$publishedAt']}, 24 * 3600 * 1000]}
+    return [
+        {'$match': {'pt_the_waiter.components': {'$exists': True}, **(match or {})}},
+        {'$unwind': '$pt_the_waiter.components'},
+        {'$replaceRoot': {'newRoot': '$pt_the_waiter.components'}},
+        {'$match': {'publishedAt': {'$lte': as_of}}},
+        {'$project': {
+            'candidates': 1,
+            'factor': {'$multiply': [
+                '$engagement', '$sentiment', {'$exp': {'$multiply': [-LAMBDA_DECAY, age_days]}},
+            ]},
+        }},
+        {'$group': {
+            '_id': None,
+            **{c: {'$sum': {'$multiply': ['$factor', {'$ifNull': [f'$candidates.{c}', 0]}]}} for c in CANDIDATES},
+        }},
+    ]
+
+
 def aggregate_results(results):
     total_candidate_weights = defaultdict(float)
     total_field_contributions = defaultdict(default_dict_float)
@@ -165,18 +257,89 @@ def normalize_candidate_weights(total_candidate_weights):
     return normalized_weights
 
 
+def finalize_results(partial):
+    # Turn a (candidate_weights, field_contributions) aggregate into the analyze_posts output
+    _total_candidate_weights, _total_field_contributions = partial
+    normalized_weights = normalize_candidate_weights(_total_candidate_weights)
+    return _total_candidate_weights, normalized_weights, _total_field_contributions
+
+
 def analyze_posts(posts_data):
     # Use multiprocessing to process posts in parallel
     with Pool(processes=cpu_count()) as pool:
         results = pool.map(process_post, posts_data)
 
-    # Aggregate candidate weights and field contributions
-    _total_candidate_weights, _total_field_contributions = aggregate_results(results)
+    # Aggregate candidate weights and field contributions, then normalize
+    return finalize_results(aggregate_results(results))
 
-    # Normalize candidate weights
-    normalized_weights = normalize_candidate_weights(_total_candidate_weights)
 
-    return _total_candidate_weights, normalized_weights, _total_field_contributions
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def aggregate_chunk(posts_data):
+    # Partial aggregate of a list of posts; same shape as aggregate_results output
+    return aggregate_results(process_post(data) for data in posts_data)
+
+
+def merge_partials(*partials):
+    # Partials are (candidate_weights, field_contributions) pairs, which aggregate_results already sums
+    return aggregate_results(partials)
+
+
+def aggregate_stream(posts_iter, chunk_size=STREAM_CHUNK_SIZE, processes=None):
+    """
+    Aggregates candidate weights over any iterable of posts (e.g. a Mongo cursor) without
+    materializing it. At most two chunks are held in memory: one being weighted by the pool
+    while the next one is read from the iterator.
+
+    :param posts_iter: Iterable of post documents.
+    :param chunk_size: Number of posts per chunk.
+    :param processes: Worker processes; 1 runs in-process without a pool.
+    :return: A mergeable (candidate_weights, field_contributions) partial aggregate.
+    """
+    partial = aggregate_results([])
+    processes = processes or cpu_count()
+
+    if processes == 1:
+        for chunk in chunked(posts_iter, chunk_size):
+            partial = merge_partials(partial, aggregate_chunk(chunk))
+        return partial
+
+    with Pool(processes=processes) as pool:
+        pending = None
+        for chunk in chunked(posts_iter, chunk_size):
+            # Strided slices so every worker gets a similar mix of posts
+            slices = [chunk[i::processes] for i in range(min(processes, len(chunk)))]
+            result = pool.map_async(aggregate_chunk, slices)
+            if pending is not None:
+                partial = merge_partials(partial, *pending.get())
+            pending = result
+        if pending is not None:
+            partial = merge_partials(partial, *pending.get())
+
+    return partial
+
+
+def partial_from_json(data):
+    # Rebuild a partial aggregate saved with json.dump (e.g. by another shard)
+    candidate_weights = defaultdict(float, data.get('candidate_weights', {}))
+    field_contributions = defaultdict(default_dict_float)
+    for candidate, fields in data.get('field_contributions', {}).items():
+        field_contributions[candidate].update(fields)
+    return candidate_weights, field_contributions
+
+
+def partial_to_json(partial):
+    candidate_weights, field_contributions = partial
+    return {'candidate_weights': candidate_weights, 'field_contributions': field_contributions}
 
 
 if __name__ == '__main__':
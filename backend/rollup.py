@@ -0,0 +1,216 @@
+import os
+import argparse
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+from stamps import article_fields
+
+# Day the dashboard puts an article on; the rollup uses the same local date
+LOCAL_TZ = ZoneInfo(os.getenv('ROLLUP_TZ', 'Asia/Colombo'))
+# As in prediction.the_waiter; importing the prediction package would load the models' libraries
+CANDIDATES = ['anura', 'sajith', 'ranil', 'other', 'no_one']
+REACTION_KEYS = ['like', 'love', 'haha', 'wow', 'sad', 'angry']
+# Op ids kept per rollup document, so a retried $inc is recognised and skipped
+ROLLUP_OPS_KEPT = 200
+ROLLUP_SYNC_BATCH = 500
+ROLLUP_MAX_RETRIES = 3
+
+# Fields contribution() reads, plus the contribution stored on the article
+ROLLUP_FIELDS = {
+    'publishedAt': 1, 'newsTitleEn': 1, 'newsTitleLl': 1, 'newsContentEn': 1, 'newsContentLl': 1,
+    'reactions': 1, 'commentCount': 1, 'pt_the_senti.sentiment_score': 1, 'pt_the_candi': 1,
+    'pt_the_waiter.total_candidate_weights': 1, 'rollup': 1,
+}
+
+
+def contribution(doc: Dict[str, Any], source: str) -> Dict[str, Any]:
+    """
+    What one article adds to the rollup: the key of its (local publishing date, language, source) bucket and
+    its values there. Derived as the dashboard derives its article rows (frontend/queries.py ROW_STAGES).
+    """
+    fields = article_fields(doc)
+    published, lang = fields['published'], fields['lang']
+    local = published.astimezone(LOCAL_TZ) if published is not None else None
+
+    weights = (doc.get('pt_the_waiter') or {}).get('total_candidate_weights') or doc.get('pt_the_candi') or {}
+    weights = {candidate: float(weights.get(candidate) or 0.0) for candidate in CANDIDATES}
+    reactions = doc.get('reactions') or {}
+    sentiment = (doc.get('pt_the_senti') or {}).get('sentiment_score')
+
+    values = {
+        'articles': 1,
+        'commentCount': int(doc.get('commentCount') or 0),
+        'sentiment_sum': float(sentiment) if sentiment is not None else 0.0,
+        'sentiment_count': int(sentiment is not None),
+        **{f'w_{candidate}': weight for candidate, weight in weights.items()},
+        **{f'rx_{key}': int(reactions.get(key) or 0) for key in REACTION_KEYS},
+        # max() keeps the first of equal weights, in CANDIDATES order
+        f'top_{max(weights, key=weights.get)}': 1,
+    }
+    if local is not None:
+        values[f'hour_{local.hour}'] = 1
+    key = {'date': local.date().isoformat() if local is not None else None, 'lang': lang, 'source': source}
+    return {'key': key, 'values': values}
+
+
+def bucket_id(key: Dict[str, Any]) -> str:
+    return f"{key['source']}:{key['date']}:{key['lang']}"
+
+
+def deltas(changes: Iterable[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Net change of every bucket when articles move from their old contribution to their new one.
+
+    :param changes: (old, new) contribution pairs; None for an article not counted before / any more.
+    :return: Bucket id -> {"key": ..., "values": {field: change}}, without zero changes.
+    """
+    buckets = {}
+    for old, new in changes:
+        for part, sign in ((old, -1), (new, 1)):
+            if part is None:
+                continue
+            bucket = buckets.setdefault(bucket_id(part['key']), {'key': part['key'], 'values': defaultdict(int)})
+            for field, value in part['values'].items():
+                bucket['values'][field] += sign * value
+    for bucket in buckets.values():
+        bucket['values'] = {field: value for field, value in bucket['values'].items() if value != 0}
+    return {bid: bucket for bid, bucket in buckets.items() if bucket['values']}
+
+
+class Rollup:
+    """
+    Keeps a rollup collection of one small document per (local publishing date, language, source) with
+    article counts, candidate weight sums, sentiment sums and counts, reaction totals, top-candidate counts
+    and publishing hours, updated with $inc as articles change.
+
+    Every article carries the contribution it was last counted with (its rollup field). sync() recomputes
+    the contribution of the articles written since the last sync and applies the difference:
+    - the article's rollup field is swapped by compare-and-set, so of several workers syncing the same
+      article only one applies its change;
+    - each $inc carries an op id that the rollup document remembers, so retrying a write that may have
+      gone through never counts twice.
+    A worker that dies between the two steps leaves that article's change out; `python rollup.py` recounts.
+    Buckets left without articles are deleted.
+
+    Only the processors' writes go through sync(): a new article is counted once it is predicted, and a
+    re-scrape's reactions and comment counts once the article is written again (e.g. re-predicted). Until
+    then the rollup shows the article as it was last written; `python rollup.py` recounts everything.
+    """
+
+    def __init__(self, articles, rollups, source: Optional[str] = None) -> None:
+        """
+        :param articles: Collection of the articles, read with dict documents.
+        :param rollups: Rollup collection.
+        :param source: Source the articles are counted under, defaults to the articles' collection name.
+        """
+        self.articles = articles
+        self.rollups = rollups
+        self.source = source or articles.name
+        self.dirty = set()
+        self.stats = {"synced": 0, "changed": 0, "conflicts": 0, "buckets": 0, "deleted": 0}
+
+    def touch(self, doc_id: Any) -> None:
+        # The article was written; its contribution is recomputed on the next sync
+        self.dirty.add(doc_id)
+
+    def sync(self) -> None:
+        # Call once the writes to the touched articles have reached the database (e.g. after a bulk flush)
+        doc_ids, self.dirty = list(self.dirty), set()
+        for start in range(0, len(doc_ids), ROLLUP_SYNC_BATCH):
+            changes = []
+            batch = doc_ids[start:start + ROLLUP_SYNC_BATCH]
+            for doc in self.articles.find({"_id": {"$in": batch}}, ROLLUP_FIELDS):
+                self.stats["synced"] += 1
+                old, new = doc.get("rollup"), contribution(doc, self.source)
+                if old == new:
+                    continue
+                swapped = self.articles.update_one(
+                    {"_id": doc["_id"], "rollup": old if old is not None else {"$exists": False}},
+                    {"$set": {"rollup": new}},
+                )
+                if swapped.modified_count != 1:
+                    # Another worker synced the article in between and counted its change
+                    self.stats["conflicts"] += 1
+                    continue
+                self.stats["changed"] += 1
+                changes.append((old, new))
+            self.apply(deltas(changes))
+
+    def apply(self, buckets: Dict[str, Dict[str, Any]]) -> None:
+        if not buckets:
+            return
+        op_id = str(ObjectId())
+        ops: List[UpdateOne] = []
+        for bid, bucket in buckets.items():
+            # Ordered: the bucket exists before its guarded, non-upserting $inc runs
+            ops.append(UpdateOne({"_id": bid}, {"$setOnInsert": bucket["key"]}, upsert=True))
+            ops.append(UpdateOne(
+                {"_id": bid, "ops": {"$ne": op_id}},
+                {"$inc": bucket["values"], "$push": {"ops": {"$each": [op_id], "$slice": -ROLLUP_OPS_KEPT}}},
+            ))
+        for attempt in range(ROLLUP_MAX_RETRIES + 1):
+            try:
+                self.rollups.bulk_write(ops, ordered=True)
+                # The buckets the last articles moved out of, which would otherwise show as empty days. Their op
+                # ids go with them: the rare retry of another worker's $inc into one after this counts again
+                emptied = self.rollups.delete_many({"_id": {"$in": list(buckets)}, "articles": {"$lte": 0}})
+                self.stats["buckets"] += len(buckets)
+                self.stats["deleted"] += emptied.deleted_count
+                return
+            except (ConnectionFailure, OperationFailure) as e:
+                print(f"Rollup update of {len(buckets)} buckets failed (attempt {attempt + 1}): {e}")
+        print(f"Giving up on the rollup update of {len(buckets)} buckets; run `python rollup.py` to recount.")
+
+    def rebuild(self, batch_size: int = 1000) -> Dict[str, int]:
+        """
+        Recounts the source from scratch: stores every article's contribution and replaces the source's
+        rollup documents. Run it with the processors stopped.
+        """
+        buckets = defaultdict(lambda: defaultdict(int))
+        keys = {}
+        ops, articles = [], 0
+        for doc in self.articles.find({}, ROLLUP_FIELDS):
+            articles += 1
+            new = contribution(doc, self.source)
+            bid = bucket_id(new["key"])
+            keys[bid] = new["key"]
+            for field, value in new["values"].items():
+                buckets[bid][field] += value
+            if doc.get("rollup") != new:
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"rollup": new}}))
+            if len(ops) >= batch_size:
+                self.articles.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            self.articles.bulk_write(ops, ordered=False)
+
+        self.rollups.delete_many({"source": self.source})
+        if buckets:
+            self.rollups.insert_many(
+                [{"_id": bid, **keys[bid], **values, "ops": []} for bid, values in buckets.items()]
+            )
+        self.dirty.clear()
+        return {"articles": articles, "buckets": len(buckets)}
+
+
+if __name__ == '__main__':
+    from database import close_db, get_db_client
+
+    arg_parser = argparse.ArgumentParser(description="Rebuild the daily rollup of a collection")
+    arg_parser.add_argument("collection", nargs="?", default=os.getenv("DB_COLLECTION_NAME"),
+                            help="Collection of the articles (default: DB_COLLECTION_NAME)")
+    arg_parser.add_argument("--source", default=None, help="Source to count them under (default: the collection)")
+    args = arg_parser.parse_args()
+
+    db_client = get_db_client(args.collection)
+    try:
+        rollup = db_client.enable_rollup(source=args.source)
+        result = rollup.rebuild()
+        print(f"Rollup of {rollup.source} rebuilt: {result['articles']} articles in {result['buckets']} buckets")
+    finally:
+        close_db(db_client)
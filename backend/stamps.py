@@ -0,0 +1,81 @@
+import os
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from pymongo import UpdateOne
+
+RFC_FORMAT = '%a, %d %b %Y %H:%M:%S GMT%z'
+STAMP_BATCH_SIZE = int(os.getenv('STAMP_BATCH_SIZE', '1000'))
+
+# Fields article_fields() reads
+STAMP_SOURCE_FIELDS = {'publishedAt': 1, 'newsTitleEn': 1, 'newsTitleLl': 1, 'newsContentEn': 1, 'newsContentLl': 1}
+# Articles not stamped yet; published is null, not missing, for those without a parseable publishedAt
+UNSTAMPED_QUERY = {'published': {'$exists': False}}
+
+
+def parse_published(value: Any) -> Optional[datetime]:
+    # Dates, ISO strings and the scrapers' "Fri, 20 Sep 2024 12:58:32 GMT+0000"; anything else is None
+    if isinstance(value, str):
+        for parse in (datetime.fromisoformat, lambda text: datetime.strptime(text, RFC_FORMAT)):
+            try:
+                value = parse(value)
+                break
+            except ValueError:
+                continue
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def article_lang(doc: Dict[str, Any]) -> str:
+    return 'si' if doc.get('newsTitleLl') or doc.get('newsContentLl') \
+        else 'en' if doc.get('newsTitleEn') or doc.get('newsContentEn') else 'unknown'
+
+
+def article_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The stored copies of an article's publishing time and language, derived as the dashboard derives them
+    (frontend/queries.py ROW_STAGES). Indexed, they let the dashboard select a date range and languages
+    before parsing anything.
+    """
+    return {'published': parse_published(doc.get('publishedAt')), 'lang': article_lang(doc)}
+
+
+def stamp_articles(collection, batch_size: int = STAMP_BATCH_SIZE, restamp: bool = False) -> int:
+    """
+    Stores article_fields() on the articles that do not have them yet, or on every article with restamp
+    (e.g. after a scraper rewrote publishedAt or the titles in place).
+
+    :return: Number of articles stamped.
+    """
+    stamped, last_id = 0, None
+    while True:
+        query = {} if restamp else dict(UNSTAMPED_QUERY)
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        docs = list(collection.find(query, STAMP_SOURCE_FIELDS).sort('_id', 1).limit(batch_size))
+        if not docs:
+            return stamped
+        collection.bulk_write(
+            [UpdateOne({'_id': doc['_id']}, {'$set': article_fields(doc)}) for doc in docs], ordered=False
+        )
+        stamped += len(docs)
+        last_id = docs[-1]['_id']
+
+
+if __name__ == '__main__':
+    from database import close_db, get_db_client
+
+    arg_parser = argparse.ArgumentParser(description="Store the publishing time and language of the articles")
+    arg_parser.add_argument("collection", nargs="?", default=os.getenv("DB_COLLECTION_NAME"),
+                            help="Collection of the articles (default: DB_COLLECTION_NAME)")
+    arg_parser.add_argument("--restamp", action="store_true", help="Stamp every article again, not only new ones")
+    args = arg_parser.parse_args()
+
+    db_client = get_db_client(args.collection)
+    try:
+        db_client.ensure_indexes()
+        print(f"Stamped {stamp_articles(db_client.collection, restamp=args.restamp)} articles")
+    finally:
+        close_db(db_client)
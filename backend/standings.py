@@ -0,0 +1,194 @@
+import os
+import json
+import sys
+import argparse
+from datetime import date, datetime, timezone
+
+from dateutil import parser
+
+from dotenv import load_dotenv
+
+from prediction.the_waiter import (
+    CANDIDATES,
+    STREAM_CHUNK_SIZE,
+    WAITER_FIELDS,
+    aggregate_stream,
+    decay_pipeline,
+    normalize_candidate_weights,
+    finalize_results,
+    merge_partials,
+    partial_from_json,
+    partial_to_json,
+)
+from prediction.profiles import load_profiles, evaluate_profiles
+from prediction.backtest import COMPONENT_FIELDS, backtest_series, write_series
+from database import get_db_client, close_db
+
+# Load environment variables
+load_dotenv(dotenv_path='.env')
+
+DB_COLLECTION_NAME: str = os.getenv("DB_COLLECTION_NAME", "")
+WAITER_PROFILES_PATH: str = os.getenv("WAITER_PROFILES_PATH", "waiter_profiles.yaml")
+
+
+def print_standings(partial) -> None:
+    total_candidate_weights, normalized_candidate_weights, _ = finalize_results(partial)
+
+    print("Total Candidate Weights:")
+    for candidate, weight in total_candidate_weights.items():
+        print(f"{candidate.capitalize()}: {weight}")
+
+    print("\nCandidate Popularity Percentages:")
+    for candidate, percentage in normalized_candidate_weights.items():
+        print(f"{candidate.capitalize()}: {percentage}%")
+
+
+def stream(args: argparse.Namespace) -> None:
+    """
+    Streams every political document of the collection through the_waiter and prints the standings.
+    Optionally saves the partial aggregate so standings from several shards can be merged later.
+    """
+    db_client = get_db_client(args.collection)
+    try:
+        cursor = db_client.find_political_docs(projection=WAITER_FIELDS, batch_size=args.chunk_size)
+        partial = aggregate_stream(cursor, chunk_size=args.chunk_size, processes=args.processes)
+    finally:
+        close_db(db_client)
+
+    if args.save_partial:
+        with open(args.save_partial, 'w') as f:
+            json.dump(partial_to_json(partial), f)
+        print(f"Partial aggregate saved to {args.save_partial}")
+
+    print_standings(partial)
+
+
+def merge(args: argparse.Namespace) -> None:
+    """
+    Merges partial aggregates saved by `stream --save-partial` and prints the combined standings.
+    """
+    partials = []
+    for path in args.partials:
+        with open(path) as f:
+            partials.append(partial_from_json(json.load(f)))
+    print_standings(merge_partials(*partials))
+
+
+def parse_as_of(value: str) -> datetime:
+    as_of = parser.parse(value)
+    if as_of.tzinfo is None:
+        as_of = as_of.replace(tzinfo=timezone.utc)
+    return as_of.astimezone(timezone.utc)
+
+
+def current(args: argparse.Namespace) -> None:
+    """
+    Computes the standings as of a given time from the stored undecayed components.
+    The decay is applied by the database, so nothing has to be re-weighted.
+    """
+    db_client = get_db_client(args.collection)
+    try:
+        result = next(db_client.aggregate(decay_pipeline(as_of=args.as_of)), {})
+    finally:
+        close_db(db_client)
+
+    total_candidate_weights = {c: result.get(c, 0.0) for c in CANDIDATES}
+    normalized_candidate_weights = normalize_candidate_weights(total_candidate_weights)
+
+    print(f"Standings as of {(args.as_of or datetime.now(timezone.utc)).isoformat()}")
+    for candidate in CANDIDATES:
+        print(f"{candidate.capitalize()}: {total_candidate_weights[candidate]} "
+              f"({normalized_candidate_weights[candidate]}%)")
+
+
+def backtest(args: argparse.Namespace) -> None:
+    """
+    Writes the daily standings between --start and --end as CSV, in one pass over the stored components.
+    """
+    db_client = get_db_client(args.collection)
+    try:
+        cursor = db_client.find_political_docs(projection=COMPONENT_FIELDS, batch_size=STREAM_CHUNK_SIZE)
+        rows = backtest_series(cursor, args.start, args.end, tz=args.tz)
+    finally:
+        close_db(db_client)
+
+    if args.out:
+        with open(args.out, 'w', newline='') as f:
+            write_series(rows, f)
+        print(f"{len(rows)} days written to {args.out}")
+    else:
+        write_series(rows, sys.stdout)
+
+
+def profiles(args: argparse.Namespace) -> None:
+    """
+    Evaluates several weighting profiles over the collection in one pass and prints their standings side by side.
+    """
+    weighting_profiles = load_profiles(args.config)
+    if args.names:
+        missing = set(args.names) - set(weighting_profiles)
+        if missing:
+            raise SystemExit(f"Unknown profiles: {', '.join(sorted(missing))}")
+        weighting_profiles = {name: weighting_profiles[name] for name in args.names}
+
+    db_client = get_db_client(args.collection)
+    try:
+        cursor = db_client.find_political_docs(projection=WAITER_FIELDS, batch_size=args.chunk_size)
+        standings = evaluate_profiles(cursor, weighting_profiles, as_of=args.as_of, chunk_size=args.chunk_size)
+    finally:
+        close_db(db_client)
+
+    if args.json:
+        print(json.dumps(standings, indent=2))
+        return
+
+    names = list(standings)
+    print("Candidate".ljust(12) + "".join(name[:18].rjust(20) for name in names))
+    for candidate in CANDIDATES:
+        shares = [standings[name]['normalized_candidate_weights'][candidate] for name in names]
+        print(candidate.capitalize().ljust(12) + "".join(f"{share:19.2f}%" for share in shares))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(description="Corpus-wide candidate standings")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    stream_parser = subparsers.add_parser("stream", help="Aggregate standings over the whole collection")
+    stream_parser.add_argument("--collection", default=DB_COLLECTION_NAME)
+    stream_parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE)
+    stream_parser.add_argument("--processes", type=int, default=None)
+    stream_parser.add_argument("--save-partial", default=None, help="Write the partial aggregate as JSON")
+    stream_parser.set_defaults(func=stream)
+
+    current_parser = subparsers.add_parser("current", help="Query-time decayed standings from stored components")
+    current_parser.add_argument("--collection", default=DB_COLLECTION_NAME)
+    current_parser.add_argument("--as-of", type=parse_as_of, default=None, help="Defaults to now")
+    current_parser.set_defaults(func=current)
+
+    backtest_parser = subparsers.add_parser("backtest", help="Daily standings over a date range")
+    backtest_parser.add_argument("--collection", default=DB_COLLECTION_NAME)
+    backtest_parser.add_argument("--start", type=date.fromisoformat, required=True)
+    backtest_parser.add_argument("--end", type=date.fromisoformat, required=True)
+    backtest_parser.add_argument("--tz", default="UTC", help="Timezone whose midnights end each day")
+    backtest_parser.add_argument("--out", default=None, help="CSV output path, defaults to stdout")
+    backtest_parser.set_defaults(func=backtest)
+
+    profiles_parser = subparsers.add_parser("profiles", help="Compare weighting profiles in a single pass")
+    profiles_parser.add_argument("--collection", default=DB_COLLECTION_NAME)
+    profiles_parser.add_argument("--config", default=WAITER_PROFILES_PATH)
+    profiles_parser.add_argument("--names", nargs="+", default=None, help="Profiles to evaluate, defaults to all")
+    profiles_parser.add_argument("--as-of", type=parse_as_of, default=None, help="Defaults to now")
+    profiles_parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE)
+    profiles_parser.add_argument("--json", action="store_true", help="Print totals and shares as JSON")
+    profiles_parser.set_defaults(func=profiles)
+
+    merge_parser = subparsers.add_parser("merge", help="Merge partial aggregates from several runs")
+    merge_parser.add_argument("partials", nargs="+")
+    merge_parser.set_defaults(func=merge)
+
+    return arg_parser
+
+
+if __name__ == '__main__':
+    cli_args = build_parser().parse_args()
+    cli_args.func(cli_args)
@@ -0,0 +1,130 @@
+import pytest
+from pymongo.errors import AutoReconnect
+
+mongomock = pytest.importorskip("mongomock")
+
+from rollup import ROLLUP_FIELDS, Rollup, bucket_id, contribution
+
+
+def article(_id, published="2024-09-20T06:00:00+00:00", likes=1, weights=None):
+    return {
+        "_id": _id, "publishedAt": published, "newsTitleEn": f"News {_id}", "reactions": {"like": likes},
+        "commentCount": 2, "pt_the_senti": {"sentiment_score": 0.5},
+        "pt_the_waiter": {"total_candidate_weights": weights or {"anura": 1.0, "sajith": 0.5}},
+    }
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["news"]
+
+
+def rollup(db, **collections):
+    return Rollup(collections.get("articles", db["articles"]), collections.get("rollups", db["rollup"]), "hela")
+
+
+def counted(db):
+    # Rollup documents without the op ids and the zero sums (which $inc never creates), by bucket id
+    return {doc.pop("_id"): {field: value for field, value in doc.items() if value != 0}
+            for doc in db["rollup"].find({}, {"ops": 0})}
+
+
+def rebuilt(db):
+    # What a recount from scratch gives
+    fresh = mongomock.MongoClient()["news"]
+    fresh["articles"].insert_many(list(db["articles"].find({}, {"rollup": 0})))
+    rollup(fresh).rebuild()
+    return counted(fresh)
+
+
+class StaleReads:
+    # The articles as a worker read them before another one synced them; writes go through
+    def __init__(self, articles, docs):
+        self.articles = articles
+        self.docs = docs
+
+    def find(self, *args, **kwargs):
+        return iter(self.docs)
+
+    def __getattr__(self, name):
+        return getattr(self.articles, name)
+
+
+class FailsAfterWriting:
+    # A rollup collection whose first bulk write goes through but reports a lost connection
+    def __init__(self, rollups):
+        self.rollups = rollups
+        self.failures = 1
+
+    def bulk_write(self, *args, **kwargs):
+        result = self.rollups.bulk_write(*args, **kwargs)
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection closed")
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.rollups, name)
+
+
+def test_sync_counts_changed_articles(db):
+    db["articles"].insert_many([article(1), article(2, likes=3)])
+    worker = rollup(db)
+    worker.touch(1)
+    worker.touch(2)
+    worker.sync()
+
+    db["articles"].update_one({"_id": 2}, {"$set": {"reactions.like": 5}})
+    worker.touch(2)
+    worker.sync()
+    assert counted(db) == rebuilt(db)
+    assert counted(db)["hela:2024-09-20:en"]["rx_like"] == 6
+    assert worker.stats["changed"] == 3
+
+
+def test_article_synced_by_two_workers_counts_once(db):
+    db["articles"].insert_one(article(1))
+    stale = list(db["articles"].find({}, ROLLUP_FIELDS))
+    first, second = rollup(db), rollup(db, articles=StaleReads(db["articles"], stale))
+
+    first.touch(1)
+    first.sync()
+    # The second worker read the article before the first swapped its contribution, so its swap fails
+    second.touch(1)
+    second.sync()
+    assert second.stats == {"synced": 1, "changed": 0, "conflicts": 1, "buckets": 0, "deleted": 0}
+    assert counted(db)["hela:2024-09-20:en"]["articles"] == 1
+
+
+def test_retried_update_is_applied_once(db):
+    db["articles"].insert_one(article(1))
+    worker = rollup(db, rollups=FailsAfterWriting(db["rollup"]))
+    worker.touch(1)
+    worker.sync()
+
+    doc = db["rollup"].find_one({"_id": "hela:2024-09-20:en"})
+    assert doc["articles"] == 1 and doc["rx_like"] == 1
+    assert len(doc["ops"]) == 1
+    assert counted(db) == rebuilt(db)
+
+
+def test_bucket_emptied_by_a_move_is_deleted(db):
+    db["articles"].insert_many([article(1), article(2, published="2024-09-21T06:00:00+00:00")])
+    worker = rollup(db)
+    worker.touch(1)
+    worker.touch(2)
+    worker.sync()
+
+    db["articles"].update_one({"_id": 1}, {"$set": {"publishedAt": "2024-09-21T07:00:00+00:00"}})
+    worker.touch(1)
+    worker.sync()
+    assert set(counted(db)) == {"hela:2024-09-21:en"}
+    assert counted(db) == rebuilt(db)
+    assert worker.stats["deleted"] == 1
+
+
+def test_contribution_key_and_top_candidate():
+    part = contribution(article(1, published="2024-09-20T20:00:00+00:00", weights={"ranil": 2.0}), "hela")
+    # 20:00 UTC is past midnight in Colombo
+    assert bucket_id(part["key"]) == "hela:2024-09-21:en"
+    assert part["values"]["top_ranil"] == 1 and part["values"]["hour_1"] == 1
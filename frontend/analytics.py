@@ -0,0 +1,242 @@
+# analytics.py — candidate, sentiment and reaction statistics computed in MongoDB
+#
+#   python analytics.py [--uri URI] [--db DB] [--collection COLL] [--since YYYY-MM-DD] [--until YYYY-MM-DD]
+#                       [--days N] [--stats totals,top,sentiment,reactions] [--json]
+#
+# Every statistic is a $group over the collection, so only the handful of result values leave the server:
+# summary() folds the requested statistics into a single $group, i.e. one pass over the articles whatever
+# is asked for. A time window first selects on the stored, indexed published time (queries.published_match)
+# and parses publishedAt (queries.date_expr) only for articles not stamped yet; without one, no date is
+# involved at all. Candidate weights are those of the dashboard's rows (queries.WEIGHTS). total_candidate.py
+# and cal_stats.py read their numbers from here.
+import argparse
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from queries import CANDIDATES, LOCAL_TZ, REACTION_KEYS, WEIGHTS, date_expr, local_midnight, published_match
+
+STATS = ["totals", "top", "sentiment", "reactions"]
+# Stamped articles carry their publishing time (backend/stamps.py); the others have it parsed
+PUBLISHED = {"$ifNull": ["$published", date_expr("$publishedAt")]}
+# Server-side limit of each aggregation, so a runaway query fails instead of hanging the page
+ANALYTICS_MAX_TIME_MS = int(os.getenv("ANALYTICS_MAX_TIME_MS", "60000"))
+
+
+class Window(NamedTuple):
+    # Publishing times from start (inclusive) to end (exclusive); None leaves that side open
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+    @classmethod
+    def last_days(cls, days: float) -> "Window":
+        return cls(start=datetime.now(timezone.utc) - timedelta(days=days))
+
+    @classmethod
+    def local_dates(cls, since: Optional[date] = None, until: Optional[date] = None) -> "Window":
+        # Whole local days, until included
+        return cls(start=local_midnight(since) if since else None,
+                   end=local_midnight(until + timedelta(days=1)) if until else None)
+
+
+def window_stages(window: Optional[Window]) -> List[Dict[str, Any]]:
+    # Articles without a parseable publishedAt fall outside every bounded window
+    if window is None or (window.start is None and window.end is None):
+        return []
+    bounds = {}
+    if window.start is not None:
+        bounds["$gte"] = window.start
+    if window.end is not None:
+        bounds["$lt"] = window.end
+    return [published_match(window.start, window.end), {"$addFields": {"_published": PUBLISHED}},
+            {"$match": {"_published": bounds}}]
+
+
+def _aggregate(coll, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return list(coll.aggregate(pipeline, allowDiskUse=True, maxTimeMS=ANALYTICS_MAX_TIME_MS))
+
+
+# =========================
+# Expressions
+# =========================
+def _weight(candidate: str) -> Dict[str, Any]:
+    # Missing weights are null, and null sorts below every number
+    return {"$ifNull": [f"$_weights.{candidate}", None]}
+
+
+def _top_candidate(candidates: Sequence[str]) -> Dict[str, Any]:
+    # First candidate with the highest weight, as argmax over the weights picks it; null without any weight
+    branches = []
+    for i, c in enumerate(candidates):
+        others = [{"$gt": [_weight(c), _weight(o)]} for o in candidates[:i]]
+        others += [{"$gte": [_weight(c), _weight(o)]} for o in candidates[i + 1:]]
+        branches.append({"case": {"$and": [{"$ne": [_weight(c), None]}] + others}, "then": c})
+    return {"$switch": {"branches": branches, "default": None}}
+
+
+# Unscored articles count as neutral, as the dashboards have always shown them
+SENTIMENT = {"$ifNull": ["$pt_the_senti.sentiment_score", 0.0]}
+
+
+def _stat_fields(stats: Sequence[str], candidates: Sequence[str]) -> Dict[str, Any]:
+    # $addFields and $group fields of the statistics
+    added, grouped = {}, {"articles": {"$sum": 1}}
+    if "totals" in stats:
+        grouped.update({f"w_{c}": {"$sum": f"$_weights.{c}"} for c in candidates})
+    if "top" in stats:
+        added["_top"] = _top_candidate(candidates)
+        grouped.update({f"top_{c}": {"$sum": {"$cond": [{"$eq": ["$_top", c]}, 1, 0]}} for c in candidates})
+    if "sentiment" in stats:
+        added["_sentiment"] = SENTIMENT
+        grouped.update({
+            "sentiment_mean": {"$avg": "$_sentiment"}, "sentiment_std": {"$stdDevPop": "$_sentiment"},
+            "sentiment_min": {"$min": "$_sentiment"}, "sentiment_max": {"$max": "$_sentiment"},
+        })
+    if "reactions" in stats:
+        grouped.update({f"rx_{k}": {"$sum": f"$reactions.{k}"} for k in REACTION_KEYS})
+    return {"added": added, "grouped": grouped}
+
+
+# =========================
+# Statistics
+# =========================
+def summary(coll, window: Optional[Window] = None, stats: Sequence[str] = STATS,
+            candidates: Sequence[str] = CANDIDATES) -> Dict[str, Any]:
+    """
+    The requested statistics of the articles published in the window, from one $group.
+
+    :param stats: Any of STATS: "totals" (candidate weight sums), "top" (articles per top candidate),
+        "sentiment" (count, mean, std, min, max) and "reactions" (sums per reaction).
+    :param candidates: Candidates to sum and to pick the top one among.
+    :return: {"articles": n, <stat>: {...}} for each stat asked for.
+    """
+    unknown = set(stats) - set(STATS)
+    if unknown:
+        raise ValueError(f"Unknown statistics {sorted(unknown)}; choose from {STATS}")
+    fields = _stat_fields(stats, candidates)
+    pipeline = window_stages(window)
+    if "totals" in stats or "top" in stats:
+        pipeline.append({"$addFields": {"_weights": WEIGHTS}})
+    if fields["added"]:
+        pipeline.append({"$addFields": fields["added"]})
+    pipeline.append({"$group": {"_id": None, **fields["grouped"]}})
+    result = (_aggregate(coll, pipeline) or [{}])[0]
+
+    articles = result.get("articles", 0)
+    out: Dict[str, Any] = {"articles": articles}
+    if "totals" in stats:
+        out["totals"] = {c: float(result.get(f"w_{c}", 0.0)) for c in candidates}
+    if "top" in stats:
+        out["top"] = {c: int(result.get(f"top_{c}", 0)) for c in candidates}
+    if "sentiment" in stats:
+        out["sentiment"] = {"count": articles, **{
+            name: float(result[f"sentiment_{name}"]) if result.get(f"sentiment_{name}") is not None else np.nan
+            for name in ("mean", "std", "min", "max")
+        }}
+    if "reactions" in stats:
+        out["reactions"] = {k: int(result.get(f"rx_{k}", 0)) for k in REACTION_KEYS}
+    return out
+
+
+def candidate_totals(coll, window: Optional[Window] = None,
+                     candidates: Sequence[str] = CANDIDATES) -> Dict[str, float]:
+    return summary(coll, window, ["totals"], candidates)["totals"]
+
+
+def top_candidate_counts(coll, window: Optional[Window] = None,
+                         candidates: Sequence[str] = CANDIDATES) -> Dict[str, int]:
+    # Articles on which each candidate has the highest weight, among those with weights
+    return summary(coll, window, ["top"], candidates)["top"]
+
+
+def sentiment_stats(coll, window: Optional[Window] = None) -> Dict[str, float]:
+    return summary(coll, window, ["sentiment"])["sentiment"]
+
+
+def reaction_stats(coll, window: Optional[Window] = None) -> Dict[str, int]:
+    return summary(coll, window, ["reactions"])["reactions"]
+
+
+def sentiment_histogram(coll, window: Optional[Window] = None, bins: int = 10,
+                        stats: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+    """
+    Articles per equal-width sentiment bin between the lowest and highest score, counted with $bucket.
+
+    :param stats: sentiment_stats() of the same window, if already at hand.
+    :return: One row per bin: lower and upper bound, count.
+    """
+    stats = stats or sentiment_stats(coll, window)
+    low, high = stats["min"], stats["max"]
+    if not stats["count"] or np.isnan(low):
+        return pd.DataFrame(columns=["lower", "upper", "count"])
+    if high <= low:
+        return pd.DataFrame({"lower": [low], "upper": [high], "count": [stats["count"]]})
+    edges = np.linspace(low, high, bins + 1).tolist()
+    # $bucket bounds are upper-exclusive, so the highest scores land in the default bucket: the last bin
+    result = _aggregate(coll, window_stages(window) + [{"$bucket": {
+        "groupBy": SENTIMENT, "boundaries": edges, "default": "last", "output": {"count": {"$sum": 1}}},
+    }])
+    counts = {r["_id"]: r["count"] for r in result}
+    frame = pd.DataFrame({"lower": edges[:-1], "upper": edges[1:],
+                          "count": [counts.get(edge, 0) for edge in edges[:-1]]})
+    frame.loc[len(frame) - 1, "count"] += counts.get("last", 0)
+    return frame
+
+
+def top_documents(coll, window: Optional[Window] = None, n: int = 5) -> pd.DataFrame:
+    # The n articles with the most reactions, with their titles; the server sorts and keeps only those
+    result = _aggregate(coll, window_stages(window) + [
+        {"$project": {"title": {"$ifNull": ["$newsTitleEn", None]},
+                      "rx_total": {"$add": [{"$ifNull": [f"$reactions.{k}", 0]} for k in REACTION_KEYS]}}},
+        {"$sort": {"rx_total": -1, "_id": 1}},
+        {"$limit": n},
+    ])
+    return pd.DataFrame(result, columns=["_id", "title", "rx_total"])
+
+
+def daily_counts(coll, window: Optional[Window] = None) -> pd.DataFrame:
+    # Articles per local publishing day, for those with a parseable publishedAt
+    stages = window_stages(window) or [published_match(), {"$addFields": {"_published": PUBLISHED}}]
+    result = _aggregate(coll, stages + [
+        {"$match": {"_published": {"$ne": None}}},
+        {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$_published", "timezone": LOCAL_TZ}},
+                    "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}},
+    ])
+    frame = pd.DataFrame(result, columns=["_id", "count"]).rename(columns={"_id": "date"})
+    frame["date"] = pd.to_datetime(frame["date"]).dt.date
+    return frame
+
+
+if __name__ == "__main__":
+    from mongo import COLL_NAME, DB_NAME, MONGO_URI, get_collection
+
+    parser = argparse.ArgumentParser(description="Candidate, sentiment and reaction statistics of a collection")
+    parser.add_argument("--uri", default=MONGO_URI, help="Connection string (default: $MONGO_URI)")
+    parser.add_argument("--db", default=DB_NAME, help="Database (default: $MONGO_DB)")
+    parser.add_argument("--collection", default=COLL_NAME, help="Collection of the articles (default: $MONGO_COLL)")
+    parser.add_argument("--since", type=date.fromisoformat, help="First local publishing date, YYYY-MM-DD")
+    parser.add_argument("--until", type=date.fromisoformat, help="Last local publishing date, YYYY-MM-DD")
+    parser.add_argument("--days", type=float, help="Only the articles published in the last DAYS days")
+    parser.add_argument("--stats", default=",".join(STATS), help=f"Comma-separated, from {','.join(STATS)}")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    if args.days is not None and (args.since or args.until):
+        parser.error("--days cannot be combined with --since/--until")
+    time_window = Window.last_days(args.days) if args.days is not None \
+        else Window.local_dates(args.since, args.until)
+    collection = get_collection(args.collection, args.db, uri=args.uri)
+    results = summary(collection, time_window, [s.strip() for s in args.stats.split(",") if s.strip()])
+
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+    else:
+        print(f"{results['articles']} articles in {args.db}.{args.collection}")
+        for stat in STATS:
+            if stat in results:
+                print(f"{stat}: " + ", ".join(f"{key}={value:.4g}" for key, value in results[stat].items()))
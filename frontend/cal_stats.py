@@ -1,19 +1,25 @@
-from pymongo import MongoClient
+import dataset
+from analytics import candidate_totals
+from mongo import get_collection
 
-def calculate_candidate_scores():
-    # Connect to MongoDB
-    client = MongoClient('mongodb://localhost:27017/')  # Update with your MongoDB connection string
-    db = client['your_database_name']  # Replace with your database name
-    collection = db['esana_scraper']  # Replace with your collection name
+CANDIDATES = ['anura', 'sajith', 'ranil', 'other']
 
-    # Initialize scores
-    total_scores = {'anura': 0, 'sajith': 0, 'ranil': 0, 'other': 0}
 
-    # Fetch all documents and calculate total weights
-    for doc in collection.find():
-        candidate_weights = doc.get('pt_the_waiter', {}).get('total_candidate_weights', {})
-        for candidate in ['anura', 'sajith', 'ranil', 'other']:
-            total_scores[candidate] += candidate_weights.get(candidate, 0)
+def calculate_candidate_scores(window=None, collection=None):
+    if dataset.PARQUET_DIR:
+        # The Parquet export's weights: the waiter's, falling back to pt_the_candi (queries.WEIGHTS)
+        weights = dataset.read_articles(dataset.PARQUET_DIR, columns=['publishedAt'] + [f'w_{c}' for c in CANDIDATES])
+        if window is not None and window.start is not None:
+            weights = weights[weights['publishedAt'] >= window.start]
+        if window is not None and window.end is not None:
+            weights = weights[weights['publishedAt'] < window.end]
+        total_scores = {candidate: float(weights[f'w_{candidate}'].sum()) for candidate in CANDIDATES}
+    else:
+        # Shared client; MONGO_URI, MONGO_DB and MONGO_COLL select the collection
+        collection = collection if collection is not None else get_collection()
+
+        # The same weights summed by the server (analytics.Window limits the publishing times)
+        total_scores = candidate_totals(collection, window, CANDIDATES)
 
     # Determine the highest scored candidate
     highest_candidate = max(total_scores, key=total_scores.get)
@@ -1,14 +1,18 @@
 # dashboard.py
-import os
-from datetime import timezone
-from typing import Dict, List, Any
+from typing import Dict, Any, Tuple
 
 import numpy as np
 import pandas as pd
 import plotly.express as px
-from pymongo import MongoClient
 import streamlit as st
 
+import dataset
+import queries
+from mongo import get_collection
+from queries import ARTICLE_COLUMNS, CANDIDATES, REACTION_KEYS, Filters
+from prefix_sums import DailyIndex
+from snapshot import ArticleSnapshot
+
 # =========================
 # Page Config
 # =========================
@@ -18,141 +22,49 @@ st.set_page_config(
     layout="wide",
 )
 
-# =========================
-# Constants & Env
-# =========================
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-DB_NAME = os.getenv("MONGO_DB", "esana_scraper")
-COLL_NAME = os.getenv("MONGO_COLL", "news_articles")
-
-CANDIDATES = ["anura", "sajith", "ranil", "other", "no_one"]
-REACTION_KEYS = ["like", "love", "haha", "wow", "sad", "angry"]
-LOCAL_TZ = "Asia/Colombo"
-
-# =========================
-# Helpers
-# =========================
-def to_dt(x):
-    if x is None or (isinstance(x, float) and np.isnan(x)):
-        return pd.NaT
-    dt = pd.to_datetime(x, utc=True, errors="coerce")
-    return dt
-
-def safe_candidate_weights(doc: Dict[str, Any]) -> Dict[str, float]:
-    # Prefer model's total_candidate_weights, fallback to pt_the_candi probs
-    weights = (
-        doc.get("pt_the_waiter", {}).get("total_candidate_weights", {})
-        or doc.get("pt_the_candi", {})
-        or {}
-    )
-    return {c: float(weights.get(c, 0.0)) for c in CANDIDATES}
-
-def safe_sentiment(doc: Dict[str, Any]) -> float:
-    return float(doc.get("pt_the_senti", {}).get("sentiment_score", np.nan))
-
-def safe_reactions(doc: Dict[str, Any]) -> Dict[str, int]:
-    rx = doc.get("reactions", {}) or {}
-    return {k: int(rx.get(k, 0)) for k in REACTION_KEYS}
-
-def doc_title(doc: Dict[str, Any]) -> str:
-    return doc.get("newsTitleEn") or doc.get("newsTitleLl") or f"News #{doc.get('newsId', '—')}"
-
-def doc_lang(doc: Dict[str, Any]) -> str:
-    if doc.get("newsTitleLl") or doc.get("newsContentLl"):
-        return "si"
-    if doc.get("newsTitleEn") or doc.get("newsContentEn"):
-        return "en"
-    return "unknown"
-
-def top_candidate_from_weights(weights: Dict[str, float]) -> str:
-    if not weights:
-        return "none"
-    return max(weights.items(), key=lambda kv: kv[1])[0]
-
-def flatten_comments(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
-    rows = []
-    for c in doc.get("top_comments", []) or []:
-        prow = {
-            "newsId": doc.get("newsId"),
-            "title": doc_title(doc),
-            "publishedAt_article": to_dt(doc.get("publishedAt")),
-            "comment_text": c.get("commentText"),
-            "comment_publishedAt": to_dt(c.get("publishedAt")),
-            "comment_like": int(c.get("commentReaction", {}).get("like", 0)),
-            "comment_love": int(c.get("commentReaction", {}).get("love", 0)),
-            "comment_haha": int(c.get("commentReaction", {}).get("haha", 0)),
-            "comment_wow": int(c.get("commentReaction", {}).get("wow", 0)),
-            "comment_sad": int(c.get("commentReaction", {}).get("sad", 0)),
-            "comment_angry": int(c.get("commentReaction", {}).get("angry", 0)),
-            "comment_replies": int(c.get("commentReplyCount", 0)),
-            "comment_sentiment": float(c.get("pt_the_senti", {}).get("sentiment_score", np.nan)),
-        }
-        cand = {k: float(c.get("pt_the_candi", {}).get(k, np.nan)) for k in CANDIDATES}
-        rows.append({**prow, **{f"cand_{k}": v for k, v in cand.items()}})
-    return rows
-
 # =========================
 # Data Access
 # =========================
+# Every view is an aggregation over the filtered articles (queries.py); results are cached per filter set.
+# With PARQUET_DIR set, the same views are read from the Parquet export (dataset.py) instead of MongoDB.
+def data_source() -> Tuple[Any, Any]:
+    return (dataset, dataset.PARQUET_DIR) if dataset.PARQUET_DIR else (queries, get_collection())
+
 @st.cache_data(show_spinner=False, ttl=300)
-def load_raw() -> List[Dict[str, Any]]:
-    client = MongoClient(MONGO_URI)
-    coll = client[DB_NAME][COLL_NAME]
-    return list(coll.find())
+def load_filter_options() -> Dict[str, Any]:
+    module, source = data_source()
+    return module.filter_options(source)
 
-# =========================
-# Load & Normalize
-# =========================
-raw = load_raw()
-if not raw:
+@st.cache_data(show_spinner=False, ttl=300)
+def run_query(name: str, *args: Any, **kwargs: Any) -> Any:
+    module, source = data_source()
+    return getattr(module, name)(source, *args, **kwargs)
+
+@st.cache_resource(show_spinner=False)
+def article_snapshot() -> ArticleSnapshot:
+    # One per server process, shared by every session; per-article views read it instead of the database
+    return ArticleSnapshot(get_collection())
+
+@st.cache_resource(show_spinner=False)
+def daily_index() -> DailyIndex:
+    # Running daily totals, shared by every session; any date range's totals are two lookups per language
+    return DailyIndex(get_collection())
+
+options = load_filter_options()
+if not options:
     st.title("Esana — Political Pulse")
     st.info("No data found in MongoDB. Check your connection or collection.")
     st.stop()
 
-rows = []
-for d in raw:
-    weights = safe_candidate_weights(d)
-    reactions = safe_reactions(d)
-    published = to_dt(d.get("publishedAt"))
-    row = {
-        "newsId": d.get("newsId"),
-        "title": doc_title(d),
-        "lang": doc_lang(d),
-        "publishedAt": published,
-        "scrapedAt": to_dt(d.get("scrapedAt")),
-        "predictedAt": to_dt(d.get("predictedAt")),
-        "sentiment": safe_sentiment(d),
-        "commentCount": int(d.get("commentCount", 0)),
-        **{f"w_{c}": weights.get(c, 0.0) for c in CANDIDATES},
-        **{f"rx_{k}": reactions.get(k, 0) for k in REACTION_KEYS},
-    }
-    row["rx_total"] = sum(reactions.values())
-    row["top_candidate"] = top_candidate_from_weights(weights)
-    # Local date-only column (crucial for filtering w/ st.date_input)
-    if pd.notna(published):
-        try:
-            row["published_local"] = published.tz_convert(LOCAL_TZ).date()
-        except Exception:
-            # If tz-naive slipped through, coerce to UTC then convert
-            row["published_local"] = pd.to_datetime(published, utc=True).tz_convert(LOCAL_TZ).date()
-    else:
-        row["published_local"] = pd.NaT
-    rows.append(row)
-
-df = pd.DataFrame(rows)
-
-# Comments dataframe
-comments_df = pd.DataFrame([r for doc in raw for r in flatten_comments(doc)]) if any(d.get("top_comments") for d in raw) else pd.DataFrame()
-
 # =========================
 # Sidebar Filters
 # =========================
 st.sidebar.header("Filters")
 
-# Determine min/max date from local date column
-if df["published_local"].notna().any():
-    min_date = pd.to_datetime(df["published_local"].dropna().min()).date()
-    max_date = pd.to_datetime(df["published_local"].dropna().max()).date()
+# Determine min/max date from local publishing dates
+if options["min_date"] is not None:
+    min_date = options["min_date"]
+    max_date = options["max_date"]
 else:
     # Fallback range
     min_date = pd.Timestamp.utcnow().date()
@@ -173,35 +85,72 @@ else:
 
 lang_sel = st.sidebar.multiselect(
     "Language",
-    sorted(df["lang"].dropna().unique().tolist()),
-    default=sorted(df["lang"].dropna().unique().tolist()),
+    options["langs"],
+    default=options["langs"],
+)
+min_rx = st.sidebar.number_input(
+    "Minimum total reactions", min_value=0, value=0, step=10,
+    help="A floor above 0 computes the KPIs and charts from the articles themselves, not from the daily sums",
 )
-min_rx = st.sidebar.number_input("Minimum total reactions", min_value=0, value=0, step=10)
 focus_candidate = st.sidebar.selectbox("Focus candidate (some views)", ["all"] + CANDIDATES, index=0)
 
-# >>> FIXED: Compare date-to-date (no Timestamp vs date mismatch)
-mask = (
-    df["published_local"].notna()
-    & df["published_local"].between(start_date, end_date)  # both are datetime.date
-    & df["lang"].isin(lang_sel)
-    & (df["rx_total"] >= min_rx)
-)
-fdf = df.loc[mask].copy()
+# Local publishing dates are compared server-side, as [local midnight of start, local midnight after end)
+filters = Filters(start_date, end_date, lang_sel, int(min_rx))
+
+# The KPIs, Overview and Candidates read the daily rollup when the processors keep one (ROLLUP=1); it has no
+# per-article reactions, so a reaction floor falls back to the article pipelines
+use_rollup = queries.ROLLUP and not dataset.PARQUET_DIR and not filters.min_rx
+
+def figures_source() -> str:
+    # Where the KPIs, Overview and Candidates come from; shown, since a reaction floor changes it
+    if dataset.PARQUET_DIR:
+        return f"the Parquet export in {dataset.PARQUET_DIR}"
+    if filters.min_rx:
+        return "the articles, as the daily sums have no per-article reactions to apply the floor to"
+    refreshed = f"refreshed {daily_index().age():.0f}s ago"
+    if queries.ROLLUP:
+        return (f"the daily rollup ({refreshed}), which follows the processors' writes: an article re-scraped "
+                "since it was last processed counts as it was then")
+    return f"daily sums of the articles, {refreshed}"
+
+def aggregate(name: str, *args: Any) -> Any:
+    # Range totals come from the daily prefix sums under the same conditions, without a query
+    if not dataset.PARQUET_DIR and not filters.min_rx and name in ("totals", "top_candidate_counts"):
+        return getattr(daily_index(), name)(*args)
+    return run_query(f"rollup_{name}" if use_rollup else name, *args)
+
+totals = aggregate("totals", filters)
+
+if dataset.PARQUET_DIR:
+    # The filters are pushed down to the Parquet partitions
+    snapshot = None
+    fdf = run_query("articles", filters)
+else:
+    # The same filters over the article snapshot: the last good one is served while a newer one loads
+    snapshot = article_snapshot()
+    df = snapshot.get()
+    mask = (
+        df["published_local"].notna()
+        & df["published_local"].between(start_date, end_date)  # both are datetime.date
+        & df["lang"].isin(lang_sel)
+        & (df["rx_total"] >= min_rx)
+    )
+    fdf = df.loc[mask]
 
 # =========================
 # KPI Header
 # =========================
 st.title("Esana — Political Pulse Dashboard")
 
-total_articles = int(fdf.shape[0])
-avg_sent = float(fdf["sentiment"].mean()) if fdf["sentiment"].notna().any() else np.nan
-total_rx = int(fdf["rx_total"].sum())
-total_comments = int(fdf["commentCount"].sum())
+total_articles = int(totals["articles"])
+avg_sent = float(totals["sentiment"])
+total_rx = int(totals["rx_total"])
+total_comments = int(totals["commentCount"])
 
 cand_cols = [f"w_{c}" for c in CANDIDATES]
 leader = "—"
-if not fdf.empty:
-    sums = fdf[cand_cols].sum().rename(lambda c: c.replace("w_", ""))
+if total_articles:
+    sums = pd.Series({c: totals[f"w_{c}"] for c in CANDIDATES})
     leader = sums.idxmax() if (sums.max() != 0 and not sums.isna().all()) else "—"
 
 k1, k2, k3, k4, k5 = st.columns(5)
@@ -211,6 +160,7 @@ k3.metric("Total Reactions", f"{total_rx:,}")
 k4.metric("Total Comments", f"{total_comments:,}")
 k5.metric("Leading Candidate (weights)", leader.capitalize() if leader != "—" else "—")
 
+st.caption(f"KPIs, Overview and Candidates from {figures_source()}.")
 st.caption("Tip: Use the sidebar to slice by time, language, and engagement.")
 
 # =========================
@@ -222,12 +172,12 @@ tab_overview, tab_candidates, tab_sentiment, tab_reactions, tab_articles, tab_co
 
 # -------- Overview --------
 with tab_overview:
-    if fdf.empty:
+    if not total_articles:
         st.info("No articles match your filters.")
     else:
         # Candidate share over time (stacked area) using local date
-        daily = fdf.groupby("published_local")[cand_cols].sum().reset_index()
-        share = daily.copy()
+        daily = aggregate("daily", filters)
+        share = daily[["published_local"] + cand_cols].copy()
         total = share[cand_cols].sum(axis=1).replace(0, np.nan)
         for c in cand_cols:
             share[c] = share[c] / total
@@ -247,27 +197,14 @@ with tab_overview:
         c1, c2 = st.columns([1.2, 1])
         with c1:
             st.subheader("Sentiment Over Time")
-            s_daily = (
-                fdf[["published_local", "sentiment"]]
-                .dropna()
-                .groupby("published_local")["sentiment"]
-                .mean()
-                .reset_index()
-            )
+            s_daily = daily[["published_local", "sentiment"]].dropna()
             fig_sent = px.line(s_daily, x="published_local", y="sentiment", markers=True, title="Avg sentiment by day")
             st.plotly_chart(fig_sent, use_container_width=True)
 
         with c2:
             st.subheader("Publishing Cadence (Hour × Weekday)")
-            tmp = fdf.dropna(subset=["publishedAt"]).copy()
-            if not tmp.empty and tmp["publishedAt"].notna().any():
-                local = tmp["publishedAt"].dt.tz_convert(LOCAL_TZ)
-                tmp["hour"] = local.dt.hour
-                tmp["weekday"] = local.dt.day_name()
-                heat = tmp.groupby(["weekday", "hour"]).size().reset_index(name="count")
-                cats = ["Monday","Tuesday","Wednesday","Thursday","Friday","Saturday","Sunday"]
-                heat["weekday"] = pd.Categorical(heat["weekday"], ordered=True, categories=cats)
-                heat = heat.sort_values(["weekday","hour"])
+            heat = aggregate("cadence", filters)
+            if not heat.empty:
                 fig_heat = px.density_heatmap(
                     heat, x="hour", y="weekday", z="count", nbinsx=24, histfunc="avg", title="Posts by hour and weekday"
                 )
@@ -277,17 +214,17 @@ with tab_overview:
 
 # -------- Candidates --------
 with tab_candidates:
-    if fdf.empty:
+    if not total_articles:
         st.info("No articles match your filters.")
     else:
         st.subheader("Total & Normalized Candidate Weights")
-        totals = fdf[cand_cols].sum().rename(lambda c: c.replace("w_", ""))
-        norm = (totals / totals.sum()).fillna(0)
+        cand_totals = pd.Series({c: totals[f"w_{c}"] for c in CANDIDATES})
+        norm = (cand_totals / cand_totals.sum()).fillna(0)
 
         cA, cB = st.columns(2)
         with cA:
             fig_tot = px.bar(
-                totals.reset_index().rename(columns={"index": "candidate", 0: "weight"}),
+                cand_totals.reset_index().rename(columns={"index": "candidate", 0: "weight"}),
                 x="candidate", y="weight", title="Total weights"
             )
             st.plotly_chart(fig_tot, use_container_width=True)
@@ -299,12 +236,7 @@ with tab_candidates:
             st.plotly_chart(fig_norm, use_container_width=True)
 
         st.subheader("Top Candidate Frequency (who tops per-article?)")
-        top_counts = (
-            fdf["top_candidate"]
-            .value_counts()
-            .reindex(CANDIDATES, fill_value=0)
-            .reset_index()
-        )
+        top_counts = aggregate("top_candidate_counts", filters).reset_index()
         top_counts.columns = ["candidate", "count"]  # <- key line: unique names
 
         fig_top = px.bar(
@@ -325,7 +257,7 @@ with tab_candidates:
 
 # -------- Sentiment --------
 with tab_sentiment:
-    if fdf.empty:
+    if not total_articles:
         st.info("No articles match your filters.")
     else:
         st.subheader("Sentiment Distribution")
@@ -342,11 +274,11 @@ with tab_sentiment:
 
 # -------- Reactions --------
 with tab_reactions:
-    if fdf.empty:
+    if not total_articles:
         st.info("No articles match your filters.")
     else:
         st.subheader("Reaction Totals")
-        rx_totals = fdf[[f"rx_{k}" for k in REACTION_KEYS]].sum()
+        rx_totals = pd.Series({f"rx_{k}": totals[f"rx_{k}"] for k in REACTION_KEYS})
         fig_rx = px.bar(
             rx_totals.reset_index().rename(columns={"index": "reaction", 0: "count"}),
             x="reaction", y="count", title="Totals"
@@ -374,50 +306,29 @@ with tab_reactions:
 # -------- Articles --------
 with tab_articles:
     st.subheader("Articles Table")
-    show_cols = [
-        "newsId", "title", "publishedAt", "published_local", "lang",
-        "sentiment", "rx_total", "commentCount", "top_candidate"
-    ] + cand_cols
     st.dataframe(
-        fdf[show_cols].sort_values(["published_local", "publishedAt"], ascending=False),
+        fdf[ARTICLE_COLUMNS].sort_values(["published_local", "publishedAt"], ascending=False),
         use_container_width=True,
         hide_index=True
     )
+    if snapshot is not None:
+        st.caption(f"Article snapshot refreshed {snapshot.age():.0f}s ago")
+    else:
+        st.caption(f"Read from the Parquet export in {dataset.PARQUET_DIR}")
 
 # -------- Comments Explorer --------
 with tab_comments:
-    if comments_df.empty:
+    st.subheader("Top Comments")
+    left, right = st.columns([1, 1])
+    with left:
+        mode = st.radio("Order by", ["Highest sentiment", "Most reactions"], horizontal=True)
+    with right:
+        n_show = st.slider("How many to show", 5, 50, 15, step=5)
+
+    show = run_query("top_comments", "comment_sentiment" if mode == "Highest sentiment" else "total_rx", n_show)
+    if show.empty:
         st.info("No comment data available.")
     else:
-        st.subheader("Top Comments")
-        left, right = st.columns([1, 1])
-        with left:
-            mode = st.radio("Order by", ["Highest sentiment", "Most reactions"], horizontal=True)
-        with right:
-            n_show = st.slider("How many to show", 5, 50, 15, step=5)
-
-        cdf = comments_df.copy()
-        # Localized comment date (optional)
-        if cdf["comment_publishedAt"].notna().any():
-            try:
-                cdf["comment_local"] = cdf["comment_publishedAt"].dt.tz_convert(LOCAL_TZ)
-            except Exception:
-                cdf["comment_local"] = pd.to_datetime(cdf["comment_publishedAt"], utc=True).dt.tz_convert(LOCAL_TZ)
-        else:
-            cdf["comment_local"] = pd.NaT
-
-        cdf["total_rx"] = cdf[["comment_like","comment_love","comment_haha","comment_wow","comment_sad","comment_angry"]].sum(axis=1)
-
-        if mode == "Highest sentiment":
-            cdf = cdf.sort_values("comment_sentiment", ascending=False, na_position="last")
-        else:
-            cdf = cdf.sort_values("total_rx", ascending=False, na_position="last")
-
-        show = cdf.head(n_show)[[
-            "newsId", "title", "comment_text", "comment_sentiment", "total_rx",
-            "comment_replies", "comment_local",
-            "cand_anura","cand_sajith","cand_ranil","cand_other","cand_no_one"
-        ]]
         st.dataframe(show, use_container_width=True, hide_index=True)
 
 st.markdown("---")
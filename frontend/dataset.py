@@ -0,0 +1,280 @@
+# dataset.py — incremental, date-partitioned Parquet copy of the dashboard's article and comment rows
+#
+#   python dataset.py [--dir DIR] [--full]
+#
+# DIR/articles and DIR/comments hold one file per local publishing date (date=YYYY-MM-DD/part-0.parquet,
+# date=unknown for articles without a time), and DIR/state.json the watermark of the last export. A run
+# fetches only the articles inserted or written after the watermark (snapshot.changed_since) and rewrites the
+# partitions they fall in. The watermark is looked back WATERMARK_LAG_SECONDS, so writes that land out of
+# order are still exported; the rows fetched again just replace themselves. A state.json from before the
+# updatedAt watermark makes the next run fetch every written article once. Articles deleted from MongoDB
+# stay in the dataset until a --full export.
+#
+# The readers below push the filters down: the date range prunes partitions and, with the rows of a partition
+# sorted by language, the languages skip row groups. With PARQUET_DIR set, dashboard.py reads the dataset
+# through the same query functions as queries.py instead of MongoDB.
+import argparse
+import os
+import shutil
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from bson import json_util
+
+import queries
+from queries import CANDIDATES, COMMENT_COLUMNS, LOCAL_TZ, REACTION_KEYS, WEEKDAYS, Filters
+from snapshot import advance, changed_since
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARQUET_DIR = os.getenv("PARQUET_DIR")
+UNKNOWN_DATE = "unknown"
+
+
+def _schemas():
+    # Fixed column types, so that partitions written from different batches read back as one dataset
+    _require_pyarrow()
+    article = pa.schema(
+        [("_id", pa.string()), ("newsId", pa.int64()), ("title", pa.string()),
+         ("publishedAt", pa.timestamp("us", tz="UTC")), ("lang", pa.string()), ("sentiment", pa.float64()),
+         ("rx_total", pa.int64()), ("commentCount", pa.int64()), ("top_candidate", pa.string())]
+        + [(f"w_{c}", pa.float64()) for c in CANDIDATES]
+        + [(f"rx_{k}", pa.int64()) for k in REACTION_KEYS]
+    )
+    comment = pa.schema(
+        [("article_id", pa.string()), ("newsId", pa.int64()), ("title", pa.string()), ("comment_text", pa.string()),
+         ("comment_sentiment", pa.float64()), ("total_rx", pa.int64()), ("comment_replies", pa.int64()),
+         ("comment_local", pa.timestamp("us", tz=LOCAL_TZ))]
+        + [(f"cand_{c}", pa.float64()) for c in CANDIDATES]
+    )
+    return article, comment
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("The Parquet dataset needs pyarrow: pip install pyarrow")
+
+
+# =========================
+# Export
+# =========================
+def _dates(published_local: pd.Series) -> pd.Series:
+    return published_local.map(lambda day: day.isoformat() if isinstance(day, date) else UNKNOWN_DATE)
+
+
+def _upsert(root: str, rows: pd.DataFrame, key: str, replaced: List[str], schema) -> int:
+    """
+    Replace the rows whose key is in replaced (wherever they are) by rows, one partition file at a time.
+
+    :param rows: New rows with a "date" column naming their partition.
+    :return: Number of partition files rewritten.
+    """
+    touched = set(rows["date"])
+    if replaced and os.path.isdir(root):
+        stale = ds.dataset(root, format="parquet", partitioning=_partitioning()).to_table(
+            columns=["date"], filter=ds.field(key).isin(replaced)
+        )
+        touched |= set(stale["date"].to_pylist())
+
+    for day in sorted(touched):
+        directory = os.path.join(root, f"date={day}")
+        path = os.path.join(directory, "part-0.parquet")
+        parts = [rows.loc[rows["date"] == day, schema.names]]
+        if os.path.exists(path):
+            existing = pq.read_table(path, schema=schema).to_pandas()
+            parts.insert(0, existing.loc[~existing[key].isin(replaced)])
+        partition = pd.concat([part for part in parts if not part.empty] or parts[:1], ignore_index=True)
+        if partition.empty:
+            shutil.rmtree(directory, ignore_errors=True)
+            continue
+        if "lang" in partition:
+            partition = partition.sort_values("lang", kind="stable")
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.tmp"
+        pq.write_table(pa.Table.from_pandas(partition, schema=schema, preserve_index=False), temporary,
+                       row_group_size=50000)
+        os.replace(temporary, path)
+    return len(touched)
+
+
+def _load_state(directory: str) -> Dict[str, Any]:
+    path = os.path.join(directory, "state.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json_util.loads(f.read())
+
+
+def _save_state(directory: str, watermark: Dict[str, Any]) -> None:
+    path = os.path.join(directory, "state.json")
+    with open(f"{path}.tmp", "w") as f:
+        f.write(json_util.dumps(watermark))
+    os.replace(f"{path}.tmp", path)
+
+
+def export(coll, directory: str, full: bool = False) -> Dict[str, int]:
+    """
+    Bring the dataset in directory up to date with the collection.
+
+    :param full: Rebuild the dataset from every article instead of the changes since the last export.
+    :return: Articles and comments written, and partition files rewritten.
+    """
+    article_schema, comment_schema = _schemas()
+    if full:
+        for name in ("articles", "comments", "state.json"):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
+                os.remove(path)
+    os.makedirs(directory, exist_ok=True)
+    watermark = _load_state(directory)
+    match = changed_since(watermark)
+
+    articles = queries.article_rows(coll, match)
+    comments = queries.comment_rows(coll, match)
+    # Changed articles replace their old rows, and all of their comments
+    replaced = [str(_id) for _id in articles.index] if match is not None else []
+
+    article_rows = articles.reset_index()
+    article_rows["_id"] = article_rows["_id"].astype(str)
+    article_rows["date"] = _dates(article_rows["published_local"])
+    comments["article_id"] = comments["article_id"].astype(str)
+    comments["date"] = _dates(comments["published_local"])
+
+    stats = {
+        "articles": len(article_rows),
+        "comments": len(comments),
+        "partitions": _upsert(os.path.join(directory, "articles"), article_rows, "_id", replaced, article_schema)
+        + _upsert(os.path.join(directory, "comments"), comments, "article_id", replaced, comment_schema),
+    }
+    # Only a complete run moves the watermark; an interrupted one is redone by the next
+    _save_state(directory, advance(watermark, articles))
+    return stats
+
+
+# =========================
+# Reading
+# =========================
+def _read(root: str, schema, columns: List[str], expression=None) -> pd.DataFrame:
+    if not os.path.isdir(root):
+        return schema.append(pa.field("date", pa.string())).empty_table().select(columns).to_pandas()
+    dataset = ds.dataset(root, format="parquet", partitioning=_partitioning())
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def _published_local(dates: pd.Series) -> pd.Series:
+    return dates.map(lambda day: None if day == UNKNOWN_DATE else date.fromisoformat(day)).astype(object)
+
+
+def _in_range(filters: Filters):
+    # UNKNOWN_DATE sorts after every ISO date, so a range ending on a date leaves it out
+    day = ds.field("date")
+    return (day >= filters.start_date.isoformat()) & (day <= filters.end_date.isoformat())
+
+
+def read_articles(directory: str, filters: Optional[Filters] = None,
+                  columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    The exported article rows, indexed by _id, as queries.article_rows returns them (without the watermark
+    fields); with filters, only those in the date range and languages with enough reactions.
+
+    :param columns: Row columns to read, all by default.
+    """
+    expression = None
+    if filters is not None:
+        expression = _in_range(filters) & ds.field("lang").isin(list(filters.langs)) \
+            & (ds.field("rx_total") >= filters.min_rx)
+    schema = _schemas()[0]
+    names = ["_id", "date"] + [c for c in (columns or schema.names) if c != "_id"]
+    frame = _read(os.path.join(directory, "articles"), schema, names, expression)
+    frame["published_local"] = _published_local(frame.pop("date"))
+    return frame.set_index("_id")
+
+
+def read_comments(directory: str, filters: Optional[Filters] = None) -> pd.DataFrame:
+    # The exported comment rows; with filters, only those of articles published in the date range
+    schema = _schemas()[1]
+    frame = _read(os.path.join(directory, "comments"), schema, schema.names + ["date"],
+                  _in_range(filters) if filters is not None else None)
+    frame["published_local"] = _published_local(frame.pop("date"))
+    return frame
+
+
+# The queries.py views over the dataset, for dashboard.py with PARQUET_DIR set
+def filter_options(directory: str) -> Dict[str, Any]:
+    frame = _read(os.path.join(directory, "articles"), _schemas()[0], ["date", "lang"])
+    if frame.empty:
+        return {}
+    dates = frame.loc[frame["date"] != UNKNOWN_DATE, "date"]
+    return {
+        "min_date": date.fromisoformat(dates.min()) if len(dates) else None,
+        "max_date": date.fromisoformat(dates.max()) if len(dates) else None,
+        "langs": sorted(frame["lang"].unique()),
+    }
+
+
+def articles(directory: str, filters: Filters) -> pd.DataFrame:
+    return read_articles(directory, filters)
+
+
+def totals(directory: str, filters: Filters) -> Dict[str, Any]:
+    frame = read_articles(directory, filters)
+    sums = ["rx_total", "commentCount"] + [f"rx_{k}" for k in REACTION_KEYS]
+    return {
+        "articles": len(frame),
+        "sentiment": float(frame["sentiment"].mean()) if len(frame) else np.nan,
+        **{column: int(frame[column].sum()) for column in sums},
+        **{f"w_{c}": float(frame[f"w_{c}"].sum()) for c in CANDIDATES},
+    }
+
+
+def daily(directory: str, filters: Filters) -> pd.DataFrame:
+    cand_cols = [f"w_{c}" for c in CANDIDATES]
+    frame = read_articles(directory, filters, ["sentiment"] + cand_cols)
+    grouped = frame.groupby("published_local", sort=True)
+    result = pd.concat([grouped["sentiment"].mean(), grouped[cand_cols].sum()], axis=1).reset_index()
+    return result[["published_local", "sentiment"] + cand_cols].astype({"sentiment": float})
+
+
+def cadence(directory: str, filters: Filters) -> pd.DataFrame:
+    published = read_articles(directory, filters, ["publishedAt"])["publishedAt"].dt.tz_convert(LOCAL_TZ)
+    frame = pd.DataFrame({"weekday": published.dt.day_name(), "hour": published.dt.hour})
+    frame = frame.groupby(["weekday", "hour"]).size().rename("count").reset_index()
+    frame["weekday"] = pd.Categorical(frame["weekday"], ordered=True, categories=WEEKDAYS)
+    return frame.sort_values(["weekday", "hour"])
+
+
+def top_candidate_counts(directory: str, filters: Filters) -> pd.Series:
+    counts = read_articles(directory, filters, ["top_candidate"])["top_candidate"].value_counts()
+    return pd.Series([int(counts.get(c, 0)) for c in CANDIDATES], index=CANDIDATES, name="count")
+
+
+def top_comments(directory: str, order_by: str, limit: int) -> pd.DataFrame:
+    frame = read_comments(directory)
+    return frame.sort_values(order_by, ascending=False, kind="stable").head(limit)[COMMENT_COLUMNS]
+
+
+if __name__ == "__main__":
+    from mongo import get_collection
+
+    parser = argparse.ArgumentParser(description="Export the dashboard's article and comment rows to Parquet")
+    parser.add_argument("--dir", default=PARQUET_DIR or "parquet",
+                        help="Dataset directory (default: $PARQUET_DIR or ./parquet)")
+    parser.add_argument("--full", action="store_true", help="Rebuild the dataset instead of appending the changes")
+    args = parser.parse_args()
+
+    result = export(get_collection(), args.dir, full=args.full)
+    print(f"Exported {result['articles']} articles and {result['comments']} comments "
+          f"({result['partitions']} partition files rewritten) to {args.dir}")
@@ -0,0 +1,16 @@
+# mongo.py — the backend's shared, pooled MongoClient for the frontend scripts
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from database import get_mongo_client  # noqa: E402
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+DB_NAME = os.getenv("MONGO_DB", "esana_scraper")
+COLL_NAME = os.getenv("MONGO_COLL", "news_articles")
+
+
+def get_collection(coll_name: str = COLL_NAME, db_name: str = DB_NAME, uri: str = MONGO_URI):
+    # Every call (and every Streamlit rerun) reuses the same client and connection pool of uri
+    return get_mongo_client(uri)[db_name][coll_name]
@@ -0,0 +1,186 @@
+# prefix_sums.py — cumulative daily sums for constant-time totals over any date range
+#
+# For every language, the DAILY_FIELDS of each local publishing day (candidate weights, sentiment sum and count,
+# reactions, comments, articles, top-candidate counts) are kept with their running totals, so the sums over
+# [start, end] are cumulative[end + 1] - cumulative[start]: two lookups per language, whatever the range.
+# New days are appended and only the running totals from the first changed day on are recomputed.
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+import queries
+from queries import CANDIDATES, DAILY_FIELDS, Filters
+
+PREFIX_REFRESH_SECONDS = float(os.getenv("PREFIX_REFRESH_SECONDS", "60"))
+# Changes to days before the last one (e.g. old articles re-weighted) only show after a full reload
+PREFIX_FULL_RELOAD_SECONDS = float(os.getenv("PREFIX_FULL_RELOAD_SECONDS", "3600"))
+
+
+class PrefixSums:
+    """
+    Daily values and running totals of DAILY_FIELDS per language, over the days from origin on.
+    """
+
+    def __init__(self) -> None:
+        self.origin: Optional[date] = None
+        self.days = 0
+        self.daily: Dict[str, np.ndarray] = {}
+        # cumulative[lang][i] is the sum of the first i days, so row 0 is all zeros
+        self.cumulative: Dict[str, np.ndarray] = {}
+
+    def copy(self) -> "PrefixSums":
+        other = PrefixSums()
+        other.origin, other.days = self.origin, self.days
+        other.daily = {lang: values.copy() for lang, values in self.daily.items()}
+        other.cumulative = {lang: values.copy() for lang, values in self.cumulative.items()}
+        return other
+
+    @property
+    def last_day(self) -> Optional[date]:
+        return self.origin + timedelta(days=self.days - 1) if self.days else None
+
+    def update(self, rows: pd.DataFrame) -> None:
+        """
+        Sets the values of the (date, lang) rows of rows (queries.daily_rows), replacing those already held.
+        """
+        rows = rows.dropna(subset=["date"])
+        if rows.empty:
+            return
+        first, last = min(rows["date"]), max(rows["date"])
+        if self.origin is None:
+            self.origin = first
+        if first < self.origin:
+            self._grow(front=(self.origin - first).days)
+        self._grow(back=max(0, (last - self.origin).days + 1 - self.days))
+
+        offsets = np.array([(day - self.origin).days for day in rows["date"]])
+        for lang in rows["lang"].unique():
+            if lang not in self.daily:
+                self.daily[lang] = np.zeros((self.days, len(DAILY_FIELDS)))
+                self.cumulative[lang] = np.zeros((self.days + 1, len(DAILY_FIELDS)))
+            mine = (rows["lang"] == lang).to_numpy()
+            self.daily[lang][offsets[mine]] = rows.loc[mine, DAILY_FIELDS].to_numpy(dtype=float)
+
+        # Running totals before the first changed day are still right
+        start = int(offsets.min())
+        for lang, values in self.daily.items():
+            cumulative = self.cumulative[lang]
+            cumulative[start + 1:] = cumulative[start] + np.cumsum(values[start:], axis=0)
+
+    def _grow(self, front: int = 0, back: int = 0) -> None:
+        # Zero days before the origin and after the last day
+        if not (front or back):
+            return
+        for lang, values in self.daily.items():
+            width = len(DAILY_FIELDS)
+            values = np.vstack([np.zeros((front, width)), values, np.zeros((back, width))])
+            self.daily[lang] = values
+            self.cumulative[lang] = np.vstack([np.zeros((1, len(DAILY_FIELDS))), np.cumsum(values, axis=0)])
+        self.origin -= timedelta(days=front)
+        self.days += front + back
+
+    def sums(self, start_date: date, end_date: date, langs) -> pd.Series:
+        # DAILY_FIELDS summed over [start_date, end_date] and the languages
+        total = np.zeros(len(DAILY_FIELDS))
+        if self.days:
+            start = min(max((start_date - self.origin).days, 0), self.days)
+            end = min(max((end_date - self.origin).days + 1, 0), self.days)
+            for lang in langs:
+                if lang in self.cumulative and end > start:
+                    total += self.cumulative[lang][end] - self.cumulative[lang][start]
+        return pd.Series(total, index=DAILY_FIELDS)
+
+
+class DailyIndex:
+    """
+    PrefixSums of a collection's articles, loaded from the rollup when it is kept (queries.ROLLUP) and from the
+    articles otherwise. Refreshes load only the days from the last one held on, into a copy that replaces the
+    current PrefixSums once complete, so readers never see one half updated.
+    """
+
+    def __init__(self, coll, refresh_seconds: float = PREFIX_REFRESH_SECONDS,
+                 full_reload_seconds: float = PREFIX_FULL_RELOAD_SECONDS) -> None:
+        self.coll = coll
+        self.refresh_seconds = refresh_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.prefix: Optional[PrefixSums] = None
+        self.refreshed_at = 0.0
+        self.loaded_at = 0.0
+        self.last_error: Optional[Exception] = None
+        self.stats = {"full_loads": 0, "delta_loads": 0, "delta_rows": 0}
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def _rows(self, since: Optional[date] = None) -> pd.DataFrame:
+        load = queries.rollup_daily_rows if queries.ROLLUP else queries.daily_rows
+        return load(self.coll, since)
+
+    def refresh(self) -> None:
+        # One refresh at a time, as for snapshot.ArticleSnapshot; a failed one keeps the last good sums
+        if not self._refreshing.acquire(blocking=self.prefix is None):
+            return
+        try:
+            started = time.monotonic()
+            if self.prefix is None or started - self.loaded_at > self.full_reload_seconds:
+                prefix = PrefixSums()
+                prefix.update(self._rows())
+                self.loaded_at = started
+                self.stats["full_loads"] += 1
+            else:
+                # The last day held may still have grown
+                prefix = self.prefix.copy()
+                rows = self._rows(prefix.last_day)
+                prefix.update(rows)
+                self.stats["delta_loads"] += 1
+                self.stats["delta_rows"] += len(rows)
+            with self._lock:
+                self.prefix = prefix
+                self.refreshed_at = time.monotonic()
+                self.last_error = None
+        except Exception as e:
+            self.last_error = e
+            print(f"Daily index refresh failed, keeping the last sums: {e}")
+            if self.prefix is None:
+                raise
+        finally:
+            self._refreshing.release()
+
+    def get(self) -> PrefixSums:
+        """
+        The current PrefixSums. Only the first call waits for a load; later ones return at once and start a
+        refresh in the background when the sums are stale.
+        """
+        if self.prefix is None:
+            self.refresh()
+        elif time.monotonic() - self.refreshed_at > self.refresh_seconds and not self._refreshing.locked():
+            threading.Thread(target=self.refresh, name="daily-index-refresh", daemon=True).start()
+        with self._lock:
+            return self.prefix
+
+    def age(self) -> float:
+        return time.monotonic() - self.refreshed_at
+
+    def _sums(self, filters: Filters) -> pd.Series:
+        if filters.min_rx:
+            raise ValueError("The daily index has no per-article reactions to apply a reaction floor to")
+        return self.get().sums(filters.start_date, filters.end_date, filters.langs)
+
+    def totals(self, filters: Filters) -> Dict[str, Any]:
+        # queries.totals() in two lookups per language
+        return queries.totals_from_sums(self._sums(filters))
+
+    def shares(self, filters: Filters) -> pd.Series:
+        # Each candidate's share of the total weight
+        weights = self._sums(filters)[[f"w_{c}" for c in CANDIDATES]].set_axis(CANDIDATES)
+        total = weights.sum()
+        return weights / total if total else weights * 0.0
+
+    def top_candidate_counts(self, filters: Filters) -> pd.Series:
+        # queries.top_candidate_counts()
+        sums = self._sums(filters)
+        return pd.Series([int(sums[f"top_{c}"]) for c in CANDIDATES], index=CANDIDATES, name="count")
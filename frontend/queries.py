@@ -0,0 +1,439 @@
+# queries.py — aggregation pipelines behind dashboard.py
+#
+# Every view is computed by MongoDB from the sidebar filters, so a page load transfers the sums, means and
+# top-N rows it plots instead of every article with its body and comments.
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+CANDIDATES = ["anura", "sajith", "ranil", "other", "no_one"]
+REACTION_KEYS = ["like", "love", "haha", "wow", "sad", "angry"]
+LOCAL_TZ = "Asia/Colombo"
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+ARTICLE_COLUMNS = [
+    "newsId", "title", "publishedAt", "published_local", "lang",
+    "sentiment", "rx_total", "commentCount", "top_candidate"
+] + [f"w_{c}" for c in CANDIDATES]
+COMMENT_COLUMNS = [
+    "newsId", "title", "comment_text", "comment_sentiment", "total_rx", "comment_replies", "comment_local"
+] + [f"cand_{c}" for c in CANDIDATES]
+# Daily rollup kept by the processors (backend/rollup.py, ROLLUP=1 there too), one document per date, language
+# and source; the rollup_ views read it instead of the articles when no reaction floor is set. It follows the
+# processors' writes, so a re-scrape shows once the article is processed again (or after `python rollup.py`)
+ROLLUP = os.getenv("ROLLUP", "0") == "1"
+ROLLUP_COLLECTION = os.getenv("ROLLUP_COLLECTION", "daily_rollup")
+# Per (local date, language) sums of the rollup and of daily_rows(); sentiment is kept as a sum and a count
+DAILY_FIELDS = (["articles", "commentCount", "sentiment_sum", "sentiment_count"] + [f"w_{c}" for c in CANDIDATES]
+                + [f"rx_{k}" for k in REACTION_KEYS] + [f"top_{c}" for c in CANDIDATES])
+# Server time of an article's last write by the processors ($currentDate in backend update_doc), by row column.
+# Re-scraped articles show up once the processors predict them again
+WATERMARK_FIELDS = {"_updatedAt": "updatedAt"}
+
+
+class Filters(NamedTuple):
+    start_date: date
+    end_date: date
+    langs: List[str]
+    min_rx: int = 0
+
+
+# =========================
+# Expressions
+# =========================
+def _present(field: str) -> Dict[str, Any]:
+    # Python truthiness of a string field: set, not null and not empty
+    return {"$and": [{"$ifNull": [field, False]}, {"$ne": [field, ""]}]}
+
+
+def _rfc_as_iso(field: str) -> Dict[str, Any]:
+    # "Fri, 20 Sep 2024 12:58:32 GMT+0000" -> "2024-09-20T12:58:32+0000"; anything else ends up unparseable
+    parts = {"$split": [field, " "]}
+    month = {"$arrayElemAt": [[""] + [f"{m:02d}" for m in range(1, 13)],
+                              {"$add": [{"$indexOfArray": [_MONTHS, {"$arrayElemAt": ["$$parts", 2]}]}, 1]}]}
+    return {"$let": {"vars": {"parts": parts}, "in": {"$concat": [
+        {"$arrayElemAt": ["$$parts", 3]}, "-", month, "-", {"$arrayElemAt": ["$$parts", 1]},
+        "T", {"$arrayElemAt": ["$$parts", 4]},
+        {"$substrCP": [{"$ifNull": [{"$arrayElemAt": ["$$parts", 5]}, "GMT"]}, 3, 5]},
+    ]}}}
+
+
+def date_expr(field: str) -> Dict[str, Any]:
+    """
+    The field as a date, like pd.to_datetime(x, utc=True, errors="coerce"): dates are kept, ISO strings and
+    the scrapers' "Fri, 20 Sep 2024 12:58:32 GMT+0000" strings are parsed, and everything else is null.
+    """
+    return {"$switch": {
+        "branches": [
+            {"case": {"$eq": [{"$type": field}, "date"]}, "then": field},
+            {"case": {"$eq": [{"$type": field}, "string"]}, "then": {"$dateFromString": {
+                "dateString": field,
+                "onError": {"$dateFromString": {"dateString": _rfc_as_iso(field), "onError": None, "onNull": None}},
+            }}},
+        ],
+        "default": None,
+    }}
+
+
+def _top_candidate(prefix: str) -> Dict[str, Any]:
+    # First candidate (in CANDIDATES order) with the highest weight, as max() picks it
+    branches = []
+    for i, c in enumerate(CANDIDATES):
+        others = [{"$gt": [f"${prefix}{c}", f"${prefix}{o}"]} for o in CANDIDATES[:i]]
+        others += [{"$gte": [f"${prefix}{c}", f"${prefix}{o}"]} for o in CANDIDATES[i + 1:]]
+        branches.append({"case": {"$and": others}, "then": c})
+    return {"$switch": {"branches": branches, "default": CANDIDATES[0]}}
+
+
+# Per-article row fields, derived as dashboard.py used to in Python. The candidate weights are the waiter's,
+# or the candidate model's until the article is weighted; analytics.py and the Parquet export count the same
+WEIGHTS = {"$cond": [
+    {"$gt": [{"$size": {"$objectToArray": {"$ifNull": ["$pt_the_waiter.total_candidate_weights", {}]}}}, 0]},
+    "$pt_the_waiter.total_candidate_weights",
+    {"$ifNull": ["$pt_the_candi", {}]},
+]}
+# The stored fields ROW_STAGES reads, projected first so bodies and comments never enter the pipeline; only
+# whether a body is set matters, so each is cut down to a flag
+SOURCE_STAGE: Dict[str, Any] = {"$project": {
+    "newsId": 1, "newsTitleEn": 1, "newsTitleLl": 1, "publishedAt": 1, "published": 1, "lang": 1,
+    "reactions": 1, "commentCount": 1, "pt_the_senti.sentiment_score": 1, "pt_the_candi": 1,
+    "pt_the_waiter.total_candidate_weights": 1,
+    **{field: {"$cond": [_present(f"${field}"), True, False]} for field in ("newsContentEn", "newsContentLl")},
+    **{field: 1 for field in WATERMARK_FIELDS.values()},
+}}
+ROW_STAGES: List[Dict[str, Any]] = [
+    {"$addFields": {
+        # Stamped articles carry their publishing time and language (backend/stamps.py)
+        "published": {"$ifNull": ["$published", date_expr("$publishedAt")]},
+        "title": {"$switch": {"branches": [
+            {"case": _present("$newsTitleEn"), "then": "$newsTitleEn"},
+            {"case": _present("$newsTitleLl"), "then": "$newsTitleLl"},
+        ], "default": {"$concat": ["News #", {"$ifNull": [{"$toString": "$newsId"}, "—"]}]}}},
+        "lang": {"$ifNull": ["$lang", {"$switch": {"branches": [
+            {"case": {"$or": [_present("$newsTitleLl"), _present("$newsContentLl")]}, "then": "si"},
+            {"case": {"$or": [_present("$newsTitleEn"), _present("$newsContentEn")]}, "then": "en"},
+        ], "default": "unknown"}}]},
+        "sentiment": "$pt_the_senti.sentiment_score",
+        "commentCount": {"$ifNull": ["$commentCount", 0]},
+        **{f"rx_{k}": {"$ifNull": [f"$reactions.{k}", 0]} for k in REACTION_KEYS},
+        **{f"w_{c}": {"$let": {"vars": {"w": WEIGHTS}, "in": {"$ifNull": [f"$$w.{c}", 0.0]}}} for c in CANDIDATES},
+    }},
+    {"$addFields": {
+        "published_local": {"$dateToString": {"format": "%Y-%m-%d", "date": "$published", "timezone": LOCAL_TZ}},
+        "rx_total": {"$add": [f"$rx_{k}" for k in REACTION_KEYS]},
+        "top_candidate": _top_candidate("w_"),
+    }},
+]
+
+
+def local_midnight(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=ZoneInfo(LOCAL_TZ)).astimezone(timezone.utc)
+
+
+def published_match(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    langs: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    A leading $match on the stored published and lang (published_lang index), so only the articles in the
+    range reach ROW_STAGES. Articles not stamped yet all pass; the $match on the derived fields decides on them.
+    """
+    stamped: Dict[str, Any] = {"published": {"$ne": None}}
+    if start is not None:
+        stamped["published"]["$gte"] = start
+    if end is not None:
+        stamped["published"]["$lt"] = end
+    if langs is not None:
+        stamped["lang"] = {"$in": list(langs)}
+    return {"$match": {"$or": [stamped, {"published": {"$exists": False}}]}}
+
+
+def filtered(filters: Filters) -> List[Dict[str, Any]]:
+    # Rows of the articles published (local time) in the date range, in the languages, with enough reactions
+    start, end = local_midnight(filters.start_date), local_midnight(filters.end_date + timedelta(days=1))
+    return [published_match(start, end, filters.langs), SOURCE_STAGE] + ROW_STAGES + [{"$match": {
+        "published": {"$gte": start, "$lt": end},
+        "lang": {"$in": list(filters.langs)},
+        "rx_total": {"$gte": filters.min_rx},
+    }}]
+
+
+def _sums(fields: List[str]) -> Dict[str, Any]:
+    return {field: {"$sum": f"${field}"} for field in fields}
+
+
+# =========================
+# Queries
+# =========================
+def _local_date(moment: Optional[datetime]) -> Optional[date]:
+    # Stored times come back naive (UTC) unless the client is tz_aware
+    if moment is None:
+        return None
+    return (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).astimezone(ZoneInfo(LOCAL_TZ)).date()
+
+
+def filter_options(coll) -> Dict[str, Any]:
+    """
+    Date bounds and languages offered by the sidebar, over every article. Stamped articles are answered from
+    the indexes (the ends of published_lang, the distinct keys of lang_1); only the unstamped ones are parsed.
+    """
+    dates, langs = [], set()
+    for direction in (1, -1):
+        doc = coll.find_one({"published": {"$ne": None}}, {"published": 1}, sort=[("published", direction)])
+        dates.append(_local_date(doc["published"]) if doc else None)
+    langs.update(lang for lang in coll.distinct("lang") if lang is not None)
+
+    unstamped = list(coll.aggregate([{"$match": {"published": {"$exists": False}}}, SOURCE_STAGE] + ROW_STAGES + [
+        {"$group": {
+            "_id": None,
+            "min_date": {"$min": "$published_local"},
+            "max_date": {"$max": "$published_local"},
+            "langs": {"$addToSet": "$lang"},
+        }},
+    ], allowDiskUse=True))
+    if unstamped:
+        options = unstamped[0]
+        dates += [date.fromisoformat(day) for day in (options["min_date"], options["max_date"]) if day]
+        langs.update(options["langs"])
+    if not langs:
+        # Every article has a language, if only "unknown"; none means no articles
+        return {}
+    known = [day for day in dates if day is not None]
+    return {
+        "min_date": min(known) if known else None,
+        "max_date": max(known) if known else None,
+        "langs": sorted(langs),
+    }
+
+
+def totals(coll, filters: Filters) -> Dict[str, Any]:
+    """
+    Article count, mean sentiment and the sums of comments, reactions and candidate weights of the filtered articles.
+    """
+    result = list(coll.aggregate(filtered(filters) + [{"$group": {
+        "_id": None,
+        "articles": {"$sum": 1},
+        "sentiment": {"$avg": "$sentiment"},
+        **_sums(["rx_total", "commentCount"] + [f"w_{c}" for c in CANDIDATES] + [f"rx_{k}" for k in REACTION_KEYS]),
+    }}], allowDiskUse=True))
+    if not result:
+        return {"articles": 0, "sentiment": np.nan, "rx_total": 0, "commentCount": 0,
+                **{f"w_{c}": 0.0 for c in CANDIDATES}, **{f"rx_{k}": 0 for k in REACTION_KEYS}}
+    result[0].pop("_id")
+    if result[0]["sentiment"] is None:
+        result[0]["sentiment"] = np.nan
+    return result[0]
+
+
+def daily(coll, filters: Filters) -> pd.DataFrame:
+    # Candidate weight sums and mean sentiment per local publishing day
+    result = list(coll.aggregate(filtered(filters) + [
+        {"$group": {"_id": "$published_local", "sentiment": {"$avg": "$sentiment"},
+                    **_sums([f"w_{c}" for c in CANDIDATES])}},
+        {"$sort": {"_id": 1}},
+    ], allowDiskUse=True))
+    frame = pd.DataFrame(result, columns=["_id", "sentiment"] + [f"w_{c}" for c in CANDIDATES])
+    frame.insert(0, "published_local", pd.to_datetime(frame.pop("_id")).dt.date)
+    return frame.astype({"sentiment": float})
+
+
+def cadence(coll, filters: Filters) -> pd.DataFrame:
+    # Articles per local weekday and hour
+    result = list(coll.aggregate(filtered(filters) + [
+        {"$group": {"_id": {"weekday": {"$isoDayOfWeek": {"date": "$published", "timezone": LOCAL_TZ}},
+                            "hour": {"$hour": {"date": "$published", "timezone": LOCAL_TZ}}},
+                    "count": {"$sum": 1}}},
+    ], allowDiskUse=True))
+    frame = pd.DataFrame(
+        [{"weekday": WEEKDAYS[r["_id"]["weekday"] - 1], "hour": r["_id"]["hour"], "count": r["count"]} for r in result],
+        columns=["weekday", "hour", "count"],
+    )
+    frame["weekday"] = pd.Categorical(frame["weekday"], ordered=True, categories=WEEKDAYS)
+    return frame.sort_values(["weekday", "hour"])
+
+
+def top_candidate_counts(coll, filters: Filters) -> pd.Series:
+    # Number of articles on which each candidate has the highest weight
+    result = coll.aggregate(filtered(filters) + [{"$group": {"_id": "$top_candidate", "count": {"$sum": 1}}}],
+                            allowDiskUse=True)
+    counts = {r["_id"]: r["count"] for r in result}
+    return pd.Series([counts.get(c, 0) for c in CANDIDATES], index=CANDIDATES, name="count")
+
+
+def daily_rows(coll, since: Optional[date] = None) -> pd.DataFrame:
+    """
+    The DAILY_FIELDS of every local publishing date (from since on) and language, over all articles.
+    """
+    start = local_midnight(since) if since is not None else None
+    match = {"published": {"$gte": start} if start is not None else {"$ne": None}}
+    sentiment_count = {"$cond": [{"$eq": [{"$ifNull": ["$sentiment", None]}, None]}, 0, 1]}
+    pipeline = [published_match(start), SOURCE_STAGE] + ROW_STAGES + [{"$match": match}, {"$group": {
+        "_id": {"date": "$published_local", "lang": "$lang"},
+        "articles": {"$sum": 1},
+        "sentiment_sum": {"$sum": "$sentiment"},
+        "sentiment_count": {"$sum": sentiment_count},
+        **_sums(["commentCount"] + [f"w_{c}" for c in CANDIDATES] + [f"rx_{k}" for k in REACTION_KEYS]),
+        **{f"top_{c}": {"$sum": {"$cond": [{"$eq": ["$top_candidate", c]}, 1, 0]}} for c in CANDIDATES},
+    }}]
+    result = coll.aggregate(pipeline, allowDiskUse=True)
+    frame = pd.DataFrame([{**r.pop("_id"), **r} for r in result], columns=["date", "lang"] + DAILY_FIELDS)
+    frame["date"] = pd.to_datetime(frame["date"]).dt.date
+    return frame
+
+
+def article_rows(coll, match: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """
+    Rows of every article (or of those matching match) with all ARTICLE_COLUMNS and the per-reaction counts,
+    indexed by _id, plus the raw WATERMARK_FIELDS a snapshot needs to ask for the articles changed after them.
+    """
+    rx_columns = [f"rx_{k}" for k in REACTION_KEYS]
+    pipeline = ([{"$match": match}] if match else []) + [SOURCE_STAGE] + ROW_STAGES + [{"$project": {
+        **{c: "$published" if c == "publishedAt" else 1 for c in ARTICLE_COLUMNS + rx_columns},
+        **{column: f"${field}" for column, field in WATERMARK_FIELDS.items()},
+    }}]
+    columns = ["_id"] + ARTICLE_COLUMNS + rx_columns + list(WATERMARK_FIELDS)
+    return _row_frame(coll.aggregate(pipeline, allowDiskUse=True), columns).set_index("_id")
+
+
+def _row_frame(rows: Iterable[Dict[str, Any]], columns: List[str]) -> pd.DataFrame:
+    frame = pd.DataFrame(list(rows), columns=columns)
+    if "publishedAt" in frame:
+        frame["publishedAt"] = pd.to_datetime(frame["publishedAt"], utc=True)
+    if "published_local" in frame:
+        frame["published_local"] = pd.to_datetime(frame["published_local"]).dt.date
+    if "sentiment" in frame:
+        frame["sentiment"] = frame["sentiment"].astype(float)
+    return frame
+
+
+def _comment_fields(title: Any) -> Dict[str, Any]:
+    # COMMENT_COLUMNS of an unwound top_comments entry
+    comment = "$top_comments"
+    return {
+        "newsId": 1,
+        "title": title,
+        "comment_text": f"{comment}.commentText",
+        "comment_sentiment": {"$ifNull": [f"{comment}.pt_the_senti.sentiment_score", None]},
+        "total_rx": {"$add": [{"$ifNull": [f"{comment}.commentReaction.{k}", 0]} for k in REACTION_KEYS]},
+        "comment_replies": {"$ifNull": [f"{comment}.commentReplyCount", 0]},
+        "comment_local": date_expr(f"{comment}.publishedAt"),
+        **{f"cand_{c}": {"$ifNull": [f"{comment}.pt_the_candi.{c}", None]} for c in CANDIDATES},
+    }
+
+
+def _comment_frame(rows: Iterable[Dict[str, Any]], columns: List[str]) -> pd.DataFrame:
+    frame = pd.DataFrame(list(rows), columns=columns)
+    frame["comment_local"] = pd.to_datetime(frame["comment_local"], utc=True).dt.tz_convert(LOCAL_TZ)
+    return frame.astype({"comment_sentiment": float, **{f"cand_{c}": float for c in CANDIDATES}})
+
+
+def top_comments(coll, order_by: str, limit: int) -> pd.DataFrame:
+    """
+    The top comments of all articles, highest first.
+
+    :param order_by: "comment_sentiment" or "total_rx".
+    """
+    pipeline = [
+        {"$match": {"top_comments.0": {"$exists": True}}},
+        {"$project": {"newsId": 1, "newsTitleEn": 1, "newsTitleLl": 1, "top_comments": 1}},
+        {"$unwind": "$top_comments"},
+        {"$project": {"_id": 0, **_comment_fields(ROW_STAGES[0]["$addFields"]["title"])}},
+        {"$sort": {order_by: -1}},
+        {"$limit": limit},
+    ]
+    return _comment_frame(coll.aggregate(pipeline, allowDiskUse=True), COMMENT_COLUMNS)
+
+
+def comment_rows(coll, match: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """
+    Rows of the top comments of every article (or of those matching match) with all COMMENT_COLUMNS, plus the
+    article's _id (article_id) and local publishing date (published_local).
+    """
+    with_comments = [{"$match": {"top_comments.0": {"$exists": True}}}]
+    pipeline = ([{"$match": match}] if match else []) + with_comments + ROW_STAGES + [
+        {"$project": {"newsId": 1, "title": 1, "published_local": 1, "top_comments": 1}},
+        {"$unwind": "$top_comments"},
+        {"$project": {"_id": 0, "article_id": "$_id", "published_local": 1, **_comment_fields("$title")}},
+    ]
+    columns = ["article_id", "published_local"] + COMMENT_COLUMNS
+    frame = _comment_frame(coll.aggregate(pipeline, allowDiskUse=True), columns)
+    frame["published_local"] = pd.to_datetime(frame["published_local"]).dt.date
+    return frame
+
+
+# =========================
+# Rollup views
+# =========================
+def _rollup_docs(coll, query: Dict[str, Any]) -> pd.DataFrame:
+    # The rollup documents of the articles' collection matching query; missing sums are 0
+    docs = coll.database[ROLLUP_COLLECTION].find({"source": coll.name, **query}, {"_id": 0, "ops": 0})
+    fields = DAILY_FIELDS + [f"hour_{h}" for h in range(24)]
+    frame = pd.DataFrame(list(docs))
+    return frame.reindex(columns=["date", "lang"] + fields).fillna({field: 0 for field in fields})
+
+
+def _rollup_frame(coll, filters: Filters) -> pd.DataFrame:
+    if filters.min_rx:
+        raise ValueError("The rollup has no per-article reactions to apply a reaction floor to")
+    return _rollup_docs(coll, {
+        "date": {"$gte": filters.start_date.isoformat(), "$lte": filters.end_date.isoformat()},
+        "lang": {"$in": list(filters.langs)},
+    })
+
+
+def rollup_daily_rows(coll, since: Optional[date] = None) -> pd.DataFrame:
+    # daily_rows() from the rollup
+    frame = _rollup_docs(coll, {"date": {"$gte": since.isoformat()} if since else {"$ne": None}})
+    frame = frame.groupby(["date", "lang"], as_index=False)[DAILY_FIELDS].sum()
+    frame["date"] = pd.to_datetime(frame["date"]).dt.date
+    return frame
+
+
+def totals_from_sums(sums: pd.Series) -> Dict[str, Any]:
+    # totals() from the DAILY_FIELDS summed over the filtered days and languages
+    rx = [f"rx_{k}" for k in REACTION_KEYS]
+    return {
+        "articles": int(sums["articles"]),
+        "sentiment": sums["sentiment_sum"] / sums["sentiment_count"] if sums["sentiment_count"] else np.nan,
+        "rx_total": int(sums[rx].sum()),
+        "commentCount": int(sums["commentCount"]),
+        **{f"w_{c}": float(sums[f"w_{c}"]) for c in CANDIDATES},
+        **{k: int(sums[k]) for k in rx},
+    }
+
+
+def rollup_totals(coll, filters: Filters) -> Dict[str, Any]:
+    # totals() from the rollup
+    return totals_from_sums(_rollup_frame(coll, filters)[DAILY_FIELDS].sum())
+
+
+def rollup_daily(coll, filters: Filters) -> pd.DataFrame:
+    # daily() from the rollup
+    cand_cols = [f"w_{c}" for c in CANDIDATES]
+    rollup = _rollup_frame(coll, filters)
+    frame = rollup.groupby("date", sort=True)[["sentiment_sum", "sentiment_count"] + cand_cols].sum().reset_index()
+    frame.insert(0, "published_local", pd.to_datetime(frame.pop("date")).dt.date)
+    frame.insert(1, "sentiment", frame.pop("sentiment_sum") / frame.pop("sentiment_count").replace(0, np.nan))
+    return frame.astype({"sentiment": float})
+
+
+def rollup_cadence(coll, filters: Filters) -> pd.DataFrame:
+    # cadence() from the rollup: the hours are counted per local date, which gives the weekday
+    rollup = _rollup_frame(coll, filters)
+    hours = [f"hour_{h}" for h in range(24)]
+    rollup["weekday"] = pd.to_datetime(rollup["date"]).dt.day_name()
+    frame = rollup.groupby("weekday")[hours].sum().stack().rename("count").reset_index()
+    frame = frame.rename(columns={frame.columns[1]: "hour"})
+    frame["hour"] = frame["hour"].str.removeprefix("hour_").astype(int)
+    frame = frame.loc[frame["count"] > 0].astype({"count": int})
+    frame["weekday"] = pd.Categorical(frame["weekday"], ordered=True, categories=WEEKDAYS)
+    return frame.sort_values(["weekday", "hour"])
+
+
+def rollup_top_candidate_counts(coll, filters: Filters) -> pd.Series:
+    # top_candidate_counts() from the rollup
+    sums = _rollup_frame(coll, filters)[[f"top_{c}" for c in CANDIDATES]].sum()
+    return pd.Series([int(sums[f"top_{c}"]) for c in CANDIDATES], index=CANDIDATES, name="count")
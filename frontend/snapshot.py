@@ -0,0 +1,130 @@
+# snapshot.py — process-wide, stale-while-revalidate snapshot of the dashboard's article rows
+#
+# Visitors always get the last good snapshot at once. When it is older than SNAPSHOT_REFRESH_SECONDS, a
+# background thread fetches only the articles inserted or changed after the watermark (less a lag, as writes
+# land out of order) and merges them in.
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+import pandas as pd
+from bson import ObjectId
+
+import queries
+
+SNAPSHOT_REFRESH_SECONDS = float(os.getenv("SNAPSHOT_REFRESH_SECONDS", "60"))
+# Deleted articles only drop out of the snapshot on a full reload
+SNAPSHOT_FULL_RELOAD_SECONDS = float(os.getenv("SNAPSHOT_FULL_RELOAD_SECONDS", "3600"))
+# How late a write may become visible after its stamp and still be picked up: well over the processors'
+# BULK_FLUSH_SECONDS plus the clock skew between the scrapers' hosts and the server
+WATERMARK_LAG_SECONDS = float(os.getenv("WATERMARK_LAG_SECONDS", "120"))
+
+
+def changed_since(watermark: Dict[str, Any], lag_seconds: float = WATERMARK_LAG_SECONDS) -> Optional[Dict[str, Any]]:
+    """
+    Articles inserted or written after the watermark, looked back lag_seconds: writes do not become visible
+    in the order they were stamped (a scraper's ObjectId is made before its insert is sent, a write may commit
+    after later ones), so the rows of the last lag_seconds before the watermark are fetched again.
+    """
+    if not watermark:
+        return None
+    lag = timedelta(seconds=lag_seconds)
+    last_id = watermark.get("_id")
+    if isinstance(last_id, ObjectId):
+        conditions = [{"_id": {"$gt": ObjectId.from_datetime(last_id.generation_time - lag)}}]
+    else:
+        conditions = [{"_id": {"$gt": last_id}}] if last_id is not None else []
+    for column, field in queries.WATERMARK_FIELDS.items():
+        latest = watermark.get(column)
+        # Until a written article has been seen, every written article counts as changed
+        conditions.append({field: {"$gt": latest - lag} if latest is not None else {"$exists": True}})
+    return {"$or": conditions}
+
+
+def _latest(values: pd.Series) -> Any:
+    # Largest value of the type most values have; MongoDB only compares $gt within a type
+    values = values.dropna()
+    if values.empty:
+        return None
+    kind = values.map(type).mode()[0]
+    return max(value for value in values if isinstance(value, kind))
+
+
+def advance(watermark: Dict[str, Any], frame: pd.DataFrame) -> Dict[str, Any]:
+    # The watermark after the rows of frame (article_rows) were seen; a field never moves back
+    advanced = {"_id": _latest(pd.Series([watermark.get("_id")] + list(frame.index), dtype=object))}
+    advanced.update({
+        column: _latest(pd.Series([watermark.get(column)] + list(frame[column]), dtype=object))
+        for column in queries.WATERMARK_FIELDS
+    })
+    return advanced
+
+
+class ArticleSnapshot:
+    def __init__(self, coll, refresh_seconds: float = SNAPSHOT_REFRESH_SECONDS,
+                 full_reload_seconds: float = SNAPSHOT_FULL_RELOAD_SECONDS) -> None:
+        """
+        :param coll: Collection of the articles (mongo.get_collection()).
+        :param refresh_seconds: Age after which a request starts a background delta refresh.
+        :param full_reload_seconds: Age of the last full load after which a refresh reloads everything.
+        """
+        self.coll = coll
+        self.refresh_seconds = refresh_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.frame: Optional[pd.DataFrame] = None
+        self.watermark: Dict[str, Any] = {}
+        self.refreshed_at = 0.0
+        self.loaded_at = 0.0
+        self.last_error: Optional[Exception] = None
+        self.stats = {"full_loads": 0, "delta_loads": 0, "delta_rows": 0}
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def get(self) -> pd.DataFrame:
+        """
+        The current snapshot, indexed by _id with the queries.ARTICLE_COLUMNS. Only the first call waits for
+        a load; later ones return at once and start a refresh in the background when the snapshot is stale.
+        """
+        if self.frame is None:
+            self.refresh()
+        elif time.monotonic() - self.refreshed_at > self.refresh_seconds and not self._refreshing.locked():
+            threading.Thread(target=self.refresh, name="article-snapshot-refresh", daemon=True).start()
+        with self._lock:
+            return self.frame
+
+    def age(self) -> float:
+        return time.monotonic() - self.refreshed_at
+
+    def refresh(self) -> None:
+        # One refresh at a time; a failed one keeps the last good snapshot
+        if not self._refreshing.acquire(blocking=self.frame is None):
+            return
+        try:
+            started = time.monotonic()
+            match = changed_since(self.watermark)
+            if self.frame is None or match is None or started - self.loaded_at > self.full_reload_seconds:
+                frame = queries.article_rows(self.coll)
+                self.stats["full_loads"] += 1
+                self.loaded_at = started
+            else:
+                delta = queries.article_rows(self.coll, match)
+                frame = pd.concat([self.frame.drop(delta.index, errors="ignore"), delta]) if not delta.empty \
+                    else self.frame
+                self.stats["delta_loads"] += 1
+                self.stats["delta_rows"] += len(delta)
+
+            watermark = advance({}, frame)
+            with self._lock:
+                self.frame = frame
+                self.watermark = watermark
+                self.refreshed_at = time.monotonic()
+                self.last_error = None
+        except Exception as e:
+            self.last_error = e
+            print(f"Article snapshot refresh failed, keeping the last snapshot: {e}")
+            if self.frame is None:
+                raise
+        finally:
+            self._refreshing.release()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The dashboard modules import each other by name; the tests write through the backend's client
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for directory in ("backend", "frontend"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
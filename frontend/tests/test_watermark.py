@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+from bson import ObjectId
+
+mongomock = pytest.importorskip("mongomock")
+
+import queries
+from database import MongoDBClient
+from snapshot import advance, changed_since
+
+
+@pytest.fixture
+def client():
+    return mongomock.MongoClient()
+
+
+@pytest.fixture
+def articles(client):
+    # Inserted a day ago, so their ids are behind the lag of every watermark below
+    inserted = datetime.now(timezone.utc) - timedelta(days=1)
+    coll = client["news"]["articles"]
+    coll.insert_many([{"_id": ObjectId.from_datetime(inserted + timedelta(seconds=i)), "newsId": i} for i in range(3)])
+    return coll
+
+
+def worker(client):
+    # A processor buffering its writes; nothing reaches the database before flush()
+    db_client = MongoDBClient(uri=None, db_name="news", collection_name="articles", client=client)
+    db_client.enable_bulk_writes(flush_interval=3600)
+    return db_client
+
+
+def rows(coll, match=None):
+    # The watermark columns of queries.article_rows()
+    return pd.DataFrame(
+        [{"_id": doc["_id"], **{column: doc.get(field) for column, field in queries.WATERMARK_FIELDS.items()}}
+         for doc in coll.find(match or {})],
+        columns=["_id"] + list(queries.WATERMARK_FIELDS),
+    ).set_index("_id")
+
+
+def fetched(coll, watermark, **kwargs):
+    return {doc["newsId"] for doc in coll.find(changed_since(watermark, **kwargs))}
+
+
+def test_write_flushed_after_a_later_one_is_fetched(client, articles):
+    first, second, _ = [doc["_id"] for doc in articles.find().sort("_id", 1)]
+    slow, fast = worker(client), worker(client)
+    try:
+        slow.update_doc(first, {"predictedAt": datetime.utcnow()})
+        fast.update_doc(second, {"predictedAt": datetime.utcnow()})
+        fast.flush()
+        watermark = advance({}, rows(articles))
+
+        # Stamped by the server as it lands, so it is ahead of the watermark whenever it was queued
+        slow.flush()
+        assert 0 in fetched(articles, watermark, lag_seconds=0)
+        watermark = advance(watermark, rows(articles, changed_since(watermark)))
+        assert watermark["_updatedAt"] == articles.find_one({"_id": first})["updatedAt"]
+    finally:
+        slow.writer.close()
+        fast.writer.close()
+
+
+def test_write_committed_behind_the_watermark_is_fetched_within_the_lag(articles):
+    first, second, _ = [doc["_id"] for doc in articles.find().sort("_id", 1)]
+    articles.update_one({"_id": second}, {"$currentDate": {"updatedAt": True}})
+    watermark = advance({}, rows(articles))
+
+    # Stamped before the write seen last, visible only after it
+    articles.update_one({"_id": first}, {"$set": {"updatedAt": watermark["_updatedAt"] - timedelta(seconds=5)}})
+    assert 0 in fetched(articles, watermark, lag_seconds=60)
+    assert 0 not in fetched(articles, watermark, lag_seconds=0)
+
+
+def test_insert_with_an_earlier_id_is_fetched_within_the_lag(articles):
+    watermark = advance({}, rows(articles))
+    last = watermark["_id"].generation_time
+
+    articles.insert_one({"_id": ObjectId.from_datetime(last - timedelta(seconds=30)), "newsId": 3})
+    articles.insert_one({"_id": ObjectId.from_datetime(last - timedelta(seconds=600)), "newsId": 4})
+    assert fetched(articles, watermark, lag_seconds=60) >= {3}
+    assert 4 not in fetched(articles, watermark, lag_seconds=60)
+
+
+def test_watermark_never_moves_back(articles):
+    articles.update_many({}, {"$currentDate": {"updatedAt": True}})
+    watermark = advance({}, rows(articles))
+    assert advance(watermark, rows(articles, {"_id": None})) == watermark
+    assert changed_since({}) is None
@@ -1,54 +1,44 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from pymongo import MongoClient
 
-def load_data():
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client['esana_scraper']
-    collection = db['news_articles']
-    return list(collection.find())
+import analytics
+from analytics import Window
+from mongo import get_collection
+from prefix_sums import DailyIndex
+from queries import Filters
 
+CANDIDATES = ['anura', 'sajith', 'ranil', 'other', 'no_one']
+REACTIONS = ['like', 'love', 'haha', 'wow', 'sad', 'angry']
+# Sidebar time windows, in days (None: every article)
+WINDOWS = {"All time": None, "Last 24 hours": 1, "Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90}
 
-# Load data from MongoDB
-data = load_data()
 
+# Every statistic below is computed by MongoDB; only the results are loaded
+@st.cache_data(show_spinner=False, ttl=300)
+def load_summary(days):
+    window = Window.last_days(days) if days else None
+    collection = get_collection()
+    summary = analytics.summary(collection, window, candidates=CANDIDATES)
+    summary['histogram'] = analytics.sentiment_histogram(collection, window, bins=10, stats=summary['sentiment'])
+    summary['top_documents'] = analytics.top_documents(collection, window, n=5)
+    summary['daily_counts'] = analytics.daily_counts(collection, window)
+    return summary
 
-# Helper functions
-def get_candidate_scores(data):
-    candidate_scores = {'anura': 0, 'sajith': 0, 'ranil': 0, 'other': 0, 'no_one': 0}
-    candidate_top_counts = {'anura': 0, 'sajith': 0, 'ranil': 0, 'other': 0, 'no_one': 0}
 
-    for doc in data:
-        weights = doc.get('pt_the_waiter', {}).get('total_candidate_weights', {})
-        for candidate in ['anura', 'sajith', 'ranil', 'other', 'no_one']:
-            candidate_scores[candidate] += weights.get(candidate, 0)
-        if weights:
-            top_candidate = max(weights, key=weights.get)
-            if top_candidate in candidate_top_counts:
-                candidate_top_counts[top_candidate] += 1
+@st.cache_resource
+def load_daily_index():
+    # Running daily totals; the totals of any date range are two lookups per language
+    return DailyIndex(get_collection())
 
-    return candidate_scores, candidate_top_counts
 
+def load_comment_examples(n=3):
+    collection = get_collection()
+    return list(collection.find({}, {'newsTitleEn': 1, 'top_comments': 1}).limit(n))
 
 
-def get_sentiment_stats(data):
-    sentiment_scores = [
-        doc.get('pt_the_senti', {}).get('sentiment_score', 0) for doc in data
-    ]
-    return sentiment_scores
-
-
-def get_reaction_stats(data):
-    reactions = {'like': 0, 'love': 0, 'haha': 0, 'wow': 0, 'sad': 0, 'angry': 0}
-    for doc in data:
-        for rtype, count in doc.get('reactions', {}).items():
-            reactions[rtype] += count
-    return reactions
-
-
-def get_top_documents(data, key, n=5):
-    return sorted(data, key=lambda x: sum(x.get(key, {}).values()), reverse=True)[:n]
+window_label = st.sidebar.selectbox("Time window", list(WINDOWS))
+data = load_summary(WINDOWS[window_label])
 
 
 # Streamlit App Layout
@@ -56,42 +46,66 @@ st.title("Candidate Scoring Analysis Dashboard")
 
 # Section 1: Candidate Scoring
 st.header("1. Candidate Scoring Overview")
-candidate_scores, candidate_top_counts = get_candidate_scores(data)
+st.write(f"{data['articles']} articles ({window_label.lower()})")
+candidate_scores, candidate_top_counts = data['totals'], data['top']
 st.subheader("Total Candidate Scores")
 st.bar_chart(candidate_scores)
 
 st.subheader("Top Candidate Distribution")
 st.write(pd.DataFrame(candidate_top_counts.items(), columns=['Candidate', 'Top Counts']))
 
+st.subheader("Candidate Weights by Date Range")
+daily_index = load_daily_index()
+prefix = daily_index.get()
+if prefix.days:
+    first_day, last_day = prefix.origin, prefix.last_day
+    date_range = st.date_input("Published date range", value=(first_day, last_day),
+                               min_value=first_day, max_value=last_day)
+    # st.date_input returns a single date while the range is being picked
+    start_date, end_date = date_range if isinstance(date_range, tuple) and len(date_range) == 2 \
+        else (first_day, last_day)
+    range_filters = Filters(start_date, end_date, list(prefix.cumulative))
+    range_totals = daily_index.totals(range_filters)
+    st.write(f"{range_totals['articles']} articles published between {start_date} and {end_date}")
+    st.write(pd.DataFrame({
+        'Candidate': CANDIDATES,
+        'Weight': [range_totals[f'w_{c}'] for c in CANDIDATES],
+        'Share': daily_index.shares(range_filters).tolist(),
+    }))
+else:
+    st.write("No dated articles available.")
+
 # Section 2: Sentiment Analysis
 st.header("2. Sentiment Analysis")
-sentiment_scores = get_sentiment_stats(data)
+sentiment = data['sentiment']
 st.subheader("Sentiment Score Distribution")
-if sentiment_scores:
-    fig = px.histogram(x=sentiment_scores, nbins=10, title="Sentiment Distribution")
+if sentiment['count']:
+    histogram = data['histogram']
+    histogram = histogram.assign(bin=histogram['lower'].round(2).astype(str) + ' to ' + histogram['upper'].round(2).astype(str))
+    fig = px.bar(histogram, x='bin', y='count', title="Sentiment Distribution")
     st.plotly_chart(fig)
-    st.write(f"Average Sentiment Score: {sum(sentiment_scores) / len(sentiment_scores):.2f}")
+    st.write(f"Average Sentiment Score: {sentiment['mean']:.2f}")
 else:
     st.write("No sentiment data available.")
 
 # Section 3: Reactions Overview
 st.header("3. Reactions Overview")
-reactions = get_reaction_stats(data)
+reactions = data['reactions']
 st.subheader("Reaction Counts")
 st.bar_chart(reactions)
 
 # Section 4: Top Reacted Documents
 st.header("4. Top Reacted Documents")
-top_docs = get_top_documents(data, 'reactions', n=5)
-for idx, doc in enumerate(top_docs, start=1):
-    st.write(f"**#{idx} - {doc.get('newsTitleEn', 'No Title')}**")
-    st.write(f"Total Reactions: {sum(doc.get('reactions', {}).values())}")
+top_docs = data['top_documents']
+for idx, doc in enumerate(top_docs.itertuples(), start=1):
+    st.write(f"**#{idx} - {doc.title or 'No Title'}**")
+    st.write(f"Total Reactions: {doc.rx_total}")
     st.write("---")
 
 # Section 5: Comments Overview
 st.header("5. Comments Overview")
 st.subheader("Top Comments by Sentiment")
-for doc in data[:3]:  # Show 3 examples
+for doc in load_comment_examples(3):  # Show 3 examples
     comments = doc.get('top_comments', [])
     if comments:
         top_comment = max(comments, key=lambda c: c.get('pt_the_senti', {}).get('sentiment_score', 0))
@@ -101,16 +115,10 @@ for doc in data[:3]:  # Show 3 examples
         st.write("---")
 
 # Section 6: Time-Based Trends (if applicable)
-if any(doc.get('publishedAt') for doc in data):
+if not data['daily_counts'].empty:
     st.header("6. Time-Based Trends")
     st.subheader("Publication Timeline")
-    time_data = pd.DataFrame(
-        [doc.get('publishedAt') for doc in data if 'publishedAt' in doc],
-        columns=['Published Date']
-    )
-    time_data['Published Date'] = pd.to_datetime(time_data['Published Date'])
-    time_data['Count'] = 1
-    time_data = time_data.groupby('Published Date').count().reset_index()
+    time_data = data['daily_counts'].rename(columns={'date': 'Published Date', 'count': 'Count'})
     fig = px.line(time_data, x='Published Date', y='Count', title="Publication Trend")
     st.plotly_chart(fig)
 